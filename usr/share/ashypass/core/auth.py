@@ -6,6 +6,7 @@ from typing import Optional, Callable
 from gi.repository import GLib
 
 from core.config import SESSION_TIMEOUT_SECONDS
+from core.secret_buffer import wipe_all
 
 
 class SessionManager:
@@ -27,6 +28,8 @@ class SessionManager:
         """End session and clear authentication"""
         self._authenticated = False
         self._cancel_timeout()
+        # Zero decrypted secrets still held in SecretBuffers
+        wipe_all()
         if self._lock_callback:
             self._lock_callback()
     
@@ -0,0 +1,634 @@
+#!/usr/bin/env python3
+"""Ashy Pass - Backup Backends - Storage targets for database backups"""
+
+import os
+import io
+import json
+import time
+import calendar
+import logging
+import tempfile
+import importlib.util
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Callable, Iterable, Tuple
+
+# Checked without importing; googleapiclient is slow to import and only
+# loaded once a Drive backup actually runs
+GOOGLE_LIBS_AVAILABLE = importlib.util.find_spec('googleapiclient') is not None
+
+from core.config import DATA_DIR
+
+STATE_FILE = DATA_DIR / 'backup_state.json'
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+# Drive accepts at most 100 calls per batch request
+DRIVE_BATCH_LIMIT = 100
+# Resumable upload chunks must be a multiple of 256 KiB
+UPLOAD_CHUNK_UNIT = 256 * 1024
+DEFAULT_UPLOAD_CHUNK_MB = 8
+
+# progress(bytes_done, bytes_total)
+ProgressCallback = Callable[[int, int], None]
+
+# Backend identifiers used in settings.json ("backup_backend")
+BACKEND_DRIVE = 'drive'
+BACKEND_LOCAL = 'local'
+BACKEND_FAKE_DRIVE = 'fake-drive'
+DEFAULT_BACKEND = BACKEND_DRIVE
+
+
+class BackupBackend:
+    """
+    Storage target for backups. Files are addressed by name inside a
+    single backup location; each backend maps names to its own storage.
+    """
+
+    name = ""
+    # Whether the backend needs the signed-in Google account
+    needs_account = False
+
+    def is_available(self) -> bool:
+        """True if the backend can be used right now"""
+        raise NotImplementedError
+
+    def upload_file(self, name: str, source: Path, mimetype: str = 'application/octet-stream',
+                    new: bool = False, progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+        """
+        Create or replace a file; returns backend metadata for it.
+        `new` promises that no file of that name exists yet, which lets
+        backends skip the lookup. `progress` is called as data is sent.
+        """
+        raise NotImplementedError
+
+    def download_file(self, name: str, dest: Path,
+                      progress: Optional[ProgressCallback] = None) -> None:
+        """Write a stored file to dest; `progress` is called as data arrives"""
+        raise NotImplementedError
+
+    def upload_bytes(self, name: str, data: bytes, mimetype: str = 'application/octet-stream',
+                     new: bool = False) -> Dict[str, Any]:
+        """Create or replace a small file from memory"""
+        with tempfile.NamedTemporaryFile(dir=DATA_DIR, prefix='.upload-') as tmp:
+            tmp.write(data)
+            tmp.flush()
+            return self.upload_file(name, Path(tmp.name), mimetype, new=new)
+
+    def download_bytes(self, name: str) -> bytes:
+        """Read a small stored file into memory"""
+        with tempfile.NamedTemporaryFile(dir=DATA_DIR, prefix='.download-') as tmp:
+            self.download_file(name, Path(tmp.name))
+            return Path(tmp.name).read_bytes()
+
+    def list_files(self, prefix: str = '') -> List[Dict[str, Any]]:
+        """
+        List stored files whose name starts with prefix, as dicts with at
+        least 'name', 'size' and 'modified' (last change, epoch seconds)
+        """
+        raise NotImplementedError
+
+    def delete_files(self, names: Iterable[str]) -> None:
+        """Delete stored files, ignoring names that do not exist"""
+        raise NotImplementedError
+
+    def reset(self) -> None:
+        """Forget any cached location state (e.g. after signing out)"""
+
+
+def _parse_drive_time(value: Optional[str]) -> Optional[int]:
+    """Drive's RFC 3339 UTC timestamps ('2024-05-01T12:00:00.000Z') as epoch seconds"""
+    if not value:
+        return None
+    return calendar.timegm(time.strptime(value[:19], '%Y-%m-%dT%H:%M:%S'))
+
+
+class DriveState:
+    """
+    Drive IDs remembered between runs so a backup can go straight to
+    files().update instead of looking the folder and file up again.
+    """
+
+    def __init__(self, path: Optional[Path] = STATE_FILE):
+        self.path = path
+        self.folder_id: Optional[str] = None
+        self.files: Dict[str, Dict[str, Any]] = {}
+        # Open resumable upload sessions: name -> {'uri', 'size'}
+        self.uploads: Dict[str, Dict[str, Any]] = {}
+        self.load()
+
+    def load(self) -> None:
+        """Load state from disk, ignoring a missing or corrupt file"""
+        if not self.path:
+            return
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.folder_id = data.get('folder_id')
+        self.files = data.get('files', {})
+        self.uploads = data.get('uploads', {})
+
+    def save(self) -> None:
+        """Write state atomically"""
+        if not self.path:
+            return
+        data = {
+            'folder_id': self.folder_id,
+            'files': self.files,
+            'uploads': self.uploads,
+        }
+        tmp_path = self.path.with_suffix('.tmp')
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.error(f"Error saving backup state: {e}")
+
+    def file_id(self, name: str) -> Optional[str]:
+        """Cached Drive ID for a file name"""
+        entry = self.files.get(name)
+        return entry.get('id') if entry else None
+
+    def remember(self, name: str, result: Dict[str, Any]) -> None:
+        """Cache the ID and revision returned by Drive"""
+        self.files[name] = {
+            'id': result.get('id'),
+            'revision': result.get('headRevisionId'),
+        }
+
+    def forget(self, name: str) -> None:
+        """Drop a cached file ID"""
+        self.files.pop(name, None)
+
+    def clear(self) -> None:
+        """Forget all cached IDs"""
+        self.folder_id = None
+        self.files = {}
+        self.uploads = {}
+        if self.path and self.path.exists():
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+def _media():
+    """googleapiclient.http, imported on first use"""
+    from googleapiclient import http
+    return http
+
+
+def _http_status(error: Exception) -> Optional[int]:
+    """Status code of a googleapiclient HttpError, without importing it"""
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    return int(status) if status is not None else None
+
+
+def _is_not_found(error: Exception) -> bool:
+    """True if the error is a Drive 404 (file deleted or no longer visible)"""
+    return _http_status(error) == 404
+
+
+def _is_session_gone(error: Exception) -> bool:
+    """True if a resumable upload session has expired on the server"""
+    return _http_status(error) in (404, 410)
+
+
+class DriveBackend(BackupBackend):
+    """Google Drive folder, reached through a googleapiclient Drive v3 service"""
+
+    name = BACKEND_DRIVE
+    needs_account = True
+
+    def __init__(self, get_service: Callable[[], Any],
+                 folder_name: str = "AshyPass Backups",
+                 state: Optional[DriveState] = None,
+                 chunk_size: int = DEFAULT_UPLOAD_CHUNK_MB * 1024 * 1024):
+        self._get_service = get_service
+        self.folder_name = folder_name
+        self.state = state if state is not None else DriveState()
+        # Round to the unit Drive requires, never below one unit
+        self.chunk_size = max(UPLOAD_CHUNK_UNIT, chunk_size - chunk_size % UPLOAD_CHUNK_UNIT)
+
+    @property
+    def service(self):
+        return self._get_service()
+
+    def is_available(self) -> bool:
+        # The account itself is checked by the owner (needs_account); asking
+        # for the service here would build the client just to test it
+        return GOOGLE_LIBS_AVAILABLE
+
+    def reset(self) -> None:
+        self.state.clear()
+
+    def _get_or_create_folder(self) -> str:
+        """Finds or creates the backup folder."""
+        if self.state.folder_id:
+            return self.state.folder_id
+
+        query = f"name = '{self.folder_name}' and mimeType = '{FOLDER_MIME_TYPE}' and trashed = false"
+        results = self.service.files().list(q=query, spaces='drive', fields='files(id, name)').execute()
+        items = results.get('files', [])
+
+        if not items:
+            file_metadata = {
+                'name': self.folder_name,
+                'mimeType': FOLDER_MIME_TYPE
+            }
+            file = self.service.files().create(body=file_metadata, fields='id').execute()
+            self.state.folder_id = file.get('id')
+        else:
+            self.state.folder_id = items[0]['id']
+
+        self.state.save()
+        return self.state.folder_id
+
+    def _find_file(self, folder_id: str, name: str) -> Optional[str]:
+        """Look up a file in the folder by name"""
+        query = f"name = '{name}' and '{folder_id}' in parents and trashed = false"
+        results = self.service.files().list(q=query, spaces='drive', fields='files(id)').execute()
+        items = results.get('files', [])
+        return items[0]['id'] if items else None
+
+    def _resolve_id(self, name: str) -> Optional[str]:
+        """Cached ID for name, falling back to a folder lookup"""
+        file_id = self.state.file_id(name)
+        if file_id:
+            return file_id
+        file_id = self._find_file(self._get_or_create_folder(), name)
+        if file_id:
+            self.state.files[name] = {'id': file_id, 'revision': None}
+        return file_id
+
+    def _upload(self, folder_id: str, name: str, media: Callable[[], Any], new: bool,
+                run: Callable[[Any], Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Upload a file, updating the known copy when possible.
+        A cached file ID is tried first; the folder is only listed when
+        there is no cached ID or Drive no longer knows it.
+        """
+        file_id = self.state.file_id(name)
+        if file_id:
+            try:
+                return run(self.service.files().update(
+                    fileId=file_id,
+                    media_body=media(),
+                    fields='id, headRevisionId'
+                ))
+            except Exception as e:
+                if not _is_not_found(e):
+                    raise
+                logging.info(f"Cached Drive file for {name} is gone, looking it up again.")
+                self.state.forget(name)
+
+        file_id = None if new else self._find_file(folder_id, name)
+        if file_id:
+            return run(self.service.files().update(
+                fileId=file_id,
+                media_body=media(),
+                fields='id, headRevisionId'
+            ))
+
+        file_metadata = {
+            'name': name,
+            'parents': [folder_id]
+        }
+        return run(self.service.files().create(
+            body=file_metadata,
+            media_body=media(),
+            fields='id, headRevisionId'
+        ))
+
+    def _upload_media(self, name: str, media: Callable[[], Any], new: bool,
+                      run: Callable[[Any], Dict[str, Any]] = lambda request: request.execute()) -> Dict[str, Any]:
+        """Upload with folder recovery, then cache the resulting ID"""
+        folder_id = self._get_or_create_folder()
+        try:
+            result = self._upload(folder_id, name, media, new, run)
+        except Exception as e:
+            if not _is_not_found(e):
+                raise
+            # The folder itself was removed; start over from scratch
+            logging.info("Cached backup folder is gone, recreating it.")
+            self.state.clear()
+            result = self._upload(self._get_or_create_folder(), name, media, new, run)
+
+        self.state.remember(name, result)
+        self.state.save()
+        return result
+
+    def _run_resumable(self, name: str, size: int, request: Any,
+                       progress: Optional[ProgressCallback]) -> Dict[str, Any]:
+        """
+        Drive a resumable upload one chunk at a time. The session URI is
+        persisted as soon as Drive hands it out, so an upload interrupted
+        by a crash or restart continues from the last byte Drive stored.
+        """
+        session = self.state.uploads.get(name)
+        if session and session.get('size') == size:
+            logging.info(f"Resuming interrupted upload of {name}")
+            try:
+                response = self._resume_session(session['uri'], request, size, progress)
+            except Exception as e:
+                # Otherwise the session is kept for the next attempt
+                if not _is_session_gone(e):
+                    raise
+                # Sessions expire after about a week; start over
+                logging.info(f"Upload session for {name} expired, restarting")
+                self.state.uploads.pop(name, None)
+                self.state.save()
+            else:
+                self.state.uploads.pop(name, None)
+                if progress:
+                    progress(size, size)
+                return response
+
+        response = None
+        try:
+            while response is None:
+                status, response = request.next_chunk()
+                if request.resumable_uri and self.state.uploads.get(name, {}).get('uri') != request.resumable_uri:
+                    self.state.uploads[name] = {'uri': request.resumable_uri, 'size': size}
+                    self.state.save()
+                if status is not None and progress:
+                    progress(status.resumable_progress, size)
+        except BaseException:
+            # Keep whatever session we reached for the next attempt
+            if request.resumable_uri:
+                self.state.uploads[name] = {'uri': request.resumable_uri, 'size': size}
+                self.state.save()
+            raise
+
+        self.state.uploads.pop(name, None)
+        if progress:
+            progress(size, size)
+        return response
+
+    def _resume_session(self, uri: str, request: Any, size: int,
+                        progress: Optional[ProgressCallback]) -> Dict[str, Any]:
+        """
+        Finish an upload session left by an earlier attempt, speaking the
+        resumable upload protocol directly: an empty PUT asks Drive how
+        many bytes it has committed, then the rest of the request's media
+        is sent from there. Raises HttpError 404/410 if the session expired.
+        """
+        committed, response = self._put_to_session(request.http, uri, f"bytes */{size}")
+        while response is None:
+            if progress:
+                progress(committed, size)
+            data = request.resumable.getbytes(committed, self.chunk_size)
+            committed, response = self._put_to_session(
+                request.http, uri, f"bytes {committed}-{committed + len(data) - 1}/{size}", data)
+        return response
+
+    @staticmethod
+    def _put_to_session(http: Any, uri: str, content_range: str,
+                        data: bytes = b'') -> Tuple[int, Optional[Dict[str, Any]]]:
+        """
+        One PUT to an upload session: (bytes committed, None) while the
+        upload is incomplete, (0, file resource) once it is done
+        """
+        resp, content = http.request(uri, 'PUT', body=data, headers={
+            'Content-Range': content_range,
+            'Content-Length': str(len(data)),
+        })
+        if resp.status in (200, 201):
+            return 0, json.loads(content)
+        if resp.status == 308:
+            # "Range: bytes=0-N" covers what Drive has; no header means nothing yet
+            stored = resp.get('range')
+            return (int(stored.rsplit('-', 1)[1]) + 1 if stored else 0), None
+        from googleapiclient.errors import HttpError
+        raise HttpError(resp, content, uri=uri)
+
+    def upload_file(self, name: str, source: Path, mimetype: str = 'application/octet-stream',
+                    new: bool = False, progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+        size = source.stat().st_size
+        # An unfinished session means the file was being created before
+        new = new and name not in self.state.uploads
+        return self._upload_media(
+            name,
+            lambda: _media().MediaFileUpload(str(source), mimetype=mimetype,
+                                             chunksize=self.chunk_size, resumable=True),
+            new,
+            lambda request: self._run_resumable(name, size, request, progress))
+
+    def upload_bytes(self, name: str, data: bytes, mimetype: str = 'application/octet-stream',
+                     new: bool = False) -> Dict[str, Any]:
+        return self._upload_media(
+            name, lambda: _media().MediaIoBaseUpload(io.BytesIO(data), mimetype=mimetype), new)
+
+    def download_bytes(self, name: str) -> bytes:
+        file_id = self._resolve_id(name)
+        if not file_id:
+            raise FileNotFoundError(name)
+        try:
+            return self.service.files().get_media(fileId=file_id).execute()
+        except Exception as e:
+            if _is_not_found(e):
+                self.state.forget(name)
+                raise FileNotFoundError(name) from e
+            raise
+
+    def download_file(self, name: str, dest: Path,
+                      progress: Optional[ProgressCallback] = None) -> None:
+        file_id = self._resolve_id(name)
+        if not file_id:
+            raise FileNotFoundError(name)
+        request = self.service.files().get_media(fileId=file_id)
+        with open(dest, 'wb') as f:
+            # Ranged requests of chunk_size each keep memory use bounded
+            downloader = _media().MediaIoBaseDownload(f, request, chunksize=self.chunk_size)
+            done = False
+            while not done:
+                status, done = downloader.next_chunk()
+                if progress:
+                    progress(status.resumable_progress, status.total_size or 0)
+
+    def list_files(self, prefix: str = '') -> List[Dict[str, Any]]:
+        folder_id = self._get_or_create_folder()
+        query = f"'{folder_id}' in parents and trashed = false"
+        if prefix:
+            # Drive matches name 'contains' on word prefixes; filtered exactly below
+            query += f" and name contains '{prefix}'"
+        files, page_token = [], None
+        while True:
+            results = self.service.files().list(
+                q=query, spaces='drive', pageToken=page_token,
+                fields='nextPageToken, files(id, name, size, modifiedTime)'
+            ).execute()
+            for item in results.get('files', []):
+                if not item['name'].startswith(prefix):
+                    continue
+                files.append({
+                    'name': item['name'],
+                    'size': int(item.get('size', 0)),
+                    'modified': _parse_drive_time(item.get('modifiedTime')),
+                    'id': item['id'],
+                })
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return files
+
+    def delete_files(self, names: Iterable[str]) -> None:
+        """Delete in batch requests of up to DRIVE_BATCH_LIMIT calls"""
+        names = list(names)
+        if not names:
+            return
+
+        # Resolve every uncached name with a single folder listing
+        if any(not self.state.file_id(name) for name in names):
+            listed = {item['name']: item['id'] for item in self.list_files()}
+            for name in names:
+                if not self.state.file_id(name) and name in listed:
+                    self.state.files[name] = {'id': listed[name], 'revision': None}
+
+        targets = [(name, self.state.file_id(name)) for name in names if self.state.file_id(name)]
+        errors: List[Exception] = []
+
+        def on_response(request_id, response, exception):
+            if exception is not None and not _is_not_found(exception):
+                errors.append(exception)
+
+        for start in range(0, len(targets), DRIVE_BATCH_LIMIT):
+            batch = self.service.new_batch_http_request(callback=on_response)
+            for name, file_id in targets[start:start + DRIVE_BATCH_LIMIT]:
+                batch.add(self.service.files().delete(fileId=file_id), request_id=name)
+            batch.execute()
+
+        for name, _ in targets:
+            self.state.forget(name)
+        self.state.save()
+        if errors:
+            raise errors[0]
+
+
+class LocalDirectoryBackend(BackupBackend):
+    """
+    Plain directory on a local disk or network mount (NFS, SMB).
+    Files are written to a temporary name, fsynced and renamed, so a
+    crash or dropped mount never leaves a half-written backup behind.
+    """
+
+    name = BACKEND_LOCAL
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory).expanduser()
+
+    def is_available(self) -> bool:
+        return self.directory.is_dir() and os.access(self.directory, os.W_OK)
+
+    def _path(self, name: str) -> Path:
+        # Names are flat; refuse anything that would escape the directory
+        if os.path.basename(name) != name or name in ('', '.', '..'):
+            raise ValueError(f"Invalid backup file name: {name}")
+        return self.directory / name
+
+    def _fsync_directory(self) -> None:
+        try:
+            fd = os.open(self.directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def upload_file(self, name: str, source: Path, mimetype: str = 'application/octet-stream',
+                    new: bool = False, progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+        target = self._path(name)
+        tmp_path = target.with_name(f".{name}.tmp")
+        total = source.stat().st_size
+        try:
+            with open(source, 'rb') as src, open(tmp_path, 'wb') as dst:
+                done = 0
+                for block in iter(lambda: src.read(1024 * 1024), b''):
+                    dst.write(block)
+                    done += len(block)
+                    if progress:
+                        progress(done, total)
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.replace(tmp_path, target)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        self._fsync_directory()
+        return {'id': name, 'size': target.stat().st_size}
+
+    def download_file(self, name: str, dest: Path,
+                      progress: Optional[ProgressCallback] = None) -> None:
+        source = self._path(name)
+        total = source.stat().st_size
+        with open(source, 'rb') as src, open(dest, 'wb') as dst:
+            done = 0
+            for block in iter(lambda: src.read(1024 * 1024), b''):
+                dst.write(block)
+                done += len(block)
+                if progress:
+                    progress(done, total)
+
+    def download_bytes(self, name: str) -> bytes:
+        return self._path(name).read_bytes()
+
+    def list_files(self, prefix: str = '') -> List[Dict[str, Any]]:
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.startswith('.') and entry.name.startswith(prefix):
+                    stat = entry.stat()
+                    files.append({
+                        'name': entry.name,
+                        'size': stat.st_size,
+                        'modified': int(stat.st_mtime),
+                        'id': entry.name,
+                    })
+        return files
+
+    def delete_files(self, names: Iterable[str]) -> None:
+        for name in names:
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+
+
+def _upload_chunk_size(value: Any) -> int:
+    """
+    backup_upload_chunk_mb in bytes, rounded to a multiple of
+    UPLOAD_CHUNK_UNIT; the default unless it is a positive number
+    """
+    try:
+        size = float(value) * 1024 * 1024
+        if not size > 0:
+            raise ValueError(value)
+        units = max(1, round(size / UPLOAD_CHUNK_UNIT))
+    except (TypeError, ValueError, OverflowError):
+        logging.warning(f"Invalid backup_upload_chunk_mb {value!r}, using {DEFAULT_UPLOAD_CHUNK_MB}")
+        return DEFAULT_UPLOAD_CHUNK_MB * 1024 * 1024
+    return units * UPLOAD_CHUNK_UNIT
+
+
+def create_backend(settings: Dict[str, Any], get_drive_service: Callable[[], Any]) -> BackupBackend:
+    """Build the backend selected in settings.json"""
+    kind = settings.get('backup_backend', DEFAULT_BACKEND)
+
+    if kind == BACKEND_LOCAL:
+        directory = settings.get('backup_local_dir') or str(DATA_DIR / 'backups')
+        return LocalDirectoryBackend(Path(directory))
+
+    chunk_size = _upload_chunk_size(settings.get('backup_upload_chunk_mb', DEFAULT_UPLOAD_CHUNK_MB))
+
+    if kind == BACKEND_FAKE_DRIVE:
+        from core.fake_drive import FakeDriveBackend
+        return FakeDriveBackend(chunk_size=chunk_size)
+
+    if kind != BACKEND_DRIVE:
+        logging.warning(f"Unknown backup backend '{kind}', using Google Drive")
+    return DriveBackend(get_drive_service, chunk_size=chunk_size)
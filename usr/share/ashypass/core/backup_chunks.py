@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Ashy Pass - Backup Chunks - Content-defined chunking and deduplication
+Snapshots are split at content-defined boundaries, so an edit only
+changes the chunks around the modified pages. Chunks are stored once,
+named by their SHA-256, and shared between generations.
+"""
+
+import re
+import time
+import zlib
+import random
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Set, Iterator, BinaryIO, Iterable, Callable
+
+from core.backup_backends import BackupBackend, ProgressCallback
+
+CHUNK_PREFIX = 'chunk-'
+
+# Unreferenced chunks younger than this are left alone: another device
+# sharing the target may be uploading them for a generation whose chunk
+# list is not stored yet.
+CHUNK_GRACE_PERIOD = 24 * 3600
+
+# Boundary statistics: ~256 KiB average, never below 64 KiB or above 1 MiB
+CHUNK_MIN_SIZE = 64 * 1024
+CHUNK_MAX_SIZE = 1024 * 1024
+SEGMENT_SIZE = 4 * 1024 * 1024
+
+# Boundary hash: byte j is the XOR of WINDOW random byte permutations
+# applied to the WINDOW bytes ending at j. A cut is made after every
+# match of BOUNDARY_PATTERN in that stream (probability 2^-18 per byte).
+# Changing the seed, window or pattern changes every boundary and
+# defeats deduplication against existing backups.
+WINDOW = 8
+BOUNDARY_SEED = 0x41534859
+BOUNDARY_PATTERN = re.compile(b'\x00\x00[\x00-\x3f]')
+
+
+def _boundary_tables() -> List[bytes]:
+    rng = random.Random(BOUNDARY_SEED)
+    tables = []
+    for _ in range(WINDOW):
+        permutation = list(range(256))
+        rng.shuffle(permutation)
+        tables.append(bytes(permutation))
+    return tables
+
+
+_TABLES = _boundary_tables()
+
+
+def _cut_candidates(data: bytes) -> List[int]:
+    """
+    Offsets after which a chunk may end. The window hash is computed
+    with big-integer XOR/shift so the per-byte work stays in C.
+    """
+    n = len(data)
+    if n < WINDOW:
+        return []
+    acc = 0
+    for k, table in enumerate(_TABLES):
+        acc ^= int.from_bytes(data.translate(table), 'little') << (8 * k)
+    stream = (acc & ((1 << (8 * n)) - 1)).to_bytes(n, 'little')
+    # Bytes before WINDOW - 1 do not have a full window yet
+    return [m.end() for m in BOUNDARY_PATTERN.finditer(stream, WINDOW - 1)]
+
+
+def iter_chunks(stream: BinaryIO, min_size: int = CHUNK_MIN_SIZE,
+                max_size: int = CHUNK_MAX_SIZE) -> Iterator[bytes]:
+    """Split a binary stream into content-defined chunks"""
+    pending = b''
+    while True:
+        data = stream.read(SEGMENT_SIZE)
+        eof = not data
+        pending += data
+
+        cuts = _cut_candidates(pending)
+        start, index = 0, 0
+        while True:
+            # First candidate far enough from the chunk start
+            while index < len(cuts) and cuts[index] < start + min_size:
+                index += 1
+            if index < len(cuts) and cuts[index] - start <= max_size:
+                end = cuts[index]
+            elif len(pending) - start >= max_size:
+                end = start + max_size
+            else:
+                break
+            yield pending[start:end]
+            start = end
+
+        pending = pending[start:]
+        if eof:
+            if pending:
+                yield pending
+            return
+
+
+def chunk_name(digest: str) -> str:
+    """Backend file name of a chunk"""
+    return f"{CHUNK_PREFIX}{digest}"
+
+
+class ChunkStore:
+    """
+    Content-addressed chunk storage on top of a backup backend. The set
+    of chunks already present is learned from one listing per backup, so
+    unchanged chunks cost no requests at all. It is not kept between
+    backups: another device sharing the target may have deleted chunks.
+    """
+
+    def __init__(self, backend: BackupBackend, grace_period: int = CHUNK_GRACE_PERIOD):
+        self.backend = backend
+        self.grace_period = grace_period
+        self._known: Optional[Set[str]] = None
+        self._lock = threading.Lock()
+
+    def _list_chunks(self) -> Dict[str, Optional[int]]:
+        """Stored chunks by digest, with their last modification time"""
+        return {
+            item['name'][len(CHUNK_PREFIX):]: item.get('modified')
+            for item in self.backend.list_files(CHUNK_PREFIX)
+        }
+
+    def _known_chunks(self) -> Set[str]:
+        if self._known is None:
+            self._known = set(self._list_chunks())
+        return self._known
+
+    def invalidate(self) -> None:
+        """Forget which chunks exist (after switching backend or account)"""
+        with self._lock:
+            self._known = None
+
+    def put(self, snapshot: Path,
+            publish: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """
+        Store a snapshot, uploading only chunks the backend lacks.
+        Returns the chunk manifest describing how to reassemble it.
+
+        publish(manifest) is called once the snapshot is chunked but
+        before the backend is listed: a chunk list stored there is what
+        keeps another device's collect_garbage() from deleting chunks
+        this snapshot reuses.
+        """
+        chunks: List[List[Any]] = []
+        offsets: List[int] = []
+        whole = hashlib.sha256()
+        size = uploaded = uploaded_bytes = 0
+
+        with open(snapshot, 'rb') as f:
+            for chunk in iter_chunks(f):
+                chunks.append([hashlib.sha256(chunk).hexdigest(), len(chunk)])
+                offsets.append(size)
+                whole.update(chunk)
+                size += len(chunk)
+        manifest = {
+            'version': 1,
+            'size': size,
+            'sha256': whole.hexdigest(),
+            'chunks': chunks,
+        }
+        if publish:
+            publish(manifest)
+
+        with self._lock:
+            self._known = None
+            known = self._known_chunks()
+            with open(snapshot, 'rb') as f:
+                for (digest, length), offset in zip(chunks, offsets):
+                    if digest in known:
+                        continue
+                    f.seek(offset)
+                    chunk = f.read(length)
+                    if hashlib.sha256(chunk).hexdigest() != digest:
+                        raise ValueError("Snapshot changed while it was being backed up")
+                    payload = zlib.compress(chunk, 6)
+                    self.backend.upload_bytes(chunk_name(digest), payload, new=True)
+                    known.add(digest)
+                    uploaded += 1
+                    uploaded_bytes += len(payload)
+
+        logging.info(f"Incremental backup: {uploaded}/{len(chunks)} chunks uploaded "
+                     f"({uploaded_bytes} bytes)")
+        return manifest
+
+    def iter_content(self, manifest: Dict[str, Any]) -> Iterator[bytes]:
+        """Stream a snapshot back one verified chunk at a time"""
+        for digest, size in manifest['chunks']:
+            data = zlib.decompress(self.backend.download_bytes(chunk_name(digest)))
+            if len(data) != size or hashlib.sha256(data).hexdigest() != digest:
+                raise ValueError(f"Backup chunk {digest[:12]} is corrupt")
+            yield data
+
+    def restore(self, manifest: Dict[str, Any], dest: Path,
+                progress: Optional[ProgressCallback] = None) -> None:
+        """Reassemble a snapshot into dest"""
+        whole = hashlib.sha256()
+        done = 0
+        with open(dest, 'wb') as f:
+            for data in self.iter_content(manifest):
+                whole.update(data)
+                f.write(data)
+                done += len(data)
+                if progress:
+                    progress(done, manifest['size'])
+        if whole.hexdigest() != manifest['sha256']:
+            raise ValueError("Reassembled backup does not match its checksum")
+
+    def collect_garbage(self, referenced: Callable[[], Iterable[str]],
+                        now: Optional[float] = None) -> int:
+        """
+        Delete chunks no generation refers to and that were last written
+        more than grace_period ago; returns how many. referenced() is
+        only asked after the chunks are listed, so a snapshot published
+        in between keeps the chunks it reuses.
+        """
+        with self._lock:
+            self._known = None
+            stored = self._list_chunks()
+            self._known = set(stored)
+            cutoff = (time.time() if now is None else now) - self.grace_period
+            referenced = set(referenced())
+            orphans = {
+                digest for digest, modified in stored.items()
+                if digest not in referenced and modified is not None and modified <= cutoff
+            }
+            if orphans:
+                self.backend.delete_files(chunk_name(d) for d in orphans)
+                self._known.difference_update(orphans)
+        return len(orphans)
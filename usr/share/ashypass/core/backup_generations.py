@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""Ashy Pass - Backup Generations - Timestamped backups with retention"""
+
+import os
+import json
+import time
+import calendar
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Set
+
+from core.config import DATA_DIR
+from core.backup_backends import BackupBackend, ProgressCallback
+from core.backup_chunks import ChunkStore
+
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+GENERATION_PREFIX = 'ashypass-'
+GENERATION_SUFFIX = '.db'
+CHUNKED_SUFFIX = '.chunks'
+
+# Generation storage modes
+MODE_FULL = 'full'
+MODE_CHUNKED = 'chunked'
+TIMESTAMP_FORMAT = '%Y%m%dT%H%M%SZ'
+
+# A full upload interrupted by a restart is resumed from these
+PENDING_FILE = DATA_DIR / 'backup_pending.json'
+PENDING_SNAPSHOT = DATA_DIR / 'backup_pending.db'
+
+
+@dataclass
+class RetentionPolicy:
+    """How many generations to keep per time bucket"""
+    hourly: int = 24
+    daily: int = 30
+    monthly: int = 12
+
+    @classmethod
+    def from_settings(cls, settings: Dict[str, Any]) -> 'RetentionPolicy':
+        """Read backup_keep_* keys from settings.json"""
+        return cls(
+            hourly=int(settings.get('backup_keep_hourly', cls.hourly)),
+            daily=int(settings.get('backup_keep_daily', cls.daily)),
+            monthly=int(settings.get('backup_keep_monthly', cls.monthly)),
+        )
+
+
+def _bucket_keys(created: int):
+    """Hour, day and month bucket of a UTC timestamp"""
+    t = time.gmtime(created)
+    return (
+        (t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour),
+        (t.tm_year, t.tm_mon, t.tm_mday),
+        (t.tm_year, t.tm_mon),
+    )
+
+
+def select_generations(generations: List[Dict[str, Any]], policy: RetentionPolicy,
+                       now: Optional[int] = None) -> Set[str]:
+    """
+    Names of the generations to keep: the newest one in each of the last
+    `hourly` hours, `daily` days and `monthly` months, plus the newest
+    generation overall so a long pause never empties the folder.
+    """
+    if not generations:
+        return set()
+    now = int(now if now is not None else time.time())
+    newest_first = sorted(generations, key=lambda g: g['created'], reverse=True)
+
+    windows = (
+        (0, policy.hourly, policy.hourly * 3600),
+        (1, policy.daily, policy.daily * 86400),
+        (2, policy.monthly, policy.monthly * 31 * 86400),
+    )
+
+    keep = {newest_first[0]['name']}
+    for index, count, max_age in windows:
+        seen = set()
+        for generation in newest_first:
+            if len(seen) >= count or now - generation['created'] >= max_age:
+                break
+            bucket = _bucket_keys(generation['created'])[index]
+            if bucket not in seen:
+                seen.add(bucket)
+                keep.add(generation['name'])
+    return keep
+
+
+def _parse_generation_name(name: str) -> Optional[int]:
+    """Creation time encoded in a generation file name"""
+    if not name.startswith(GENERATION_PREFIX):
+        return None
+    if name.endswith(GENERATION_SUFFIX):
+        stamp = name[len(GENERATION_PREFIX):-len(GENERATION_SUFFIX)]
+    elif name.endswith(CHUNKED_SUFFIX):
+        stamp = name[len(GENERATION_PREFIX):-len(CHUNKED_SUFFIX)]
+    else:
+        return None
+    stamp = stamp.split('-')[0]
+    try:
+        return calendar.timegm(time.strptime(stamp, TIMESTAMP_FORMAT))
+    except ValueError:
+        return None
+
+
+class GenerationStore:
+    """
+    Keeps timestamped database snapshots in a backend, plus a manifest
+    listing them so restore never has to list the whole folder.
+    In incremental mode a generation is a small chunk manifest and the
+    data lives in deduplicated chunks shared with other generations.
+    Synced devices share one backup target, so the manifest is never
+    cached: it is read again and merged right before every save.
+    """
+
+    def __init__(self, backend: BackupBackend, policy: Optional[RetentionPolicy] = None,
+                 incremental: bool = False, pending_path: Path = PENDING_FILE,
+                 pending_snapshot: Path = PENDING_SNAPSHOT):
+        self.backend = backend
+        self.pending_path = pending_path
+        self.pending_snapshot = pending_snapshot
+        self.policy = policy or RetentionPolicy()
+        self.incremental = incremental
+        self.chunks = ChunkStore(backend)
+        self._chunk_manifests: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    # --- Manifest ---
+
+    def _load_manifest(self) -> Dict[str, Any]:
+        """Download the current manifest, rebuilding it if missing"""
+        try:
+            manifest = json.loads(self.backend.download_bytes(MANIFEST_NAME))
+            if manifest.get('version') != MANIFEST_VERSION:
+                raise ValueError(f"Unsupported manifest version {manifest.get('version')}")
+        except FileNotFoundError:
+            manifest = self._rebuild_manifest()
+        except ValueError as e:
+            logging.warning(f"Backup manifest unreadable ({e}), rebuilding it")
+            manifest = self._rebuild_manifest()
+        return manifest
+
+    def _rebuild_manifest(self) -> Dict[str, Any]:
+        """Recover generation entries from a folder listing"""
+        generations = []
+        for item in self.backend.list_files():
+            created = _parse_generation_name(item['name'])
+            if created is not None:
+                chunked = item['name'].endswith(CHUNKED_SUFFIX)
+                generations.append({
+                    'name': item['name'],
+                    'created': created,
+                    'size': None if chunked else item.get('size', 0),
+                    'sha256': None,
+                    'mode': MODE_CHUNKED if chunked else MODE_FULL,
+                })
+        generations.sort(key=lambda g: g['created'])
+        return {'version': MANIFEST_VERSION, 'generations': generations}
+
+    def _save_manifest(self, manifest: Dict[str, Any]) -> None:
+        """Upload the manifest"""
+        data = json.dumps(manifest, indent=1).encode()
+        self.backend.upload_bytes(MANIFEST_NAME, data, 'application/json')
+
+    def invalidate(self) -> None:
+        """Drop cached chunk lists (after switching backend or account)"""
+        with self._lock:
+            self._chunk_manifests = {}
+        self.chunks.invalidate()
+
+    def _chunk_manifest(self, name: str) -> Dict[str, Any]:
+        """Chunk list of a chunked generation (immutable, so cached)"""
+        if name not in self._chunk_manifests:
+            self._chunk_manifests[name] = json.loads(self.backend.download_bytes(name))
+        return self._chunk_manifests[name]
+
+    # --- Public API ---
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Generations, newest first"""
+        with self._lock:
+            generations = list(self._load_manifest()['generations'])
+        return sorted(generations, key=lambda g: g['created'], reverse=True)
+
+    def add(self, snapshot: Path, created: Optional[int] = None,
+            progress: Optional[ProgressCallback] = None, source_mtime: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Upload a snapshot as a new generation, then prune old ones.
+        Full snapshots are kept until uploaded so an interrupted upload
+        can be resumed with resume_pending(); chunked ones need no such
+        care because chunks already stored are never sent again.
+        """
+        created = int(created if created is not None else time.time())
+
+        with self._lock:
+            manifest = self._load_manifest()
+            existing = {g['name'] for g in manifest['generations']}
+
+            suffix = CHUNKED_SUFFIX if self.incremental else GENERATION_SUFFIX
+            stamp = time.strftime(TIMESTAMP_FORMAT, time.gmtime(created))
+            name = f"{GENERATION_PREFIX}{stamp}{suffix}"
+            counter = 1
+            while name in existing:
+                name = f"{GENERATION_PREFIX}{stamp}-{counter}{suffix}"
+                counter += 1
+
+            if self.incremental:
+                # The chunk list goes up before the chunks it reuses are
+                # looked up, so pruning on other devices keeps them
+                def publish(chunk_manifest: Dict[str, Any]) -> None:
+                    self.backend.upload_bytes(name, json.dumps(chunk_manifest).encode(),
+                                              'application/json', new=True)
+                chunk_manifest = self.chunks.put(snapshot, publish)
+                self._chunk_manifests[name] = chunk_manifest
+                generation = {
+                    'name': name,
+                    'created': created,
+                    'size': chunk_manifest['size'],
+                    'sha256': chunk_manifest['sha256'],
+                    'mode': MODE_CHUNKED,
+                }
+            else:
+                os.replace(snapshot, self.pending_snapshot)
+                generation = {
+                    'name': name,
+                    'created': created,
+                    'size': self.pending_snapshot.stat().st_size,
+                    'sha256': _file_sha256(self.pending_snapshot),
+                    'mode': MODE_FULL,
+                }
+                self._save_pending(dict(generation, source_mtime=source_mtime))
+                self.backend.upload_file(name, self.pending_snapshot, 'application/x-sqlite3',
+                                         new=True, progress=progress)
+
+            self._commit(generation)
+
+        return generation
+
+    def resume_pending(self, progress: Optional[ProgressCallback] = None) -> Optional[Dict[str, Any]]:
+        """
+        Finish a full upload interrupted by a crash or restart, reusing
+        the same name and snapshot so the backend can pick up its upload
+        session. Returns the pending record once uploaded, else None.
+        """
+        with self._lock:
+            pending = self._load_pending()
+            if pending is None:
+                return None
+            if not self.pending_snapshot.exists() or \
+                    self.pending_snapshot.stat().st_size != pending['size']:
+                self.discard_pending()
+                return None
+
+            logging.info(f"Resuming pending backup {pending['name']}")
+            self.backend.upload_file(pending['name'], self.pending_snapshot,
+                                     'application/x-sqlite3', new=True, progress=progress)
+            generation = {key: pending[key] for key in ('name', 'created', 'size', 'sha256', 'mode')}
+            self._commit(generation)
+            return pending
+
+    def discard_pending(self) -> None:
+        """Forget an unfinished upload (after switching backend or account)"""
+        self._clear_pending()
+
+    def _commit(self, generation: Dict[str, Any]) -> None:
+        """
+        Record an uploaded generation in the manifest and prune. The
+        manifest is read just before saving, so generations other devices
+        added meanwhile are kept and the ones they pruned stay gone.
+        """
+        manifest = self._load_manifest()
+        generations = [g for g in manifest['generations'] if g['name'] != generation['name']]
+        generations.append(generation)
+
+        # The manifest must stop referencing a generation before it is deleted
+        keep = select_generations(generations, self.policy, now=generation['created'])
+        expired = [g for g in generations if g['name'] not in keep]
+        manifest['generations'] = [g for g in generations if g['name'] in keep]
+        self._save_manifest(manifest)
+        self._clear_pending()
+
+        if expired:
+            self._prune(expired, {g['name'] for g in manifest['generations']})
+
+    # --- Pending upload ---
+
+    def _load_pending(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.pending_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"Discarding unreadable pending backup record: {e}")
+            return None
+
+    def _save_pending(self, pending: Dict[str, Any]) -> None:
+        tmp_path = self.pending_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(pending, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.pending_path)
+
+    def _clear_pending(self) -> None:
+        for path in (self.pending_path, self.pending_snapshot):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _prune(self, expired: List[Dict[str, Any]], recorded: Set[str]) -> None:
+        """Delete expired generations and chunks no longer referenced"""
+        try:
+            self.backend.delete_files(g['name'] for g in expired)
+            for generation in expired:
+                self._chunk_manifests.pop(generation['name'], None)
+            logging.info(f"Pruned {len(expired)} old backup generations")
+
+            if any(g.get('mode') == MODE_CHUNKED for g in expired):
+                removed = self.chunks.collect_garbage(lambda: self._referenced_chunks(recorded))
+                logging.info(f"Removed {removed} unreferenced backup chunks")
+        except Exception as e:
+            # Orphans are harmless; they are no longer in the manifest
+            logging.warning(f"Pruning old backups failed: {e}")
+
+    def _referenced_chunks(self, recorded: Set[str]) -> Set[str]:
+        """
+        Chunks used by any stored chunk list, including those of
+        generations another device is still uploading. Unrecorded lists
+        past the grace period were left by an interrupted backup and
+        are deleted instead.
+        """
+        referenced, stale = set(), []
+        cutoff = time.time() - self.chunks.grace_period
+        for item in self.backend.list_files(GENERATION_PREFIX):
+            if not item['name'].endswith(CHUNKED_SUFFIX):
+                continue
+            if item['name'] not in recorded and item.get('modified') is not None \
+                    and item['modified'] <= cutoff:
+                stale.append(item['name'])
+                continue
+            referenced.update(d for d, _ in self._chunk_manifest(item['name'])['chunks'])
+        if stale:
+            self.backend.delete_files(stale)
+            for name in stale:
+                self._chunk_manifests.pop(name, None)
+        return referenced
+
+    def restore(self, generation: Dict[str, Any], dest: Path,
+                progress: Optional[ProgressCallback] = None) -> None:
+        """Write a generation's database file to dest, verifying its checksum"""
+        if generation.get('mode') == MODE_CHUNKED:
+            self.chunks.restore(self._chunk_manifest(generation['name']), dest, progress)
+            return
+
+        self.backend.download_file(generation['name'], dest, progress)
+        if generation.get('sha256') and _file_sha256(dest) != generation['sha256']:
+            raise ValueError("Downloaded backup does not match its checksum")
+
+
+def _file_sha256(path: Path) -> str:
+    """SHA-256 of a file, read in 1 MiB blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""Ashy Pass - Backup Queue - Durable backup jobs with retry and backoff"""
+
+import os
+import json
+import time
+import random
+import socket
+import logging
+import threading
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Callable
+
+from core.config import DATA_DIR
+
+QUEUE_FILE = DATA_DIR / 'backup_queue.json'
+
+# Backoff settings (seconds)
+BACKOFF_BASE = 2
+BACKOFF_MAX = 15 * 60
+MAX_ATTEMPTS = 20
+
+# HTTP statuses Drive documents as transient
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+
+
+def _http_status(error: Exception) -> Optional[int]:
+    """Status code of a googleapiclient HttpError, if that is what this is"""
+    resp = getattr(error, 'resp', None)
+    status = getattr(resp, 'status', None)
+    return int(status) if status is not None else None
+
+
+def is_retryable(error: Exception) -> bool:
+    """Decide whether a failed backup is worth trying again later"""
+    status = _http_status(error)
+    if status is not None:
+        if status in RETRYABLE_STATUSES:
+            return True
+        # Drive reports per-user rate limiting as 403
+        if status == 403:
+            return any(reason in str(error) for reason in RATE_LIMIT_REASONS)
+        return False
+
+    # Local targets: a bad directory setting will not fix itself
+    if isinstance(error, (PermissionError, ValueError)):
+        return False
+    # No HTTP response at all: offline, DNS failure, dropped connection
+    if isinstance(error, (OSError, socket.timeout, ConnectionError, TimeoutError)):
+        return True
+    # httplib2 and google-auth transport errors do not share a base class
+    return type(error).__name__ in ('ServerNotFoundError', 'TransportError', 'RedirectMissingLocation')
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Honour a Retry-After header on 429/503 responses"""
+    resp = getattr(error, 'resp', None)
+    if resp is None:
+        return None
+    try:
+        value = resp.get('retry-after')
+        return float(value) if value is not None else None
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempts: int) -> float:
+    """Exponential backoff with full jitter"""
+    ceiling = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** max(0, attempts - 1)))
+    return random.uniform(BACKOFF_BASE / 2, ceiling)
+
+
+class BackupQueue:
+    """
+    Backup jobs persisted under DATA_DIR and drained by a single worker.
+    Jobs survive restarts, so a backup requested while offline is sent
+    once connectivity returns.
+    """
+
+    def __init__(self, run_job: Callable[[Dict[str, Any]], None],
+                 can_run: Callable[[], bool] = lambda: True,
+                 path: Path = QUEUE_FILE):
+        self.path = path
+        self._run_job = run_job
+        self._can_run = can_run
+        self._cond = threading.Condition()
+        self._jobs: List[Dict[str, Any]] = []
+        self._running: Optional[Dict[str, Any]] = None
+        self.last_success: Optional[int] = None
+        self.last_error: Optional[str] = None
+        self._listeners: List[Callable[[], None]] = []
+        self._worker: Optional[threading.Thread] = None
+        self._stopped = False
+        self._load()
+
+    # --- Persistence ---
+
+    def _load(self) -> None:
+        """Load pending jobs from disk"""
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._jobs = data.get('jobs', [])
+        self.last_success = data.get('last_success')
+        self.last_error = data.get('last_error')
+
+    def _save(self) -> None:
+        """Write queue atomically (caller holds the lock)"""
+        data = {
+            'jobs': self._jobs,
+            'last_success': self.last_success,
+            'last_error': self.last_error,
+        }
+        tmp_path = self.path.with_suffix('.tmp')
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.error(f"Error saving backup queue: {e}")
+
+    # --- Listeners ---
+
+    def add_listener(self, callback: Callable[[], None]) -> None:
+        """Called (from any thread) whenever depth or status changes"""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[], None]) -> None:
+        """Stop notifying a listener"""
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def _notify(self) -> None:
+        """Notify all listeners of a change"""
+        for callback in list(self._listeners):
+            try:
+                callback()
+            except Exception as e:
+                logging.error(f"Error in backup queue listener: {e}")
+
+    # --- Public API ---
+
+    def start(self) -> None:
+        """Start the worker thread (idempotent)"""
+        with self._cond:
+            if self._worker and self._worker.is_alive():
+                return
+            self._stopped = False
+            self._worker = threading.Thread(target=self._work, name="backup-queue", daemon=True)
+            self._worker.start()
+
+    def stop(self) -> None:
+        """Ask the worker to exit after the current job"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def enqueue(self, kind: str = 'backup') -> None:
+        """
+        Add a job. Whole-database backups always upload the current file,
+        so a pending job of the same kind absorbs the new request.
+        """
+        with self._cond:
+            pending = [job for job in self._jobs if job['kind'] == kind and job is not self._running]
+            if pending:
+                # Someone wants it now; skip the remaining backoff
+                pending[0]['next_attempt'] = 0
+            else:
+                self._jobs.append({
+                    'id': f"{int(time.time() * 1000)}-{random.randrange(1 << 16):04x}",
+                    'kind': kind,
+                    'created_at': int(time.time()),
+                    'attempts': 0,
+                    'next_attempt': 0,
+                })
+            self._save()
+            self._cond.notify_all()
+        self.start()
+        self._notify()
+
+    def wake(self) -> None:
+        """Retry waiting jobs now, e.g. when the network comes back"""
+        with self._cond:
+            for job in self._jobs:
+                job['next_attempt'] = 0
+            self._cond.notify_all()
+
+    def clear(self) -> None:
+        """Drop all pending jobs"""
+        with self._cond:
+            self._jobs = [job for job in self._jobs if job is self._running]
+            self._save()
+        self._notify()
+
+    def depth(self) -> int:
+        """Number of jobs not yet completed"""
+        with self._cond:
+            return len(self._jobs)
+
+    def is_busy(self) -> bool:
+        """True while a job is being executed"""
+        return self._running is not None
+
+    def running_kind(self) -> Optional[str]:
+        """Kind of the job being executed, or None"""
+        running = self._running
+        return running['kind'] if running else None
+
+    # --- Worker ---
+
+    def _next_job(self) -> Optional[Dict[str, Any]]:
+        """Block until a job is due (caller holds the lock)"""
+        while not self._stopped:
+            if self._jobs and self._can_run():
+                job = min(self._jobs, key=lambda j: j['next_attempt'])
+                delay = job['next_attempt'] - time.time()
+                if delay <= 0:
+                    return job
+                self._cond.wait(timeout=delay)
+            else:
+                # Nothing to do, or signed out: wait to be woken
+                self._cond.wait(timeout=60)
+        return None
+
+    def _work(self) -> None:
+        """Worker loop: run due jobs one at a time, rescheduling failures"""
+        while True:
+            with self._cond:
+                job = self._next_job()
+                if job is None:
+                    return
+                self._running = job
+            self._notify()
+
+            error: Optional[Exception] = None
+            try:
+                self._run_job(job)
+            except Exception as e:
+                error = e
+
+            with self._cond:
+                self._running = None
+                if error is None:
+                    self._jobs.remove(job)
+                    self.last_success = int(time.time())
+                    self.last_error = None
+                else:
+                    job['attempts'] += 1
+                    self.last_error = str(error)
+                    if is_retryable(error) and job['attempts'] < MAX_ATTEMPTS:
+                        delay = retry_after(error) or backoff_delay(job['attempts'])
+                        job['next_attempt'] = time.time() + delay
+                        logging.warning(f"Backup failed, retrying in {delay:.0f}s: {error}")
+                    else:
+                        self._jobs.remove(job)
+                        logging.error(f"Backup failed permanently: {error}")
+                self._save()
+            self._notify()
@@ -1,21 +1,23 @@
 import os.path
+import json
+import time
 import pickle
+import sqlite3
 import logging
+import tempfile
 import threading
-from typing import Optional, Dict, Any
+import importlib.util
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List, Callable
 from pathlib import Path
 
-# Google API Client imports
-try:
-    from google_auth_oauthlib.flow import InstalledAppFlow
-    from google.auth.transport.requests import Request
-    from googleapiclient.discovery import build
-    from googleapiclient.http import MediaFileUpload
-    GOOGLE_LIBS_AVAILABLE = True
-except ImportError:
-    GOOGLE_LIBS_AVAILABLE = False
-
-from core.config import DATA_DIR, DATABASE_PATH
+from core.config import DATA_DIR, DATABASE_PATH, load_settings, save_settings
+from core.database import Database
+from core.backup_queue import BackupQueue
+from core.backup_backends import BackupBackend, create_backend
+from core.backup_generations import GenerationStore, RetentionPolicy
+from core.sync import SyncEngine
 from core.client_secrets import GOOGLE_CLIENT_CONFIG
 
 SCOPES = [
@@ -24,59 +26,283 @@ SCOPES = [
     'https://www.googleapis.com/auth/userinfo.email'
 ]
 TOKEN_FILE = DATA_DIR / 'token.pickle'
+# The Google client libraries take hundreds of milliseconds to import, so
+# they are only checked for here and imported when first needed
+GOOGLE_LIBS_AVAILABLE = all(importlib.util.find_spec(name) is not None
+                            for name in ('googleapiclient', 'google_auth_oauthlib'))
+# Refresh access tokens this long before they expire
+TOKEN_REFRESH_MARGIN = 300
+TOKEN_RETRY_SECONDS = 60
+# Account email/name shown in settings, refreshed in the background
+PROFILE_FILE = DATA_DIR / 'account_profile.json'
+PROFILE_TTL_SECONDS = 24 * 3600
+
+
+@dataclass
+class StagedRestore:
+    """A downloaded and checked backup waiting to replace the vault"""
+    path: Path
+    name: str
+    # Unconnected Database holding the backup's unlocked key
+    unlocked: Optional[Database] = None
+
 
 class BackupService:
     """
-    Manages Google Drive backups and authentication.
-    Uses embedded client configuration.
+    Manages database backups and Google authentication.
+    Uploads go through the backend selected in settings (Google Drive by
+    default); the Google account is only needed for the Drive backend.
     """
     
     def __init__(self):
         self.creds = None
-        self.service = None
-        self.user_info_service = None
-        self.folder_id: Optional[str] = None
-        self.folder_name = "AshyPass Backups"
-        self._is_backing_up = False
+        self._service = None
+        self._user_info_service = None
+        self._creds_lock = threading.RLock()
+        self._refresh_timer: Optional[threading.Timer] = None
+        self._account_listeners: List[Callable[[], None]] = []
+        self._profile: Optional[Dict[str, Any]] = self._load_profile()
+        self._profile_refreshing = False
+        self._profile_attempted = 0.0
+        self._backup_lock = threading.Lock()
+        # Held while the vault file is copied or replaced
+        self._file_lock = threading.Lock()
+        self._progress_listeners: List[Callable[[int, int], None]] = []
+        self._sync_listeners: List[Callable[[int], None]] = []
+        settings = load_settings()
+        self.backend: BackupBackend = create_backend(settings, lambda: self.service)
+        self.generations = self._create_generation_store(settings)
+        self.sync_enabled = bool(settings.get('sync_enabled', False))
+        self.sync_engine: Optional[SyncEngine] = None
+
+        # Pending backups from a previous run are drained once the backend is ready
+        self.queue = BackupQueue(self._run_backup_job, can_run=self.is_ready)
+        if self.queue.depth():
+            self.queue.start()
         
-        # Attempt to load existing token on startup
+        # Loading and refreshing the token may hit the network; keep it off the startup path
         if GOOGLE_LIBS_AVAILABLE and TOKEN_FILE.exists():
-             self._load_token()
+            thread = threading.Thread(target=self._load_token, daemon=True)
+            thread.start()
+
+    @property
+    def service(self):
+        """Drive API client, built on first use"""
+        with self._creds_lock:
+            if self._service is None and self.creds is not None:
+                from googleapiclient.discovery import build
+                self._service = build('drive', 'v3', credentials=self.creds)
+            return self._service
+
+    @property
+    def user_info_service(self):
+        """OAuth2 user info client, built on first use"""
+        with self._creds_lock:
+            if self._user_info_service is None and self.creds is not None:
+                from googleapiclient.discovery import build
+                self._user_info_service = build('oauth2', 'v2', credentials=self.creds)
+            return self._user_info_service
+
+    def _set_credentials(self, creds) -> None:
+        """Replace the credentials and drop clients bound to the old ones"""
+        with self._creds_lock:
+            self.creds = creds
+            self._service = None
+            self._user_info_service = None
+            if self._refresh_timer:
+                self._refresh_timer.cancel()
+                self._refresh_timer = None
 
     def _load_token(self) -> bool:
-        """Load token from file and refresh if necessary"""
+        """Load token from file and refresh if necessary (background thread)"""
         try:
             with open(TOKEN_FILE, 'rb') as token:
-                self.creds = pickle.load(token)
-            
-            if self.creds and self.creds.expired and self.creds.refresh_token:
-                self.creds.refresh(Request())
-                # Save refreshed token
-                with open(TOKEN_FILE, 'wb') as token:
-                    pickle.dump(self.creds, token)
-            
-            if self.creds and self.creds.valid:
-                self.service = build('drive', 'v3', credentials=self.creds)
-                self.user_info_service = build('oauth2', 'v2', credentials=self.creds)
-                return True
+                self._set_credentials(pickle.load(token))
+            self._refresh_credentials()
         except Exception as e:
             logging.error(f"Error loading token: {e}")
-            self.creds = None
+            self._set_credentials(None)
+
+        self._notify_account()
+        if self.is_logged_in():
+            self.queue.wake()
+            return True
         return False
 
+    def _refresh_credentials(self) -> None:
+        """Refresh the access token if it is about to expire, then schedule the next refresh"""
+        with self._creds_lock:
+            creds = self.creds
+            if creds is None or not creds.refresh_token:
+                return
+            try:
+                if not creds.valid or self._seconds_until_expiry(creds) < TOKEN_REFRESH_MARGIN:
+                    from google.auth.transport.requests import Request
+                    creds.refresh(Request())
+                    with open(TOKEN_FILE, 'wb') as token:
+                        pickle.dump(creds, token)
+            except Exception as e:
+                # Requests still refresh on demand; just try again later
+                logging.warning(f"Token refresh failed: {e}")
+            self._schedule_refresh()
+
+    def _schedule_refresh(self) -> None:
+        """Arm a timer that refreshes the token shortly before it expires"""
+        if self._refresh_timer:
+            self._refresh_timer.cancel()
+            self._refresh_timer = None
+        if self.creds is None or self.creds.expiry is None:
+            return
+        delay = max(TOKEN_RETRY_SECONDS, self._seconds_until_expiry(self.creds) - TOKEN_REFRESH_MARGIN)
+        self._refresh_timer = threading.Timer(delay, self._refresh_credentials)
+        self._refresh_timer.daemon = True
+        self._refresh_timer.start()
+
+    @staticmethod
+    def _seconds_until_expiry(creds) -> float:
+        # google-auth keeps expiry as a naive UTC datetime
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return (creds.expiry - now).total_seconds() if creds.expiry else float('inf')
+
+    def add_account_listener(self, callback: Callable[[], None]) -> None:
+        """Call callback() when the signed-in account changes or finishes loading"""
+        self._account_listeners.append(callback)
+
+    def remove_account_listener(self, callback: Callable[[], None]) -> None:
+        """Stop notifying an account listener"""
+        if callback in self._account_listeners:
+            self._account_listeners.remove(callback)
+
+    def _notify_account(self) -> None:
+        for callback in list(self._account_listeners):
+            try:
+                callback()
+            except Exception as e:
+                logging.error(f"Error in account listener: {e}")
+
     def is_logged_in(self) -> bool:
         """Check if user is currently logged in"""
-        return self.creds is not None and self.creds.valid
+        creds = self.creds
+        # An expired token still counts; requests refresh it on demand
+        return creds is not None and (creds.valid or bool(creds.refresh_token))
+
+    def uses_drive_account(self) -> bool:
+        """True if the active backend needs a signed-in Google account"""
+        return self.backend.needs_account
+
+    def is_ready(self) -> bool:
+        """Check if backups can be sent right now"""
+        if self.uses_drive_account() and not self.is_logged_in():
+            return False
+        return self.backend.is_available()
+
+    def set_backend(self, kind: str, local_dir: Optional[str] = None) -> None:
+        """Switch backup target and remember the choice in settings"""
+        settings = load_settings()
+        settings['backup_backend'] = kind
+        if local_dir is not None:
+            settings['backup_local_dir'] = local_dir
+        save_settings(settings)
+
+        with self._backup_lock:
+            # A half-finished upload belongs to the previous target
+            self.generations.discard_pending()
+            self.backend = create_backend(settings, lambda: self.service)
+            self.generations = self._create_generation_store(settings)
+        self.queue.wake()
+
+    def _create_generation_store(self, settings: Dict[str, Any]) -> GenerationStore:
+        """Generation store for the current backend, configured from settings"""
+        return GenerationStore(self.backend,
+                               RetentionPolicy.from_settings(settings),
+                               incremental=bool(settings.get('backup_incremental', False)))
+
+    def set_incremental(self, enabled: bool) -> None:
+        """Switch between full-file and chunked incremental backups"""
+        settings = load_settings()
+        settings['backup_incremental'] = enabled
+        save_settings(settings)
+        self.generations.incremental = enabled
+
+    def set_retention(self, policy: RetentionPolicy) -> None:
+        """Change how many generations are kept and remember it in settings"""
+        settings = load_settings()
+        settings['backup_keep_hourly'] = policy.hourly
+        settings['backup_keep_daily'] = policy.daily
+        settings['backup_keep_monthly'] = policy.monthly
+        save_settings(settings)
+        self.generations.policy = policy
 
     def get_user_info(self) -> Optional[Dict[str, Any]]:
-        """Get logged in user profile info"""
+        """Fetch logged in user profile info from Google (blocking) and cache it"""
         if not self.is_logged_in() or not self.user_info_service:
             return None
         try:
-            return self.user_info_service.userinfo().get().execute()
+            info = self.user_info_service.userinfo().get().execute()
         except Exception as e:
             logging.error(f"Error fetching user info: {e}")
             return None
+        self._save_profile(info)
+        return info
+
+    def get_cached_user_info(self) -> Optional[Dict[str, Any]]:
+        """
+        Cached profile info, returned immediately. A missing or stale
+        entry is refreshed in the background and account listeners are
+        notified when it arrives.
+        """
+        if not self.is_logged_in():
+            return None
+        profile = self._profile
+        stale = profile is None or time.time() - profile.get('fetched_at', 0) > PROFILE_TTL_SECONDS
+        # Failed attempts are not repeated on every call
+        if stale and not self._profile_refreshing and time.time() - self._profile_attempted > TOKEN_RETRY_SECONDS:
+            self._profile_refreshing = True
+            self._profile_attempted = time.time()
+            thread = threading.Thread(target=self._refresh_profile, daemon=True)
+            thread.start()
+        return profile
+
+    def is_profile_loading(self) -> bool:
+        """True while the profile is being fetched in the background"""
+        return self._profile_refreshing
+
+    def _refresh_profile(self) -> None:
+        try:
+            self.get_user_info()
+        finally:
+            self._profile_refreshing = False
+            self._notify_account()
+
+    def _load_profile(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(PROFILE_FILE, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable account profile cache: {e}")
+            return None
+
+    def _save_profile(self, info: Dict[str, Any]) -> None:
+        profile = {key: info.get(key) for key in ('email', 'name', 'picture')}
+        profile['fetched_at'] = int(time.time())
+        self._profile = profile
+        try:
+            tmp_path = PROFILE_FILE.with_suffix('.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(profile, f)
+            os.replace(tmp_path, PROFILE_FILE)
+        except OSError as e:
+            logging.warning(f"Could not cache account profile: {e}")
+
+    def _clear_profile(self) -> None:
+        self._profile = None
+        self._profile_attempted = 0.0
+        try:
+            os.remove(PROFILE_FILE)
+        except FileNotFoundError:
+            pass
 
     def login(self) -> bool:
         """
@@ -89,17 +315,22 @@ class BackupService:
 
         try:
             # Use embedded config instead of file
+            from google_auth_oauthlib.flow import InstalledAppFlow
             flow = InstalledAppFlow.from_client_config(
                 GOOGLE_CLIENT_CONFIG, SCOPES)
             
-            self.creds = flow.run_local_server(port=0)
+            creds = flow.run_local_server(port=0)
             
             # Save the credentials
             with open(TOKEN_FILE, 'wb') as token:
-                pickle.dump(self.creds, token)
+                pickle.dump(creds, token)
             
-            self.service = build('drive', 'v3', credentials=self.creds)
-            self.user_info_service = build('oauth2', 'v2', credentials=self.creds)
+            # A different account may have signed in
+            self._clear_profile()
+            self._set_credentials(creds)
+            with self._creds_lock:
+                self._schedule_refresh()
+            self.queue.wake()
             return True
             
         except Exception as e:
@@ -108,102 +339,241 @@ class BackupService:
 
     def logout(self) -> None:
         """Clear credentials and token file"""
-        self.creds = None
-        self.service = None
-        self.user_info_service = None
+        self._set_credentials(None)
+        self._clear_profile()
+        # Cached IDs and pending jobs belong to the signed-out account
+        if self.uses_drive_account():
+            self.backend.reset()
+            self.generations.invalidate()
+            self.generations.discard_pending()
+            self.queue.clear()
         if TOKEN_FILE.exists():
             try:
                 os.remove(TOKEN_FILE)
             except OSError:
                 pass
 
-    def _get_or_create_folder(self) -> Optional[str]:
-        """Finds or creates the backup folder."""
-        if not self.service:
-            return None
-            
-        if self.folder_id:
-            return self.folder_id
-            
+    def _perform_backup(self) -> None:
+        """
+        Upload the current database file to the backup backend.
+        Raises on failure so the queue can decide whether to retry.
+        """
+        if not self.is_ready():
+            raise RuntimeError("Backup target not available")
+
+        with self._backup_lock:
+            if not DATABASE_PATH.exists():
+                return
+
+            source_mtime = DATABASE_PATH.stat().st_mtime_ns
+            resumed = self.generations.resume_pending(progress=self._notify_progress)
+            if resumed is not None:
+                logging.info(f"Backup successful: {resumed['name']}")
+                if resumed.get('source_mtime') == source_mtime:
+                    return
+
+            with tempfile.TemporaryDirectory(dir=DATA_DIR) as tmp_dir:
+                snapshot = Path(tmp_dir) / 'snapshot.db'
+                with self._file_lock:
+                    self._snapshot_database(snapshot)
+                generation = self.generations.add(snapshot, progress=self._notify_progress,
+                                                  source_mtime=source_mtime)
+            logging.info(f"Backup successful: {generation['name']}")
+
+    def list_backups(self) -> List[Dict[str, Any]]:
+        """Backup generations available for restore, newest first"""
+        if not self.is_ready():
+            raise RuntimeError("Backup target not available")
+        return self.generations.list()
+
+    def stage_restore(self, generation: Dict[str, Any], password: str,
+                      progress: Optional[Callable[[int, int], None]] = None) -> StagedRestore:
+        """
+        Download a backup generation next to the vault and check it against
+        its checksum, SQLite's integrity check and the master password,
+        without touching the live vault; safe on a worker thread. Pass the
+        result to install_restore() or discard_restore().
+        Raises ValueError if the backup is rejected.
+        """
+        fd, tmp_name = tempfile.mkstemp(dir=DATA_DIR, prefix='.restore-', suffix='.db')
+        os.close(fd)
+        staged = StagedRestore(Path(tmp_name), generation['name'])
         try:
-            query = f"name = '{self.folder_name}' and mimeType = 'application/vnd.google-apps.folder' and trashed = false"
-            results = self.service.files().list(q=query, spaces='drive', fields='files(id, name)').execute()
-            items = results.get('files', [])
-            
-            if not items:
-                file_metadata = {
-                    'name': self.folder_name,
-                    'mimeType': 'application/vnd.google-apps.folder'
-                }
-                file = self.service.files().create(body=file_metadata, fields='id').execute()
-                self.folder_id = file.get('id')
-            else:
-                self.folder_id = items[0]['id']
-                
-            return self.folder_id
-            
-        except Exception as e:
-            logging.error(f"Error getting folder: {e}")
-            return None
+            self.generations.restore(generation, staged.path, progress)
+            staged.unlocked = self._verify_restored_database(staged.path, password)
+        except BaseException:
+            self.discard_restore(staged)
+            raise
+        return staged
+
+    def install_restore(self, staged: StagedRestore, database: Database) -> None:
+        """
+        Replace the live vault with a staged backup and reopen it, unlocked
+        with the key found when it was checked. Must run on the thread that
+        owns database's connection (the GTK thread): SQLite connections
+        cannot be closed or used from another thread.
+        """
+        try:
+            # Only wait for a snapshot being taken, not for a whole upload
+            with self._file_lock:
+                database.close()
+                try:
+                    # A leftover journal belongs to the old file and must not be replayed
+                    for suffix in ('-journal', '-wal', '-shm'):
+                        try:
+                            os.remove(f"{database.db_path}{suffix}")
+                        except FileNotFoundError:
+                            pass
+                    os.replace(staged.path, database.db_path)
+                    dir_fd = os.open(database.db_path.parent, os.O_RDONLY)
+                    try:
+                        os.fsync(dir_fd)
+                    finally:
+                        os.close(dir_fd)
+                finally:
+                    database.connect()
+                    database.initialize()
+
+            # The password was checked against this very file while staging;
+            # taking over that key spares a second key derivation here
+            database.adopt_key(staged.unlocked)
+            # The backup may come from another device; never share its sync identity
+            database.reset_sync_identity()
+            logging.info(f"Restored backup {staged.name}")
+        finally:
+            self.discard_restore(staged)
+
+    @staticmethod
+    def discard_restore(staged: StagedRestore) -> None:
+        """Delete a staged backup that will not be installed"""
+        try:
+            staged.path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _verify_restored_database(self, path: Path, password: str) -> Database:
+        """
+        Reject a downloaded database that is damaged or not ours; returns
+        an unconnected handle holding its unlocked key
+        """
+        try:
+            conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            try:
+                result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+                tables = {row[0] for row in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table'")}
+            finally:
+                conn.close()
+        except sqlite3.DatabaseError as e:
+            raise ValueError(f"Backup is not a valid database: {e}")
+
+        if result != 'ok':
+            raise ValueError(f"Backup failed the integrity check: {result}")
+        if not {'master', 'passwords'} <= tables:
+            raise ValueError("Backup is not an Ashy Pass vault")
+
+        candidate = Database(path)
+        try:
+            # Bring an older backup up to date as install_restore() would,
+            # so unlocking it stores the keys it lacks
+            candidate.initialize()
+            if not candidate.verify_master_password(password):
+                raise ValueError("Master password does not match this backup")
+            return candidate.clone(connect=False)
+        finally:
+            candidate.close()
+
+    def add_progress_listener(self, callback: Callable[[int, int], None]) -> None:
+        """Call callback(bytes_sent, bytes_total) while a backup uploads"""
+        self._progress_listeners.append(callback)
+
+    def remove_progress_listener(self, callback: Callable[[int, int], None]) -> None:
+        """Stop reporting upload progress to a listener"""
+        if callback in self._progress_listeners:
+            self._progress_listeners.remove(callback)
+
+    def _notify_progress(self, sent: int, total: int) -> None:
+        for callback in list(self._progress_listeners):
+            try:
+                callback(sent, total)
+            except Exception as e:
+                logging.error(f"Error in backup progress listener: {e}")
+
+    def _snapshot_database(self, dest: Path) -> None:
+        """Consistent copy of the live database via the SQLite backup API"""
+        source = sqlite3.connect(str(DATABASE_PATH))
+        target = sqlite3.connect(str(dest))
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+
+    def attach_database(self, database: Database) -> None:
+        """Database whose entries are synced with other devices"""
+        self.sync_engine = SyncEngine(database, lambda: self.backend)
+
+    def set_sync_enabled(self, enabled: bool) -> None:
+        """Turn device sync on or off and remember it in settings"""
+        settings = load_settings()
+        settings['sync_enabled'] = enabled
+        save_settings(settings)
+        self.sync_enabled = enabled
+        if enabled:
+            self.request_sync()
+
+    def request_sync(self) -> None:
+        """Queue a sync round if sync is on and possible"""
+        if self.sync_enabled and self.sync_engine and self.is_ready():
+            self.queue.enqueue('sync')
+
+    def _perform_sync(self) -> None:
+        """Exchange entry changes with other devices"""
+        if not self.is_ready():
+            raise RuntimeError("Backup target not available")
+        if not self.sync_engine or not self.sync_engine.database.is_unlocked():
+            # Nothing can be read or written until the vault is unlocked
+            logging.info("Skipping sync while the vault is locked")
+            return
+
+        result = self.sync_engine.sync()
+        if result.applied:
+            for callback in list(self._sync_listeners):
+                try:
+                    callback(result.applied)
+                except Exception as e:
+                    logging.error(f"Error in sync listener: {e}")
+            # Back up the merged vault
+            self.queue.enqueue('backup')
+
+    def add_sync_listener(self, callback: Callable[[int], None]) -> None:
+        """Call callback(applied_count) after changes from other devices are merged"""
+        self._sync_listeners.append(callback)
+
+    def _run_backup_job(self, job: Dict[str, Any]) -> None:
+        """Queue worker entry point"""
+        if job['kind'] == 'backup':
+            self._perform_backup()
+        elif job['kind'] == 'sync':
+            self._perform_sync()
+        else:
+            logging.warning(f"Unknown backup job kind: {job['kind']}")
 
     def backup_database(self) -> bool:
         """
-        Uploads the current database file to Google Drive.
+        Uploads the current database file synchronously.
         Returns True if successful.
         """
-        if not self.is_logged_in():
-            return False
-        
-        # Prevent concurrent backups
-        if self._is_backing_up:
-            return False
-        self._is_backing_up = True
-
         try:
-            folder_id = self._get_or_create_folder()
-            if not folder_id:
-                return False
-                
-            if not DATABASE_PATH.exists():
-                return False
-                
-            file_metadata = {
-                'name': 'ashypass.db',
-                'parents': [folder_id]
-            }
-            media = MediaFileUpload(str(DATABASE_PATH), 
-                                   mimetype='application/x-sqlite3',
-                                   resumable=True)
-            
-            query = f"name = 'ashypass.db' and '{folder_id}' in parents and trashed = false"
-            results = self.service.files().list(q=query, spaces='drive', fields='files(id)').execute()
-            items = results.get('files', [])
-            
-            if items:
-                file_id = items[0]['id']
-                self.service.files().update(
-                    fileId=file_id,
-                    media_body=media
-                ).execute()
-            else:
-                self.service.files().create(
-                    body=file_metadata,
-                    media_body=media,
-                    fields='id'
-                ).execute()
-                
-            logging.info("Backup successful.")
+            self._perform_backup()
             return True
-            
         except Exception as e:
             logging.error(f"Backup failed: {e}")
             return False
-        finally:
-            self._is_backing_up = False
 
     def auto_backup(self) -> None:
-        """Run backup in a separate thread (fire and forget)"""
-        if self.is_logged_in():
-            thread = threading.Thread(target=self.backup_database)
-            thread.daemon = True
-            thread.start()
\ No newline at end of file
+        """Queue a backup; the queue worker uploads it and retries on failure"""
+        if self.is_ready():
+            # Sync first so the backup includes merged changes
+            self.request_sync()
+            self.queue.enqueue()
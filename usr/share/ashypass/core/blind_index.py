@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Ashy Pass - Blind Index - Search terms for encrypted entry metadata
+Titles, usernames and URLs are stored encrypted, so search runs over
+keyed hashes of terms instead: each whole word, its first one and two
+characters, and its trigrams. A query becomes the terms that every
+matching entry must have; those candidates are then decrypted and
+checked, so the index only has to narrow the search, never decide it.
+"""
+
+import re
+from typing import Iterable, Optional, Set
+
+_WORD = re.compile(r'\w+')
+TRIGRAM = 3
+# Word prefixes indexed for queries too short for trigrams
+SHORT_PREFIXES = (1, 2)
+
+
+def normalize(text: Optional[str]) -> str:
+    """Case-insensitive form used for terms and for matching"""
+    return (text or '').casefold()
+
+
+def _trigrams(word: str) -> Set[str]:
+    return {f"t:{word[i:i + TRIGRAM]}" for i in range(len(word) - TRIGRAM + 1)}
+
+
+def entry_terms(fields: Iterable[Optional[str]]) -> Set[str]:
+    """Index terms of an entry's title, username and URL"""
+    terms: Set[str] = set()
+    for field in fields:
+        for word in _WORD.findall(normalize(field)):
+            terms.add(f"w:{word}")
+            terms.update(f"p:{word[:n]}" for n in SHORT_PREFIXES if len(word) >= n)
+            terms.update(_trigrams(word))
+    return terms
+
+
+def query_terms(query: str) -> Optional[Set[str]]:
+    """
+    Terms every entry containing query must have, or None if the query
+    does not narrow the search (e.g. a single character), to scan instead.
+    Inner words of the query are whole words; the first may be the end of
+    a word and the last the start of one.
+    """
+    text = normalize(query)
+    words = _WORD.findall(text)
+    terms: Set[str] = set()
+    for i, word in enumerate(words):
+        open_start = i == 0 and text.startswith(word)
+        open_end = i == len(words) - 1 and text.endswith(word)
+        if not open_start and not open_end:
+            terms.add(f"w:{word}")
+        elif not open_start and len(word) <= max(SHORT_PREFIXES):
+            terms.add(f"p:{word}")
+        else:
+            terms.update(_trigrams(word))
+    return terms or None
+
+
+def fold(fields: Iterable[Optional[str]]) -> str:
+    """
+    Fields in one normalized string to match queries against; NUL keeps
+    a query from matching across two fields
+    """
+    return '\0'.join(normalize(field) for field in fields)
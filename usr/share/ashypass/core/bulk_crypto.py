@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Ashy Pass - Bulk Crypto - Parallel encryption for whole-vault operations
+Import, export and re-encryption handle thousands of values at once.
+The cryptography primitives release the GIL, so batches are split into
+chunks and processed on a thread pool sized to the CPU count.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Protocol, Sequence, TypeVar
+
+# Values handed to one worker at a time; big enough to amortize the
+# hand-off, small enough to spread a few thousand values over all cores
+BULK_CHUNK_SIZE = 256
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+class Cipher(Protocol):
+    """Anything with bytes-to-bytes encrypt() and decrypt(), e.g. CellCipher or Fernet"""
+
+    def encrypt(self, data: bytes) -> bytes: ...
+
+    def decrypt(self, token: bytes) -> bytes: ...
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def default_workers() -> int:
+    """Number of CPUs this process may run on"""
+    try:
+        return len(os.sched_getaffinity(0)) or 1
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Process-wide pool, shared by every database connection"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=default_workers(), thread_name_prefix='ashypass-crypto')
+        return _executor
+
+
+class BulkCrypto:
+    """
+    Encrypts and decrypts batches with a cipher, in parallel when
+    more than one CPU is available. Results keep the input order and
+    None values pass through unchanged (e.g. empty notes).
+    """
+
+    def __init__(self, cipher: Cipher, workers: Optional[int] = None, chunk_size: int = BULK_CHUNK_SIZE):
+        self.cipher = cipher
+        self.workers = workers if workers is not None else default_workers()
+        self.chunk_size = chunk_size
+        # A private pool when the caller asks for a specific size (benchmarks)
+        self._executor = ThreadPoolExecutor(max_workers=workers) if workers and workers > 1 else None
+
+    def encrypt_many(self, values: Sequence[Optional[str]]) -> List[Optional[bytes]]:
+        """Encrypt strings; returns ciphertexts in the same order"""
+        encrypt = self.cipher.encrypt
+        return self._map(lambda chunk: [encrypt(v.encode()) if v is not None else None for v in chunk], values)
+
+    def decrypt_many(self, tokens: Sequence[Optional[bytes]]) -> List[Optional[str]]:
+        """Decrypt ciphertexts; returns strings in the same order"""
+        decrypt = self.cipher.decrypt
+        return self._map(lambda chunk: [decrypt(t).decode() if t is not None else None for t in chunk], tokens)
+
+    def close(self) -> None:
+        """Stop the private pool, if any"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _map(self, work: Callable[[Sequence[T]], List[R]], items: Sequence[T]) -> List[R]:
+        """Run work over chunks of items and join the results in order"""
+        if self.workers <= 1 or len(items) <= self.chunk_size:
+            return work(items)
+
+        chunks = [items[i:i + self.chunk_size] for i in range(0, len(items), self.chunk_size)]
+        executor = self._executor or _get_executor()
+        results: List[R] = []
+        for part in executor.map(work, chunks):
+            results.extend(part)
+        return results
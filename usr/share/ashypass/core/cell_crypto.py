@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Ashy Pass - Cell Crypto - Compact encrypted field format
+Fields are stored as raw binary cells: a version byte, a 12-byte nonce
+and the AES-256-GCM ciphertext with its 16-byte tag, 29 bytes of
+overhead in total and no base64. Fernet tokens written by earlier
+versions are still read, so vaults can be migrated row by row.
+
+The vault key itself is random and stored wrapped (AES-GCM) by a key
+derived from the master password; see wrap_key() and unwrap_key().
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from core.secret_buffer import SecretBuffer
+
+CELL_V1 = b'\x01'
+_NONCE_SIZE = 12
+_HEADER_SIZE = len(CELL_V1) + _NONCE_SIZE
+_TAG_SIZE = 16
+VAULT_KEY_SIZE = 32
+_WRAP_AAD = b'ashypass vault key v1'
+# Truncated HMAC per search term; collisions only add candidates to check
+BLIND_TOKEN_SIZE = 8
+
+
+def is_cell(data: bytes) -> bool:
+    """True for the current cell format, False for a legacy Fernet token"""
+    return data[:1] == CELL_V1
+
+
+def wrap_key(wrapping_key: bytes, key: bytes) -> bytes:
+    """Encrypt a vault key with a password-derived key: nonce and AES-GCM ciphertext"""
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    nonce = os.urandom(_NONCE_SIZE)
+    return nonce + AESGCM(wrapping_key).encrypt(nonce, key, _WRAP_AAD)
+
+
+def unwrap_key(wrapping_key: bytes, wrapped: bytes) -> bytes:
+    """Recover a vault key from wrap_key(); raises InvalidToken for a wrong key"""
+    from cryptography.exceptions import InvalidTag
+    from cryptography.fernet import InvalidToken
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    try:
+        return AESGCM(wrapping_key).decrypt(wrapped[:_NONCE_SIZE], wrapped[_NONCE_SIZE:], _WRAP_AAD)
+    except InvalidTag:
+        raise InvalidToken
+
+
+class CellCipher:
+    """
+    Encrypts fields as v1 cells and decrypts both cells and Fernet tokens,
+    and hashes search terms for the blind index. All keys come from the
+    32-byte vault key: the Fernet key is the key itself, as before, and
+    the AES-GCM and index keys are derived from it with HKDF. Every
+    failure raises cryptography's InvalidToken, as Fernet does.
+    """
+
+    def __init__(self, key: bytes):
+        from cryptography.exceptions import InvalidTag
+        from cryptography.fernet import Fernet, InvalidToken
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+        from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+        self._fernet = Fernet(base64.urlsafe_b64encode(key))
+        cell_key = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b'ashypass cell v1').derive(key)
+        self._aead = AESGCM(cell_key)
+        # The streaming API of the same cipher, to decrypt into a SecretBuffer
+        self._stream = lambda nonce, tag: Cipher(algorithms.AES(cell_key), modes.GCM(nonce, tag)).decryptor()
+        self._index_key = HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                               info=b'ashypass search v1').derive(key)
+        self._errors = (InvalidTag, InvalidToken)
+
+    def encrypt(self, data: bytes) -> bytes:
+        nonce = os.urandom(_NONCE_SIZE)
+        return CELL_V1 + nonce + self._aead.encrypt(nonce, data, CELL_V1)
+
+    def decrypt(self, token: bytes) -> bytes:
+        if token[:1] != CELL_V1:
+            return self._fernet.decrypt(token)
+        invalid_tag, invalid_token = self._errors
+        try:
+            return self._aead.decrypt(token[len(CELL_V1):_HEADER_SIZE], token[_HEADER_SIZE:], CELL_V1)
+        except invalid_tag:
+            raise invalid_token
+
+    def decrypt_into(self, token: bytes, buffer: 'SecretBuffer') -> memoryview:
+        """
+        Decrypt to the end of buffer, which must have room for len(token)
+        bytes, and return a view of the plaintext. Cells are decrypted in
+        place; a legacy Fernet token briefly exists as bytes first.
+        """
+        if token[:1] != CELL_V1:
+            return buffer.append(self._fernet.decrypt(token))
+
+        invalid_tag, invalid_token = self._errors
+        ciphertext, tag = token[_HEADER_SIZE:-_TAG_SIZE], token[-_TAG_SIZE:]
+        decryptor = self._stream(token[len(CELL_V1):_HEADER_SIZE], tag)
+        decryptor.authenticate_additional_data(CELL_V1)
+        target = buffer.tail(len(ciphertext))
+        try:
+            written = decryptor.update_into(ciphertext, target)
+            decryptor.finalize()
+        except invalid_tag:
+            # Nothing unauthenticated may stay behind
+            target[:] = bytes(len(target))
+            raise invalid_token
+        finally:
+            target.release()
+        return buffer.commit(written)
+
+    def blind_token(self, term: str) -> bytes:
+        """Keyed hash of a search term (see core.blind_index)"""
+        return hmac.new(self._index_key, term.encode(), hashlib.sha256).digest()[:BLIND_TOKEN_SIZE]
@@ -25,6 +25,9 @@ SESSION_TIMEOUT_SECONDS = 30
 CLIPBOARD_CLEAR_SECONDS = 60
 MIN_MASTER_PASSWORD_LENGTH = 8
 
+# Sync Settings
+SYNC_INTERVAL_SECONDS = 300
+
 # Password Generation Defaults
 DEFAULT_PASSWORD_LENGTH = 16
 MIN_PASSWORD_LENGTH = 8
@@ -1,11 +1,311 @@
 import csv
+import io
+import codecs
 import os
-from typing import List, Dict, Optional, Any
+import time
+import threading
+import itertools
+import tempfile
+import re
+from dataclasses import dataclass, replace
+from typing import List, Dict, Optional, Any, Iterator, Iterable, Callable, Tuple, Union
+
+from core.secret_buffer import SecretBuffer
+
+# Rows per transaction when importing into the database
+IMPORT_BATCH_SIZE = 500
+# Bytes of CSV collected before each write when exporting
+EXPORT_BUFFER_SIZE = 64 * 1024
+# Characters that make a CSV field need quotes
+_CSV_SPECIAL = (',', '"', '\r', '\n')
+# re scans a memoryview in place, without copying it to bytes
+_QUOTE = re.compile(rb'"')
+# Bytes read to detect the format of a CSV file, and rows it previews
+SNIFF_BYTES = 16 * 1024
+PREVIEW_ROWS = 5
+
+
+class _CountingReader(io.RawIOBase):
+    """Binary file wrapper that counts bytes read, for progress reporting"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_read = 0
+        # Set by readers whose byte count is not the file size (archives)
+        self.total_bytes: Optional[int] = None
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        n = self.raw.readinto(buffer)
+        self.bytes_read += n or 0
+        return n
+
+
+# Parses a file into entries, counting bytes read through the given reader
+EntryReader = Callable[[str, _CountingReader], Iterator[Dict[str, str]]]
+
+
+class _SecretWriter:
+    """
+    Collects output in a locked SecretBuffer, zeroed after every flush,
+    and writes it to an unbuffered file, so exported secrets are never
+    copied to ordinary memory on the way out
+    """
+
+    def __init__(self, out, size: int):
+        self.out = out
+        self.buffer = SecretBuffer(size, wipe_on_lock=False)
+
+    def write(self, data: Union[bytes, memoryview]) -> None:
+        if len(self.buffer) + len(data) > self.buffer.capacity:
+            self.flush()
+        if len(data) > self.buffer.capacity:
+            self._write_all(data)
+        else:
+            self.buffer.write(data)
+
+    def write_field(self, value: Union[str, memoryview, None]) -> None:
+        """One CSV field, quoted like csv.QUOTE_MINIMAL; secrets are always quoted"""
+        if not isinstance(value, memoryview):
+            text = value or ''
+            if any(char in text for char in _CSV_SPECIAL):
+                text = '"' + text.replace('"', '""') + '"'
+            self.write(text.encode('utf-8'))
+            return
+
+        # Double each quote by writing slices of the view, never a copy
+        self.write(b'"')
+        start = 0
+        for match in _QUOTE.finditer(value):
+            self.write(value[start:match.end()])
+            self.write(b'"')
+            start = match.end()
+        self.write(value[start:])
+        self.write(b'"')
+
+    def flush(self) -> None:
+        view = self.buffer.view()
+        try:
+            self._write_all(view)
+        finally:
+            view.release()
+            self.buffer.clear()
+
+    def close(self) -> None:
+        self.buffer.close()
+
+    def _write_all(self, data: Union[bytes, memoryview]) -> None:
+        # A raw file may accept less than asked for
+        data = memoryview(data)
+        while data:
+            data = data[self.out.write(data):]
+
+
+@dataclass
+class ImportProgress:
+    """State of a running or finished import"""
+    rows: int = 0
+    added: int = 0
+    updated: int = 0
+    skipped: int = 0
+    bytes_read: int = 0
+    total_bytes: int = 0
+    elapsed: float = 0.0
+    cancelled: bool = False
+
+    @property
+    def fraction(self) -> float:
+        return self.bytes_read / self.total_bytes if self.total_bytes else 1.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class ImportCancelled(Exception):
+    """Raised inside an import batch when the user cancels"""
+
+
+# Header names other tools use for each entry field, compared after
+# lowercasing and dropping spaces, '_' and '-'
+HEADER_ALIASES: Dict[str, Tuple[str, ...]] = {
+    'title': ('name', 'title', 'account', 'accountname', 'site', 'sitename', 'service', 'entry', 'item'),
+    'url': ('url', 'website', 'web', 'siteurl', 'loginuri', 'uri', 'address', 'hostname', 'link'),
+    'username': ('username', 'user', 'login', 'loginname', 'loginusername', 'userid', 'email', 'emailaddress'),
+    'password': ('password', 'pass', 'passwd', 'pwd', 'loginpassword', 'secret'),
+    'notes': ('note', 'notes', 'comment', 'comments', 'extra', 'description', 'memo'),
+}
+
+
+@dataclass
+class CsvFormat:
+    """How a CSV file is written, as detected by CsvHandler.sniff()"""
+    encoding: str
+    delimiter: str
+    quotechar: str
+    has_header: bool
+    # Entry field -> column index
+    columns: Dict[str, int]
+    headers: List[str]
+
+
+@dataclass
+class CsvPreview:
+    """Detected format and the first mapped entries of a file"""
+    format: CsvFormat
+    entries: List[Dict[str, str]]
+
+
+def _header_key(name: str) -> str:
+    return ''.join(ch for ch in name.strip().lower() if ch not in ' _-')
+
+
+_ALIAS_LOOKUP = {_header_key(alias): field for field, aliases in HEADER_ALIASES.items() for alias in aliases}
+
+
+def _map_headers(headers: List[str]) -> Dict[str, int]:
+    """Entry field -> column index for recognized header names; first match wins"""
+    columns: Dict[str, int] = {}
+    for index, header in enumerate(headers):
+        field = _ALIAS_LOOKUP.get(_header_key(header))
+        if field and field not in columns:
+            columns[field] = index
+    return columns
+
+
+def _detect_encoding(sample: bytes, complete: bool) -> str:
+    """Encoding from a byte order mark, else UTF-8 if it decodes, else Windows-1252 or Latin-1"""
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    for encoding in ('utf-8', 'cp1252'):
+        try:
+            # Incremental, so a character cut at the end of the sample is fine
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=complete)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return 'latin-1'
+
 
 class CsvHandler:
     """Handles import and export of passwords in CSV format (Google Chrome compatible)"""
     
     FIELD_NAMES = ['name', 'url', 'username', 'password', 'note']
+
+    @staticmethod
+    def _normalize_row(row: List[str], columns: Dict[str, int]) -> Optional[Dict[str, str]]:
+        """Map a CSV row to an entry, or None if it carries nothing useful"""
+        def cell(field: str) -> str:
+            index = columns.get(field)
+            return row[index] if index is not None and index < len(row) else ''
+
+        entry = {
+            'title': cell('title') or 'Untitled',
+            'url': cell('url'),
+            'username': cell('username'),
+            'password': cell('password'),
+            'notes': cell('notes')
+        }
+        # Only add if there is at least a password or title
+        if entry['password'] or entry['title'] != 'Untitled':
+            return entry
+        return None
+
+    @staticmethod
+    def sniff(file_path: str, sample_size: int = SNIFF_BYTES) -> CsvFormat:
+        """
+        Detect encoding, dialect, header row and column mapping from the
+        first sample_size bytes only.
+        """
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File not found: {file_path}")
+
+        with open(file_path, 'rb') as f:
+            sample = f.read(sample_size)
+            complete = not f.read(1)
+
+        encoding = _detect_encoding(sample, complete)
+        text = codecs.getincrementaldecoder(encoding)(errors='replace').decode(sample, final=complete)
+        if not complete:
+            # The last line is probably cut off
+            text = text[:max(text.rfind('\n'), 0)] or text
+        if not text.strip():
+            raise ValueError("The file is empty")
+
+        try:
+            dialect = csv.Sniffer().sniff(text, delimiters=',;\t|')
+            delimiter, quotechar = dialect.delimiter, dialect.quotechar or '"'
+        except csv.Error:
+            delimiter, quotechar = ',', '"'
+
+        first = next(csv.reader(io.StringIO(text), delimiter=delimiter, quotechar=quotechar), [])
+        columns = _map_headers(first)
+        if any('://' in cell for cell in first):
+            # A URL is data, so there is no header row
+            has_header = False
+        elif len(columns) >= 2:
+            has_header = True
+        else:
+            try:
+                has_header = csv.Sniffer().has_header(text)
+            except csv.Error:
+                has_header = False
+
+        if has_header and 'password' not in columns and 'title' not in columns:
+            raise ValueError(f"No password or title column among: {', '.join(first)}")
+        if not has_header:
+            # No header: assume the Chrome column order
+            columns = {field: i for i, field in enumerate(['title', 'url', 'username', 'password', 'notes'])}
+
+        return CsvFormat(encoding=encoding, delimiter=delimiter, quotechar=quotechar,
+                         has_header=has_header, columns=columns, headers=first if has_header else [])
+
+    @staticmethod
+    def preview(file_path: str, rows: int = PREVIEW_ROWS) -> CsvPreview:
+        """Detected format and the first mapped entries, read from the sample only"""
+        fmt = CsvHandler.sniff(file_path)
+        with open(file_path, 'rb') as f:
+            sample = f.read(SNIFF_BYTES)
+        text = codecs.getincrementaldecoder(fmt.encoding)(errors='replace').decode(sample)
+        reader = csv.reader(io.StringIO(text), delimiter=fmt.delimiter, quotechar=fmt.quotechar)
+        if fmt.has_header:
+            next(reader, None)
+        entries = []
+        for row in reader:
+            if len(entries) == rows:
+                break
+            entry = CsvHandler._normalize_row(row, fmt.columns)
+            if entry:
+                entries.append(entry)
+        return CsvPreview(format=fmt, entries=entries)
+
+    @staticmethod
+    def iter_csv(file_path: str, counter: Optional[_CountingReader] = None,
+                 fmt: Optional[CsvFormat] = None) -> Iterator[Dict[str, str]]:
+        """
+        Yield password entries one at a time without loading the file.
+        The format is sniffed from the start of the file unless given.
+        """
+        if fmt is None:
+            fmt = CsvHandler.sniff(file_path)
+
+        with open(file_path, 'rb', buffering=0) as raw:
+            source = counter if counter is not None else _CountingReader(None)
+            source.raw = raw
+            with io.TextIOWrapper(io.BufferedReader(source), encoding=fmt.encoding,
+                                  errors='replace', newline='') as csvfile:
+                reader = csv.reader(csvfile, delimiter=fmt.delimiter, quotechar=fmt.quotechar)
+                if fmt.has_header:
+                    next(reader, None)
+
+                for row in reader:
+                    entry = CsvHandler._normalize_row(row, fmt.columns)
+                    if entry:
+                        yield entry
     
     @staticmethod
     def import_csv(file_path: str) -> List[Dict[str, str]]:
@@ -13,68 +313,99 @@ class CsvHandler:
         Reads a CSV file and returns a list of password entries.
         Expected format: name, url, username, password, note
         """
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"File not found: {file_path}")
-            
-        entries = []
         try:
-            with open(file_path, mode='r', encoding='utf-8', newline='') as csvfile:
-                # Google CSVs usually have a header. Sniffer could be used, 
-                # but let's assume standard header or try to detect.
-                # We'll use DictReader which uses the first row as keys.
-                reader = csv.DictReader(csvfile)
-                
-                # Normalize headers to lowercase to match our expected keys
-                if reader.fieldnames:
-                    headers = [h.lower() for h in reader.fieldnames]
-                    reader.fieldnames = headers
-                
-                for row in reader:
-                    # Map Google's 'name' to our 'title' logic, but keep dict generic
-                    entry = {
-                        'title': row.get('name') or row.get('title') or 'Untitled',
-                        'url': row.get('url') or '',
-                        'username': row.get('username') or '',
-                        'password': row.get('password') or '',
-                        'notes': row.get('note') or row.get('notes') or ''
-                    }
-                    
-                    # Only add if there is at least a password or title
-                    if entry['password'] or entry['title'] != 'Untitled':
-                        entries.append(entry)
-                        
+            return list(CsvHandler.iter_csv(file_path))
         except Exception as e:
             print(f"Error importing CSV: {e}")
             raise
-            
-        return entries
 
     @staticmethod
-    def export_csv(file_path: str, passwords: List[Dict[str, Any]]) -> bool:
+    def import_into_database(database, file_path: str, batch_size: int = IMPORT_BATCH_SIZE,
+                             progress: Optional[Callable[[ImportProgress], None]] = None,
+                             cancel: Optional[threading.Event] = None,
+                             reader: Optional[EntryReader] = None) -> ImportProgress:
+        """
+        Stream a CSV file into the database, committing every batch_size
+        rows. Rows matching an existing entry (see Database.merge_passwords)
+        update it or are skipped, so importing the same file twice adds
+        nothing. Setting `cancel` stops the import and rolls back the batch
+        in progress; earlier batches stay imported. `reader` parses other
+        formats (see core.importers); it defaults to iter_csv().
+        """
+        state = ImportProgress(total_bytes=os.path.getsize(file_path))
+        counter = _CountingReader(None)
+        entries = (reader or CsvHandler.iter_csv)(file_path, counter)
+        started = time.monotonic()
+        index = database.build_identity_index()
+
+        def guarded(batch):
+            for entry in batch:
+                if cancel is not None and cancel.is_set():
+                    raise ImportCancelled()
+                yield entry
+
+        try:
+            while True:
+                batch = itertools.islice(entries, batch_size)
+                merged = database.merge_passwords(guarded(batch), index)
+                state.rows += merged.total
+                state.added += merged.added
+                state.updated += merged.updated
+                state.skipped += merged.skipped
+                state.bytes_read = counter.bytes_read
+                state.total_bytes = counter.total_bytes or state.total_bytes
+                state.elapsed = time.monotonic() - started
+                if progress:
+                    # A copy, since the caller may read it on another thread
+                    progress(replace(state))
+                if merged.total < batch_size:
+                    break
+        except ImportCancelled:
+            state.cancelled = True
+        finally:
+            entries.close()
+
+        state.elapsed = time.monotonic() - started
+        return state
+
+    @staticmethod
+    def export_csv(file_path: str, passwords: Iterable[Dict[str, Any]],
+                   buffer_size: int = EXPORT_BUFFER_SIZE) -> bool:
         """
-        Exports a list of password dictionaries to a CSV file.
+        Writes password entries to a CSV file as they are produced.
+        `passwords` may be any iterable, e.g. Database.iter_decrypted_passwords(),
+        and must yield plain-text entries. Password and notes may be str or,
+        with iter_decrypted_passwords(secrets=True), memoryviews of UTF-8 that
+        are only ever copied into locked memory. Rows are flushed in blocks of
+        about buffer_size bytes to a temporary file that replaces file_path
+        only once everything has been written.
         """
+        directory = os.path.dirname(os.path.abspath(file_path))
+        tmp_path = None
         try:
-            with open(file_path, mode='w', encoding='utf-8', newline='') as csvfile:
-                writer = csv.DictWriter(csvfile, fieldnames=CsvHandler.FIELD_NAMES)
-                
-                writer.writeheader()
-                
-                for p in passwords:
-                    # Decrypt/Prepare data before calling this method or ensure 'passwords' list 
-                    # passed here contains plain text if the user authorized it.
-                    # NOTE: The database usually returns encrypted data. 
-                    # The caller must ensure passwords are decrypted.
-                    
-                    row = {
-                        'name': p.get('title', ''),
-                        'url': p.get('url', ''),
-                        'username': p.get('username', ''),
-                        'password': p.get('password', ''), # Must be plain text
-                        'note': p.get('notes', '')
-                    }
-                    writer.writerow(row)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.ashypass-export-', suffix='.csv')
+            with os.fdopen(fd, 'wb', buffering=0) as out:
+                writer = _SecretWriter(out, buffer_size)
+                try:
+                    writer.write(','.join(CsvHandler.FIELD_NAMES).encode() + b'\r\n')
+                    for p in passwords:
+                        for i, value in enumerate((p.get('title'), p.get('url'), p.get('username'),
+                                                   p.get('password'), p.get('notes'))):
+                            if i:
+                                writer.write(b',')
+                            writer.write_field(value)
+                        writer.write(b'\r\n')
+                    writer.flush()
+                finally:
+                    writer.close()
+                os.fsync(out.fileno())
+            os.replace(tmp_path, file_path)
             return True
         except Exception as e:
             print(f"Error exporting CSV: {e}")
+            if tmp_path:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
             return False
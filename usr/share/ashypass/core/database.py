@@ -2,17 +2,83 @@
 """Ashy Pass - Database Module - Encrypted SQLite password storage"""
 
 import sqlite3
+import logging
 import time
+import json
+import uuid
 from pathlib import Path
-from typing import Optional, List, Dict, Any, Callable
+from typing import Optional, List, Dict, Any, Callable, Tuple, Iterable, Iterator, TYPE_CHECKING
 import hashlib
 import base64
-
-from argon2 import PasswordHasher
-from argon2.exceptions import VerifyMismatchError
-from cryptography.fernet import Fernet
+import os
+import itertools
+from dataclasses import dataclass
+from urllib.parse import urlsplit
 
 from core.config import DATABASE_PATH
+from core.bulk_crypto import BulkCrypto
+from core.cell_crypto import CellCipher, CELL_V1, VAULT_KEY_SIZE, wrap_key, unwrap_key
+from core.blind_index import entry_terms, query_terms, normalize, fold
+from core.secret_buffer import SecretBuffer
+
+if TYPE_CHECKING:
+    from argon2 import PasswordHasher
+
+# Namespace for entry UUIDs of rows created before sync existed; derived
+# from the row ID so copies of the same legacy vault agree on them
+LEGACY_UUID_NAMESPACE = uuid.UUID('6c1f6d2e-3c57-4d8e-9a54-2f0e5b1c7a10')
+
+# PBKDF2-SHA256 rounds of the key that wraps the vault key
+KEY_KDF_ITERATIONS = 600000
+# Vaults from before the vault key was wrapped derived it directly
+LEGACY_KDF_ITERATIONS = 100000
+# Most rounds accepted from a sync key record another device published
+MAX_KDF_ITERATIONS = 10000000
+
+# Entries encrypted or decrypted together by bulk operations
+BULK_ROWS = 1024
+# Row IDs per "WHERE id IN (...)" query, below SQLite's variable limit
+_IN_QUERY_SIZE = 500
+# Rows rewritten per transaction by migrate_cells()
+MIGRATION_BATCH = 200
+# Fields get_secret() reads from their own encrypted column
+_SECRET_COLUMNS = {'password': 'password_encrypted', 'notes': 'notes_encrypted'}
+# Fields of the metadata cell, in the order of its JSON array
+_META_FIELDS = ('title', 'username', 'url')
+# Rows with a field still in the Fernet format, or plain-text metadata
+_LEGACY_ROWS = (f"(meta_encrypted IS NULL OR substr(password_encrypted, 1, 1) != X'{CELL_V1.hex()}' OR "
+                f"(length(notes_encrypted) > 0 AND substr(notes_encrypted, 1, 1) != X'{CELL_V1.hex()}'))")
+
+IdentityKey = Tuple[str, str, str]
+
+
+def identity_key(title: Optional[str], username: Optional[str], url: Optional[str]) -> IdentityKey:
+    """
+    What makes two entries the same login: the URL host without "www.",
+    the username and the title, compared case-insensitively
+    """
+    host = ''
+    if url and url.strip():
+        url = url.strip()
+        try:
+            host = urlsplit(url if '://' in url else f"//{url}").hostname or ''
+        except ValueError:
+            host = url.casefold()
+        if host.startswith('www.'):
+            host = host[4:]
+    return host, (username or '').strip().casefold(), (title or '').strip().casefold()
+
+
+@dataclass
+class MergeResult:
+    """What merge_passwords() did with the incoming entries"""
+    added: int = 0
+    updated: int = 0
+    skipped: int = 0
+
+    @property
+    def total(self) -> int:
+        return self.added + self.updated + self.skipped
 
 
 class Database:
@@ -21,10 +87,23 @@ class Database:
     def __init__(self, db_path: Path = DATABASE_PATH):
         self.db_path = db_path
         self.connection: Optional[sqlite3.Connection] = None
-        self.ph = PasswordHasher(time_cost=3, memory_cost=65536, parallelism=4)
-        self._fernet: Optional[Fernet] = None
+        # argon2 and cryptography are imported when the vault is first unlocked
+        self._ph: Optional['PasswordHasher'] = None
+        self._cipher: Optional[CellCipher] = None
+        self._sync_cipher: Optional[CellCipher] = None
+        self._bulk: Optional[BulkCrypto] = None
+        # Opened metadata cells for get_passwords(), by ciphertext
+        self._meta_cache: Dict[bytes, Tuple[str, Optional[str], Optional[str], str]] = {}
         self._change_listeners: List[Callable[[], None]] = []
 
+    @property
+    def ph(self) -> 'PasswordHasher':
+        """Argon2 hasher for the master password, created on first use"""
+        if self._ph is None:
+            from argon2 import PasswordHasher
+            self._ph = PasswordHasher(time_cost=3, memory_cost=65536, parallelism=4)
+        return self._ph
+
     def add_change_listener(self, callback: Callable[[], None]) -> None:
         """Add a listener to be notified when database changes"""
         self._change_listeners.append(callback)
@@ -41,13 +120,18 @@ class Database:
         """Establish database connection"""
         self.connection = sqlite3.connect(str(self.db_path))
         self.connection.row_factory = sqlite3.Row
+        # Zero deleted content, such as metadata replaced by encrypted
+        # cells, rather than leave it in free pages and backups
+        self.connection.execute("PRAGMA secure_delete = ON")
     
     def close(self) -> None:
         """Close database connection"""
         if self.connection:
             self.connection.close()
             self.connection = None
-        self._fernet = None
+        self._cipher = None
+        self._sync_cipher = None
+        self._meta_cache = {}
     
     def initialize(self) -> None:
         """Create database tables if they don't exist"""
@@ -79,10 +163,97 @@ class Database:
             )
         """)
         
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_passwords_title ON passwords(title)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_passwords_username ON passwords(username)")
+        # The random vault key, wrapped by a key derived from the master
+        # password with the salt and these rounds; the sync key encrypted
+        # under the vault key, and the record that publishes it wrapped by
+        # the master password (see _wrap_sync_key); NULL in older vaults
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(master)")}
+        for column, kind in (('kdf_iterations', 'INTEGER'), ('wrapped_key', 'BLOB'),
+                             ('sync_key', 'BLOB'), ('sync_key_record', 'TEXT')):
+            if column not in columns:
+                cursor.execute(f"ALTER TABLE master ADD COLUMN {column} {kind}")
+
+        self._initialize_sync(cursor)
+        self._initialize_search(cursor)
         
         self.connection.commit()
+
+    def _initialize_sync(self, cursor: sqlite3.Cursor) -> None:
+        """
+        Sync bookkeeping: every entry has a UUID and the (device, sequence)
+        of its last change, deletions leave tombstones, and sync_state
+        holds this device's ID and counters.
+        """
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(passwords)")}
+        for column, kind in (('uuid', 'TEXT'), ('origin', 'TEXT'), ('seq', 'INTEGER')):
+            if column not in columns:
+                cursor.execute(f"ALTER TABLE passwords ADD COLUMN {column} {kind}")
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS tombstones (
+                uuid TEXT PRIMARY KEY,
+                deleted_at INTEGER NOT NULL,
+                origin TEXT NOT NULL,
+                seq INTEGER NOT NULL
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sync_state (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        """)
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_passwords_uuid ON passwords(uuid)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_passwords_origin_seq ON passwords(origin, seq)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_tombstones_origin_seq ON tombstones(origin, seq)")
+
+        cursor.execute("INSERT OR IGNORE INTO sync_state (key, value) VALUES ('device_id', ?)",
+                       (uuid.uuid4().hex[:16],))
+        cursor.execute("INSERT OR IGNORE INTO sync_state (key, value) VALUES ('local_seq', '0')")
+        cursor.execute("INSERT OR IGNORE INTO sync_state (key, value) VALUES ('pushed_seq', '0')")
+
+        # Entries from before sync become this device's first changes
+        legacy = cursor.execute("SELECT id, created_at FROM passwords WHERE uuid IS NULL").fetchall()
+        for row_id, created_at in legacy:
+            entry_uuid = str(uuid.uuid5(LEGACY_UUID_NAMESPACE, f"{row_id}:{created_at}"))
+            origin, seq = self._next_change(cursor)
+            cursor.execute("UPDATE passwords SET uuid = ?, origin = ?, seq = ? WHERE id = ?",
+                           (entry_uuid, origin, seq, row_id))
+
+    def _initialize_search(self, cursor: sqlite3.Cursor) -> None:
+        """
+        Title, username and URL live in one encrypted cell, meta_encrypted;
+        the plain-text columns are left empty. search_tokens is the blind
+        index: keyed hashes of search terms per entry (see core.blind_index).
+        """
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(passwords)")}
+        if 'meta_encrypted' not in columns:
+            cursor.execute("ALTER TABLE passwords ADD COLUMN meta_encrypted BLOB")
+        # Indexes over the plain-text columns would keep a copy of them
+        cursor.execute("DROP INDEX IF EXISTS idx_passwords_title")
+        cursor.execute("DROP INDEX IF EXISTS idx_passwords_username")
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS search_tokens (
+                token BLOB NOT NULL,
+                entry_id INTEGER NOT NULL,
+                PRIMARY KEY (token, entry_id)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_search_tokens_entry ON search_tokens(entry_id)")
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS passwords_delete_tokens AFTER DELETE ON passwords
+            BEGIN
+                DELETE FROM search_tokens WHERE entry_id = OLD.id;
+            END
+        """)
+
+    def _next_change(self, cursor: sqlite3.Cursor) -> Tuple[str, int]:
+        """Stamp for a local change: this device's ID and its next sequence number"""
+        cursor.execute("UPDATE sync_state SET value = CAST(value AS INTEGER) + 1 WHERE key = 'local_seq'")
+        cursor.execute("SELECT key, value FROM sync_state WHERE key IN ('device_id', 'local_seq')")
+        state = dict(cursor.fetchall())
+        return state['device_id'], int(state['local_seq'])
     
     def has_master_password(self) -> bool:
         """Check if master password is set"""
@@ -101,54 +272,316 @@ class Database:
         if self.has_master_password():
             return False
         
-        salt = base64.urlsafe_b64encode(hashlib.sha256(password.encode()).digest())
+        key = os.urandom(VAULT_KEY_SIZE)
+        salt, iterations, wrapped = self._wrap_vault_key(password, key, KEY_KDF_ITERATIONS)
         password_hash = self.ph.hash(password)
+        cipher = CellCipher(key)
+        sync_key = os.urandom(VAULT_KEY_SIZE)
+        record = self._wrap_sync_key(password, sync_key, uuid.uuid4().hex)
         
         cursor = self.connection.cursor()
         cursor.execute(
-            "INSERT INTO master (id, password_hash, salt, created_at) VALUES (1, ?, ?, ?)",
-            (password_hash, salt.decode(), int(time.time())),
+            """INSERT INTO master (id, password_hash, salt, kdf_iterations, wrapped_key, sync_key,
+                                    sync_key_record, created_at)
+               VALUES (1, ?, ?, ?, ?, ?, ?, ?)""",
+            (password_hash, salt, iterations, wrapped, cipher.encrypt(sync_key), record, int(time.time())),
         )
         self.connection.commit()
         
-        self._derive_encryption_key(password, salt)
+        self._cipher = cipher
+        self._sync_cipher = CellCipher(sync_key)
         return True
     
     def verify_master_password(self, password: str) -> bool:
         """Verify master password and unlock database"""
+        key = self._unlock_vault_key(password)
+        if key is None:
+            return False
+        self._cipher = CellCipher(key)
+        self._sync_cipher = CellCipher(self._open_sync_key(password))
+        return True
+
+    def change_master_password(self, current: str, new: str, iterations: int = KEY_KDF_ITERATIONS) -> bool:
+        """
+        Set a new master password, or new KDF rounds, by re-wrapping the
+        vault key; entries are not touched. False if current is wrong.
+        """
+        key = self._unlock_vault_key(current)
+        if key is None:
+            return False
+
+        salt, iterations, wrapped = self._wrap_vault_key(new, key, iterations)
+        self._cipher = CellCipher(key)
+        sync_key = self._open_sync_key(current)
+        self._sync_cipher = CellCipher(sync_key)
+        # The sync key stays the same, so other devices keep syncing; its
+        # record is published again so devices joining later use the new password
+        key_id = self.get_sync_key_record()['key_id']
+        self.connection.execute(
+            """UPDATE master SET password_hash = ?, salt = ?, kdf_iterations = ?, wrapped_key = ?,
+                                 sync_key_record = ?
+               WHERE id = 1""",
+            (self.ph.hash(new), salt, iterations, wrapped, self._wrap_sync_key(new, sync_key, key_id)),
+        )
+        self.connection.commit()
+        # Back up the new wrapping so a restore takes the new password
+        self._notify_change()
+        return True
+
+    def _unlock_vault_key(self, password: str) -> Optional[bytes]:
+        """
+        The vault key if password is right. Vaults from before the key was
+        wrapped used the password-derived key as the vault key; it is kept
+        and wrapped on first unlock so existing entries stay readable.
+        """
         if not self.connection:
             self.connect()
         
-        cursor = self.connection.cursor()
-        cursor.execute("SELECT password_hash, salt FROM master WHERE id = 1")
-        row = cursor.fetchone()
-        
+        row = self.connection.execute("SELECT * FROM master WHERE id = 1").fetchone()
         if not row:
-            return False
+            return None
         
+        from argon2.exceptions import VerifyMismatchError
+        from cryptography.fernet import InvalidToken
         try:
             self.ph.verify(row["password_hash"], password)
-            self._derive_encryption_key(password, row["salt"].encode())
-            return True
         except VerifyMismatchError:
-            return False
-    
-    def _derive_encryption_key(self, password: str, salt: bytes) -> None:
-        """Derive Fernet encryption key from master password"""
-        key = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, 100000, dklen=32)
-        self._fernet = Fernet(base64.urlsafe_b64encode(key))
+            return None
+
+        salt = row["salt"].encode()
+        # Backups being verified may predate the columns
+        columns = row.keys()
+        if 'wrapped_key' in columns and row["wrapped_key"] is not None:
+            try:
+                return unwrap_key(self._derive_wrapping_key(password, salt, row["kdf_iterations"]),
+                                  row["wrapped_key"])
+            except InvalidToken:
+                return None
+
+        key = self._derive_wrapping_key(password, salt, LEGACY_KDF_ITERATIONS)
+        if 'wrapped_key' in columns:
+            salt, iterations, wrapped = self._wrap_vault_key(password, key, KEY_KDF_ITERATIONS)
+            self.connection.execute(
+                "UPDATE master SET salt = ?, kdf_iterations = ?, wrapped_key = ? WHERE id = 1",
+                (salt, iterations, wrapped),
+            )
+            self.connection.commit()
+        return key
+
+    def _wrap_vault_key(self, password: str, key: bytes, iterations: int) -> Tuple[str, int, bytes]:
+        """Wrap key under password with a fresh salt: (salt, iterations, wrapped key)"""
+        salt = base64.urlsafe_b64encode(os.urandom(16)).decode()
+        return salt, iterations, wrap_key(self._derive_wrapping_key(password, salt.encode(), iterations), key)
+
+    @staticmethod
+    def _derive_wrapping_key(password: str, salt: bytes, iterations: int) -> bytes:
+        """Key derived from the master password"""
+        return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations, dklen=VAULT_KEY_SIZE)
+
+    def _wrap_sync_key(self, password: str, key: bytes, key_id: str) -> str:
+        """
+        Sync key record, published next to the change sets: the key wrapped
+        by the master password with a fresh salt, so each sync group needs
+        its own dictionary attack, and an ID that tells groups apart
+        """
+        salt, iterations, wrapped = self._wrap_vault_key(password, key, KEY_KDF_ITERATIONS)
+        return json.dumps({
+            'key_id': key_id,
+            'salt': salt,
+            'iterations': iterations,
+            'wrapped': base64.b64encode(wrapped).decode(),
+            'updated': int(time.time()),
+        })
+
+    def _open_sync_key(self, password: str) -> bytes:
+        """
+        The key change sets are sealed with. It is random and stored under
+        the vault key; the key of a sync group this vault was offered (see
+        offer_sync_key) replaces it once password unwraps it. Vaults from
+        before sync keys get a new one.
+        """
+        from cryptography.fernet import InvalidToken
+
+        row = self.connection.execute("SELECT * FROM master WHERE id = 1").fetchone()
+        offered = self.get_sync_value('offered_sync_key')
+        if offered:
+            record = json.loads(offered)
+            try:
+                sync_key = unwrap_key(
+                    self._derive_wrapping_key(password, record['salt'].encode(), int(record['iterations'])),
+                    base64.b64decode(record['wrapped']))
+            except InvalidToken:
+                logging.warning("The sync group uses another master password; not joining it")
+            else:
+                self._store_sync_key(sync_key, offered, rejoin=True)
+                return sync_key
+
+        if row["sync_key"] is not None and row["sync_key_record"] is not None:
+            return self._cipher.decrypt(row["sync_key"])
+
+        sync_key = os.urandom(VAULT_KEY_SIZE)
+        self._store_sync_key(sync_key, self._wrap_sync_key(password, sync_key, uuid.uuid4().hex))
+        return sync_key
+
+    def _store_sync_key(self, sync_key: bytes, record: str, rejoin: bool = False) -> None:
+        """
+        Keep a sync key and its record. On joining another group, change
+        sets sealed with the old key are unreadable to it, so all of this
+        device's changes are sent again.
+        """
+        cursor = self.connection.cursor()
+        cursor.execute("UPDATE master SET sync_key = ?, sync_key_record = ? WHERE id = 1",
+                       (self._cipher.encrypt(sync_key), record))
+        if rejoin:
+            cursor.execute("DELETE FROM sync_state WHERE key = 'offered_sync_key'")
+            cursor.execute("UPDATE sync_state SET value = '0' WHERE key = 'pushed_seq'")
+            cursor.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES ('republish', '1')")
+        self.connection.commit()
+
+    def get_sync_key_record(self) -> Dict[str, Any]:
+        """This vault's sync key record, to publish to its sync group"""
+        if not self.connection:
+            self.connect()
+        row = self.connection.execute("SELECT sync_key_record FROM master WHERE id = 1").fetchone()
+        return json.loads(row["sync_key_record"])
+
+    def offer_sync_key(self, record: Dict[str, Any]) -> None:
+        """
+        Remember the sync key record of a group this vault is not part of
+        yet; the next unlock unwraps it with the master password and joins.
+        Raises ValueError for a record no unlock should spend time on.
+        """
+        try:
+            iterations = int(record['iterations'])
+            base64.b64decode(record['wrapped'], validate=True)
+            record['salt'].encode()
+        except (KeyError, TypeError, AttributeError, ValueError) as e:
+            raise ValueError(f"Malformed sync key record: {e}")
+        if not LEGACY_KDF_ITERATIONS <= iterations <= MAX_KDF_ITERATIONS:
+            raise ValueError(f"Sync key record asks for {iterations} KDF rounds")
+        self.set_sync_value('offered_sync_key', json.dumps(record))
     
+    def is_unlocked(self) -> bool:
+        """Check if the encryption key has been derived"""
+        return self._cipher is not None
+
+    def clone(self, connect: bool = True) -> 'Database':
+        """
+        Separate connection to the same vault sharing the unlocked key,
+        for use from a worker thread. Without connect, it connects on first
+        use in whichever thread uses it. Change listeners are not copied.
+        """
+        other = Database(self.db_path)
+        other._ph = self._ph
+        other._cipher = self._cipher
+        other._sync_cipher = self._sync_cipher
+        if connect:
+            other.connect()
+        return other
+
+    def adopt_key(self, other: 'Database') -> None:
+        """Unlock with the key another handle to the same vault file was unlocked with"""
+        if not other.is_unlocked():
+            raise RuntimeError("Database not unlocked")
+        self._cipher = other._cipher
+        self._sync_cipher = other._sync_cipher
+        self._meta_cache = {}
+
     def _encrypt(self, data: str) -> bytes:
-        """Encrypt data using Fernet"""
-        if not self._fernet:
+        """Encrypt data as a v1 cell"""
+        if not self._cipher:
             raise RuntimeError("Database not unlocked")
-        return self._fernet.encrypt(data.encode())
+        return self._cipher.encrypt(data.encode())
     
     def _decrypt(self, data: bytes) -> str:
-        """Decrypt data using Fernet"""
-        if not self._fernet:
+        """Decrypt a v1 cell or a legacy Fernet token"""
+        if not self._cipher:
             raise RuntimeError("Database not unlocked")
-        return self._fernet.decrypt(data).decode()
+        return self._cipher.decrypt(data).decode()
+
+    def decrypt_secret(self, data: bytes) -> SecretBuffer:
+        """Decrypt into a new SecretBuffer instead of a str; close it when done"""
+        if not self._cipher:
+            raise RuntimeError("Database not unlocked")
+        buffer = SecretBuffer(len(data))
+        try:
+            self._cipher.decrypt_into(data, buffer)
+        except BaseException:
+            buffer.close()
+            raise
+        return buffer
+
+    def encrypt_many(self, values: List[Optional[str]]) -> List[Optional[bytes]]:
+        """Encrypt a batch on all CPUs, keeping order; None stays None"""
+        return self._bulk_crypto().encrypt_many(values)
+
+    def decrypt_many(self, tokens: List[Optional[bytes]]) -> List[Optional[str]]:
+        """Decrypt a batch on all CPUs, keeping order; None stays None"""
+        return self._bulk_crypto().decrypt_many(tokens)
+
+    def _bulk_crypto(self) -> BulkCrypto:
+        """Bulk engine for the current key"""
+        if not self._cipher:
+            raise RuntimeError("Database not unlocked")
+        if self._bulk is None or self._bulk.cipher is not self._cipher:
+            self._bulk = BulkCrypto(self._cipher)
+        return self._bulk
+
+    @staticmethod
+    def _meta_json(entry: Dict[str, Any]) -> str:
+        """Plain text of an entry's metadata cell"""
+        return json.dumps([entry.get('title') or '', entry.get('username'), entry.get('url')], separators=(',', ':'))
+
+    def _open_meta(self, rows: List[sqlite3.Row]) -> List[Dict[str, Any]]:
+        """
+        Title, username and URL of rows selected with meta_encrypted and
+        the plain-text columns, which rows not yet migrated still use
+        """
+        opened = self.decrypt_many([row["meta_encrypted"] for row in rows])
+        # One JSON document for the batch parses far faster than a call per row
+        fields = json.loads(f"[{','.join(meta or 'null' for meta in opened)}]")
+        metas = []
+        for row, meta in zip(rows, fields):
+            if meta is None:
+                metas.append({'title': row["title"], 'username': row["username"], 'url': row["url"]})
+            else:
+                metas.append({'title': meta[0], 'username': meta[1], 'url': meta[2]})
+        return metas
+
+    def _listing_meta(self, rows: List[sqlite3.Row],
+                      prune: bool = False) -> List[Tuple[str, Optional[str], Optional[str], str]]:
+        """
+        (title, username, url, folded fields) of rows, for get_passwords().
+        Opened cells are kept by ciphertext until the vault is locked, so
+        listing or searching again only decrypts entries changed since;
+        with prune, cells of entries not in rows are dropped.
+        """
+        cache = self._meta_cache
+        missing = [row for row in rows if row["meta_encrypted"] not in cache]
+        unmigrated = {}
+        for row, meta in zip(missing, self._open_meta(missing)):
+            fields = (meta['title'], meta['username'], meta['url'])
+            opened = fields + (fold(fields),)
+            if row["meta_encrypted"] is None:
+                unmigrated[row["id"]] = opened
+            else:
+                cache[row["meta_encrypted"]] = opened
+        cells = [row["meta_encrypted"] for row in rows]
+        metas = [cache[cell] if cell is not None else unmigrated[row["id"]] for row, cell in zip(rows, cells)]
+        if prune:
+            self._meta_cache = {cell: meta for cell, meta in zip(cells, metas) if cell is not None}
+        return metas
+
+    def _index_entry(self, cursor: sqlite3.Cursor, entry_id: int, meta: Dict[str, Any]) -> None:
+        """Replace the blind-index tokens of an entry without committing"""
+        if not self._cipher:
+            raise RuntimeError("Database not unlocked")
+        token = self._cipher.blind_token
+        cursor.execute("DELETE FROM search_tokens WHERE entry_id = ?", (entry_id,))
+        cursor.executemany(
+            "INSERT OR IGNORE INTO search_tokens (token, entry_id) VALUES (?, ?)",
+            [(token(term), entry_id) for term in entry_terms((meta['title'], meta['username'], meta['url']))],
+        )
     
     def add_password(self, title: str, password: str, username: Optional[str] = None,
                     notes: Optional[str] = None, url: Optional[str] = None) -> int:
@@ -156,42 +589,237 @@ class Database:
         if not self.connection:
             self.connect()
         
-        timestamp = int(time.time())
-        password_encrypted = self._encrypt(password)
-        notes_encrypted = self._encrypt(notes) if notes else None
-        
         cursor = self.connection.cursor()
-        cursor.execute(
-            """INSERT INTO passwords (title, username, password_encrypted, notes_encrypted, url, created_at, updated_at)
-               VALUES (?, ?, ?, ?, ?, ?, ?)""",
-            (title, username, password_encrypted, notes_encrypted, url, timestamp, timestamp),
-        )
+        (row_id,) = self._insert_entries(cursor, [
+            {'title': title, 'password': password, 'username': username, 'notes': notes, 'url': url}
+        ])
         self.connection.commit()
         self._notify_change()
-        return cursor.lastrowid
+        return row_id
+    
+    def add_passwords(self, entries: Iterable[Dict[str, Any]]) -> int:
+        """
+        Add many entries in one transaction; returns how many were added.
+        If iterating entries raises (e.g. a cancelled import), nothing from
+        this call is kept.
+        """
+        if not self.connection:
+            self.connect()
+
+        cursor = self.connection.cursor()
+        entries = iter(entries)
+        count = 0
+        try:
+            while True:
+                chunk = list(itertools.islice(entries, BULK_ROWS))
+                if not chunk:
+                    break
+                self._insert_entries(cursor, chunk)
+                count += len(chunk)
+            self.connection.commit()
+        except BaseException:
+            self.connection.rollback()
+            raise
+
+        if count:
+            self._notify_change()
+        return count
+
+    def build_identity_index(self) -> Dict[IdentityKey, int]:
+        """Map identity_key() of every entry to its ID, for merge_passwords()"""
+        if not self.connection:
+            self.connect()
+        rows = self.connection.execute("SELECT id, title, username, url, meta_encrypted FROM passwords").fetchall()
+        return {identity_key(meta['title'], meta['username'], meta['url']): row["id"]
+                for row, meta in zip(rows, self._open_meta(rows))}
+
+    def merge_passwords(self, entries: Iterable[Dict[str, Any]],
+                        index: Optional[Dict[IdentityKey, int]] = None) -> MergeResult:
+        """
+        Import entries without creating duplicates, in one transaction.
+        An entry whose identity_key() is already in the vault is skipped
+        if its password, notes and URL are the same, and otherwise updates
+        that entry; everything else is added. Pass the same index to
+        successive calls to merge a large import batch by batch; added
+        entries are recorded in it. Rolls back like add_passwords().
+        """
+        if not self.connection:
+            self.connect()
+        if index is None:
+            index = self.build_identity_index()
+
+        cursor = self.connection.cursor()
+        entries = iter(entries)
+        result = MergeResult()
+        try:
+            while True:
+                chunk = list(itertools.islice(entries, BULK_ROWS))
+                if not chunk:
+                    break
+
+                # Within the chunk the last entry for an identity wins
+                fresh: Dict[IdentityKey, Dict[str, Any]] = {}
+                matched: Dict[int, Dict[str, Any]] = {}
+                for entry in chunk:
+                    key = identity_key(entry.get('title'), entry.get('username'), entry.get('url'))
+                    row_id = index.get(key)
+                    target, slot = (fresh, key) if row_id is None else (matched, row_id)
+                    if slot in target:
+                        result.skipped += 1
+                    target[slot] = entry
+
+                changed = self._changed_entries(cursor, matched)
+                result.skipped += len(matched) - len(changed)
+                self._update_entries(cursor, changed)
+                result.updated += len(changed)
+
+                for key, row_id in zip(fresh, self._insert_entries(cursor, list(fresh.values()))):
+                    index[key] = row_id
+                result.added += len(fresh)
+            self.connection.commit()
+        except BaseException:
+            self.connection.rollback()
+            raise
+
+        if result.added or result.updated:
+            self._notify_change()
+        return result
+
+    def _insert_entries(self, cursor: sqlite3.Cursor, chunk: List[Dict[str, Any]]) -> List[int]:
+        """Insert entries without committing; returns their IDs"""
+        # Passwords, notes and metadata of the whole chunk in one parallel pass
+        count = len(chunk)
+        sealed = self.encrypt_many([entry['password'] for entry in chunk] +
+                                   [entry.get('notes') or None for entry in chunk] +
+                                   [self._meta_json(entry) for entry in chunk])
+        timestamp = int(time.time())
+        ids = []
+        for entry, password_encrypted, notes_encrypted, meta_encrypted in zip(
+                chunk, sealed, sealed[count:], sealed[2 * count:]):
+            origin, seq = self._next_change(cursor)
+            # Entries from a vault archive keep their own dates
+            cursor.execute(
+                """INSERT INTO passwords (title, password_encrypted, notes_encrypted, meta_encrypted,
+                                          created_at, updated_at, uuid, origin, seq)
+                   VALUES ('', ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (password_encrypted, notes_encrypted, meta_encrypted,
+                 entry.get('created_at') or timestamp, entry.get('updated_at') or timestamp,
+                 str(uuid.uuid4()), origin, seq),
+            )
+            row_id = cursor.lastrowid
+            self._index_entry(cursor, row_id, entry)
+            ids.append(row_id)
+        return ids
+
+    def _changed_entries(self, cursor: sqlite3.Cursor,
+                         matched: Dict[int, Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+        """
+        The incoming entries whose password, notes or URL differ from the
+        stored entry, with the stored title and username
+        """
+        ids = list(matched)
+        rows = []
+        for i in range(0, len(ids), _IN_QUERY_SIZE):
+            part = ids[i:i + _IN_QUERY_SIZE]
+            cursor.execute(
+                f"SELECT id, title, username, url, meta_encrypted, password_encrypted, notes_encrypted FROM passwords "
+                f"WHERE id IN ({', '.join('?' * len(part))})",
+                part,
+            )
+            rows.extend(cursor.fetchall())
+
+        opened = self.decrypt_many([row["password_encrypted"] for row in rows] +
+                                   [row["notes_encrypted"] or None for row in rows])
+        changed = {}
+        for row, meta, password, notes in zip(rows, self._open_meta(rows), opened, opened[len(rows):]):
+            entry = matched[row["id"]]
+            if (entry['password'] != password or (entry.get('notes') or '') != (notes or '')
+                    or (entry.get('url') or '') != (meta['url'] or '')):
+                changed[row["id"]] = dict(entry, title=meta['title'], username=meta['username'])
+        return changed
+
+    def _update_entries(self, cursor: sqlite3.Cursor, changed: Dict[int, Dict[str, Any]]) -> None:
+        """Overwrite password, notes and URL of existing entries without committing"""
+        ids = list(changed)
+        count = len(ids)
+        sealed = self.encrypt_many([changed[i]['password'] for i in ids] +
+                                   [changed[i].get('notes') or None for i in ids] +
+                                   [self._meta_json(changed[i]) for i in ids])
+        timestamp = int(time.time())
+        for row_id, password_encrypted, notes_encrypted, meta_encrypted in zip(
+                ids, sealed, sealed[count:], sealed[2 * count:]):
+            origin, seq = self._next_change(cursor)
+            cursor.execute(
+                """UPDATE passwords SET password_encrypted = ?, notes_encrypted = ?, meta_encrypted = ?,
+                                        title = '', username = NULL, url = NULL,
+                                        updated_at = MAX(?, updated_at + 1), origin = ?, seq = ?
+                   WHERE id = ?""",
+                (password_encrypted, notes_encrypted, meta_encrypted, timestamp, origin, seq, row_id),
+            )
+            self._index_entry(cursor, row_id, changed[row_id])
+
+    def notify_external_change(self) -> None:
+        """Tell listeners about changes written through another connection (see clone())"""
+        self._notify_change()
     
     def get_passwords(self, search: Optional[str] = None) -> List[Dict[str, Any]]:
-        """Get all password entries (passwords remain encrypted)"""
+        """
+        Entries ordered by title, with title, username and URL decrypted
+        (passwords remain encrypted). A search matches entries whose title,
+        username or URL contains it, ignoring case; the blind index picks
+        the candidates unless even its rarest term is in most entries,
+        where checking every entry is cheaper than intersecting the terms.
+        """
         if not self.connection:
             self.connect()
         
+        needle = normalize(search) if search else None
+        if needle is not None and '\0' in needle:
+            # Fields are folded into one string separated by NUL
+            return []
         cursor = self.connection.cursor()
+        columns = "id, title, username, url, meta_encrypted, created_at, updated_at, last_accessed"
+        terms = query_terms(search) if search else None
+        tokens = None
         
-        if search:
+        if terms:
+            if not self._cipher:
+                raise RuntimeError("Database not unlocked")
+            tokens = [self._cipher.blind_token(term) for term in terms]
+            rarest = min(cursor.execute("SELECT COUNT(*) FROM search_tokens WHERE token = ?", (token,)).fetchone()[0]
+                         for token in tokens)
+            if 2 * rarest > cursor.execute("SELECT COUNT(*) FROM passwords").fetchone()[0]:
+                tokens = None
+        if tokens:
+            # Rows not migrated yet have no tokens and are always checked
             cursor.execute(
-                """SELECT id, title, username, url, created_at, updated_at, last_accessed
-                   FROM passwords WHERE title LIKE ? OR username LIKE ? OR url LIKE ? ORDER BY title""",
-                (f"%{search}%", f"%{search}%", f"%{search}%"),
+                f"""SELECT {columns} FROM passwords
+                    WHERE meta_encrypted IS NULL OR id IN (
+                        SELECT entry_id FROM search_tokens WHERE token IN ({', '.join('?' * len(tokens))})
+                        GROUP BY entry_id HAVING COUNT(*) = ?)""",
+                tokens + [len(tokens)],
             )
         else:
-            cursor.execute(
-                "SELECT id, title, username, url, created_at, updated_at, last_accessed FROM passwords ORDER BY title"
-            )
+            cursor.execute(f"SELECT {columns} FROM passwords")
         
-        return [dict(row) for row in cursor.fetchall()]
+        rows = cursor.fetchall()
+        entries = []
+        for row, (title, username, url, folded) in zip(rows, self._listing_meta(rows, prune=not search)):
+            # The index only narrows the search; candidates are checked
+            if needle is not None and needle not in folded:
+                continue
+            entries.append({'title': title, 'username': username, 'url': url, 'id': row["id"],
+                            'created_at': row["created_at"], 'updated_at': row["updated_at"],
+                            'last_accessed': row["last_accessed"]})
+        entries.sort(key=lambda entry: entry["title"])
+        return entries
     
-    def get_password(self, password_id: int) -> Optional[Dict[str, Any]]:
-        """Get a specific password entry with decrypted password"""
+    def get_password(self, password_id: int, secrets: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Get a specific password entry with decrypted password. With
+        secrets, password and notes are SecretBuffers (notes may be None)
+        that the caller must close.
+        """
         if not self.connection:
             self.connect()
         
@@ -203,14 +831,169 @@ class Database:
             return None
         
         entry = dict(row)
-        entry["password"] = self._decrypt(entry["password_encrypted"])
-        entry["notes"] = self._decrypt(entry["notes_encrypted"]) if entry["notes_encrypted"] else None
+        entry.update(self._open_meta([row])[0])
+        decrypt = self.decrypt_secret if secrets else self._decrypt
+        entry["password"] = decrypt(entry["password_encrypted"])
+        entry["notes"] = decrypt(entry["notes_encrypted"]) if entry["notes_encrypted"] else None
         
         cursor.execute("UPDATE passwords SET last_accessed = ? WHERE id = ?", (int(time.time()), password_id))
         self.connection.commit()
         
         return entry
+
+    def get_secret(self, password_id: int, field: str) -> Optional[SecretBuffer]:
+        """
+        One field of an entry ('password', 'notes', 'title', 'username' or
+        'url') in a SecretBuffer the caller must close, or None if the
+        entry does not exist or the field is empty. Only the column holding
+        that field is read and decrypted, for quick actions such as copying.
+        """
+        if field in _SECRET_COLUMNS:
+            columns = _SECRET_COLUMNS[field]
+        elif field in _META_FIELDS:
+            columns = f"meta_encrypted, {field}"
+        else:
+            raise ValueError(f"Unknown field: {field}")
+
+        if not self.connection:
+            self.connect()
+
+        cursor = self.connection.cursor()
+        row = cursor.execute(f"SELECT {columns} FROM passwords WHERE id = ?", (password_id,)).fetchone()
+        if not row:
+            return None
+
+        if field in _SECRET_COLUMNS:
+            secret = self.decrypt_secret(row[0]) if row[0] else None
+        else:
+            # Rows not yet migrated keep metadata in the plain-text column
+            value = row[1] if row[0] is None else json.loads(self._decrypt(row[0]))[_META_FIELDS.index(field)]
+            secret = SecretBuffer.from_str(value) if value else None
+
+        cursor.execute("UPDATE passwords SET last_accessed = ? WHERE id = ?", (int(time.time()), password_id))
+        self.connection.commit()
+
+        return secret
     
+    def count_passwords(self) -> int:
+        """Number of stored entries"""
+        if not self.connection:
+            self.connect()
+        return self.connection.execute("SELECT COUNT(*) FROM passwords").fetchone()[0]
+
+    def iter_decrypted_passwords(self, fetch_size: int = BULK_ROWS,
+                                 secrets: bool = False) -> Iterator[Dict[str, Any]]:
+        """
+        Yield every entry decrypted, one at a time in the order they were
+        added, so callers such as export never hold the whole decrypted
+        vault. Does not touch last_accessed. With secrets, password and
+        notes are memoryviews into a locked buffer that is zeroed once the
+        next batch is fetched; use them before asking for more entries.
+        """
+        if not self.connection:
+            self.connect()
+
+        cursor = self.connection.cursor()
+        cursor.execute(
+            """SELECT id, title, username, url, meta_encrypted, password_encrypted, notes_encrypted,
+                      created_at, updated_at
+               FROM passwords ORDER BY id"""
+        )
+        arena = SecretBuffer(wipe_on_lock=False) if secrets else None
+        views: List[memoryview] = []
+        try:
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                if secrets:
+                    opened = self._decrypt_batch_into(rows, arena, views)
+                else:
+                    opened = self.decrypt_many([row["password_encrypted"] for row in rows] +
+                                               [row["notes_encrypted"] or None for row in rows])
+                yield from self._decrypted_entries(rows, opened)
+        finally:
+            for view in views:
+                view.release()
+            if arena is not None:
+                arena.close()
+
+    def _decrypt_batch_into(self, rows: List[sqlite3.Row], arena: SecretBuffer,
+                            views: List[memoryview]) -> List[Optional[memoryview]]:
+        """Passwords, then notes, of rows decrypted into arena, replacing the previous batch"""
+        if not self._cipher:
+            raise RuntimeError("Database not unlocked")
+        for view in views:
+            view.release()
+        views.clear()
+        arena.clear()
+
+        tokens = [row["password_encrypted"] for row in rows] + [row["notes_encrypted"] or None for row in rows]
+        arena.reserve(sum(len(token) for token in tokens if token))
+        opened: List[Optional[memoryview]] = []
+        for token in tokens:
+            view = self._cipher.decrypt_into(token, arena) if token else None
+            if view is not None:
+                views.append(view)
+            opened.append(view)
+        return opened
+
+    def _decrypted_entries(self, rows: List[sqlite3.Row], opened: List[Any]) -> Iterator[Dict[str, Any]]:
+        """Entries of rows, given their passwords and then their notes in opened"""
+        for row, meta, password, notes in zip(rows, self._open_meta(rows), opened, opened[len(rows):]):
+            entry = dict(row)
+            del entry["meta_encrypted"], entry["password_encrypted"], entry["notes_encrypted"]
+            entry.update(meta)
+            entry["password"] = password
+            entry["notes"] = notes
+            yield entry
+
+    def count_legacy_cells(self) -> int:
+        """Number of entries with a Fernet-encrypted field or plain-text metadata"""
+        if not self.connection:
+            self.connect()
+        return self.connection.execute(f"SELECT COUNT(*) FROM passwords WHERE {_LEGACY_ROWS}").fetchone()[0]
+
+    def migrate_cells(self, batch_size: int = MIGRATION_BATCH) -> int:
+        """
+        Rewrite one batch of entries in an older format as v1 cells, with
+        encrypted and indexed metadata, and commit it; returns how many were
+        rewritten, 0 when none are left. The plain text is unchanged, so
+        seq, updated_at and listeners are left alone, and a row edited
+        meanwhile is skipped and picked up again by the next batch. Call
+        repeatedly; stopping between batches is safe.
+        """
+        if not self.connection:
+            self.connect()
+
+        cursor = self.connection.cursor()
+        rows = cursor.execute(
+            f"""SELECT id, title, username, url, meta_encrypted, password_encrypted, notes_encrypted
+                FROM passwords WHERE {_LEGACY_ROWS} LIMIT ?""",
+            (batch_size,)
+        ).fetchall()
+        if not rows:
+            return 0
+
+        count = len(rows)
+        metas = self._open_meta(rows)
+        opened = self.decrypt_many([row["password_encrypted"] for row in rows] +
+                                   [row["notes_encrypted"] or None for row in rows])
+        sealed = self.encrypt_many(opened + [self._meta_json(meta) for meta in metas])
+        for row, meta, password, notes, meta_encrypted in zip(
+                rows, metas, sealed, sealed[count:], sealed[2 * count:]):
+            cursor.execute(
+                """UPDATE passwords SET password_encrypted = ?, notes_encrypted = ?, meta_encrypted = ?,
+                                        title = '', username = NULL, url = NULL
+                   WHERE id = ? AND password_encrypted = ? AND notes_encrypted IS ? AND meta_encrypted IS ?""",
+                (password, notes, meta_encrypted,
+                 row["id"], row["password_encrypted"], row["notes_encrypted"], row["meta_encrypted"]),
+            )
+            if cursor.rowcount:
+                self._index_entry(cursor, row["id"], meta)
+        self.connection.commit()
+        return count
+
     def update_password(self, password_id: int, title: Optional[str] = None,
                        password: Optional[str] = None, username: Optional[str] = None,
                        notes: Optional[str] = None, url: Optional[str] = None) -> bool:
@@ -219,31 +1002,39 @@ class Database:
             self.connect()
         
         updates, params = [], []
+        cursor = self.connection.cursor()
+        meta = None
         
-        if title is not None:
-            updates.append("title = ?")
-            params.append(title)
+        if title is not None or username is not None or url is not None:
+            row = cursor.execute("SELECT title, username, url, meta_encrypted FROM passwords WHERE id = ?",
+                                 (password_id,)).fetchone()
+            if not row:
+                return False
+            meta = self._open_meta([row])[0]
+            for key, value in (('title', title), ('username', username), ('url', url)):
+                if value is not None:
+                    meta[key] = value
+            updates.extend(["meta_encrypted = ?", "title = ''", "username = NULL", "url = NULL"])
+            params.append(self._encrypt(self._meta_json(meta)))
         if password is not None:
             updates.append("password_encrypted = ?")
             params.append(self._encrypt(password))
-        if username is not None:
-            updates.append("username = ?")
-            params.append(username)
         if notes is not None:
             updates.append("notes_encrypted = ?")
             params.append(self._encrypt(notes) if notes else None)
-        if url is not None:
-            updates.append("url = ?")
-            params.append(url)
         
         if not updates:
             return False
         
-        updates.append("updated_at = ?")
-        params.extend([int(time.time()), password_id])
+        origin, seq = self._next_change(cursor)
+        # Later than the version replaced, even within the same second, so
+        # every device's last-writer-wins order agrees this edit came after it
+        updates.extend(["updated_at = MAX(?, updated_at + 1)", "origin = ?", "seq = ?"])
+        params.extend([int(time.time()), origin, seq, password_id])
         
-        cursor = self.connection.cursor()
         cursor.execute(f"UPDATE passwords SET {', '.join(updates)} WHERE id = ?", params)
+        if meta is not None and cursor.rowcount > 0:
+            self._index_entry(cursor, password_id, meta)
         self.connection.commit()
         if cursor.rowcount > 0:
             self._notify_change()
@@ -255,8 +1046,202 @@ class Database:
             self.connect()
         
         cursor = self.connection.cursor()
+        cursor.execute("SELECT uuid, updated_at FROM passwords WHERE id = ?", (password_id,))
+        row = cursor.fetchone()
+        if not row:
+            return False
+
+        # The tombstone tells other devices about the deletion; like edits,
+        # it must be later than the version it deletes
+        origin, seq = self._next_change(cursor)
         cursor.execute("DELETE FROM passwords WHERE id = ?", (password_id,))
+        cursor.execute(
+            "INSERT OR REPLACE INTO tombstones (uuid, deleted_at, origin, seq) VALUES (?, ?, ?, ?)",
+            (row["uuid"], max(int(time.time()), row["updated_at"] + 1), origin, seq),
+        )
         self.connection.commit()
-        if cursor.rowcount > 0:
+        self._notify_change()
+        return True
+
+    # --- Sync ---
+
+    def get_sync_value(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        """Read a sync bookkeeping value"""
+        if not self.connection:
+            self.connect()
+        row = self.connection.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else default
+
+    def set_sync_value(self, key: str, value: Any) -> None:
+        """Write a sync bookkeeping value"""
+        if not self.connection:
+            self.connect()
+        self.connection.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, str(value)))
+        self.connection.commit()
+
+    def get_local_changes(self, after_seq: int, up_to: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        This device's changes with a sequence number above after_seq, and
+        at most up_to if given, decrypted: other devices have other vault
+        keys, so change sets are encrypted as a whole with the sync key.
+        """
+        if not self.connection:
+            self.connect()
+        device_id = self.get_sync_value('device_id')
+        up_to = up_to if up_to is not None else int(self.get_sync_value('local_seq', '0'))
+
+        cursor = self.connection.cursor()
+        cursor.execute(
+            """SELECT uuid, title, username, password_encrypted, notes_encrypted, url, meta_encrypted,
+                      created_at, updated_at, origin, seq
+               FROM passwords WHERE origin = ? AND seq > ? AND seq <= ?""",
+            (device_id, after_seq, up_to),
+        )
+        rows = cursor.fetchall()
+        opened = self.decrypt_many([row["password_encrypted"] for row in rows] +
+                                   [row["notes_encrypted"] or None for row in rows])
+        changes = []
+        for row, meta, password, notes in zip(rows, self._open_meta(rows), opened, opened[len(rows):]):
+            change = dict(row, deleted=False, password=password, notes=notes, **meta)
+            del change['meta_encrypted'], change['password_encrypted'], change['notes_encrypted']
+            changes.append(change)
+        cursor.execute(
+            """SELECT uuid, deleted_at AS updated_at, origin, seq FROM tombstones
+               WHERE origin = ? AND seq > ? AND seq <= ?""",
+            (device_id, after_seq, up_to),
+        )
+        changes.extend(dict(row, deleted=True) for row in cursor.fetchall())
+        changes.sort(key=lambda change: change['seq'])
+        return changes
+
+    def get_seen(self) -> Dict[str, int]:
+        """Highest sequence number merged from each other device"""
+        if not self.connection:
+            self.connect()
+        rows = self.connection.execute("SELECT key, value FROM sync_state WHERE key LIKE 'seen:%'").fetchall()
+        return {row["key"][len('seen:'):]: int(row["value"]) for row in rows}
+
+    def count_tombstones(self) -> int:
+        """Deletions still remembered for other devices"""
+        if not self.connection:
+            self.connect()
+        return self.connection.execute("SELECT COUNT(*) FROM tombstones").fetchone()[0]
+
+    def prune_tombstones(self, horizons: Dict[str, int]) -> int:
+        """
+        Forget deletions every device has merged: tombstones of each origin
+        up to its horizon sequence number. Returns how many were removed.
+        """
+        if not self.connection:
+            self.connect()
+        cursor = self.connection.cursor()
+        removed = 0
+        for origin, seq in horizons.items():
+            cursor.execute("DELETE FROM tombstones WHERE origin = ? AND seq <= ?", (origin, seq))
+            removed += cursor.rowcount
+        self.connection.commit()
+        return removed
+
+    def apply_remote_changes(self, changes: List[Dict[str, Any]]) -> int:
+        """
+        Merge changes made on other devices; returns how many were applied.
+        Per entry, the version with the highest (updated_at, origin, seq)
+        wins, so every device settles on the same result whatever order
+        changes arrive in.
+        """
+        if not self.connection:
+            self.connect()
+
+        cursor = self.connection.cursor()
+        # Fields arrive decrypted and are encrypted with this vault's key
+        updates = [change for change in changes if not change['deleted']]
+        encrypted = self.encrypt_many([change['password'] for change in updates] +
+                                      [change['notes'] or None for change in updates] +
+                                      [self._meta_json(change) for change in updates])
+        count = len(updates)
+        cells = iter(zip(encrypted, encrypted[count:], encrypted[2 * count:]))
+        applied = 0
+        for change in changes:
+            sealed = None if change['deleted'] else next(cells)
+            incoming = (change['updated_at'], change['origin'], change['seq'])
+            cursor.execute("SELECT updated_at, origin, seq FROM passwords WHERE uuid = ?", (change['uuid'],))
+            current = cursor.fetchone()
+            if current is None:
+                cursor.execute("SELECT deleted_at, origin, seq FROM tombstones WHERE uuid = ?", (change['uuid'],))
+                current = cursor.fetchone()
+            if current is not None and incoming <= tuple(current):
+                continue
+
+            if change['deleted']:
+                cursor.execute("DELETE FROM passwords WHERE uuid = ?", (change['uuid'],))
+                cursor.execute(
+                    "INSERT OR REPLACE INTO tombstones (uuid, deleted_at, origin, seq) VALUES (?, ?, ?, ?)",
+                    (change['uuid'], change['updated_at'], change['origin'], change['seq']),
+                )
+            else:
+                cursor.execute("DELETE FROM tombstones WHERE uuid = ?", (change['uuid'],))
+                values = sealed + (change['created_at'], change['updated_at'], change['origin'], change['seq'])
+                cursor.execute(
+                    """UPDATE passwords SET title = '', username = NULL, url = NULL,
+                                            password_encrypted = ?, notes_encrypted = ?, meta_encrypted = ?,
+                                            created_at = ?, updated_at = ?, origin = ?, seq = ?
+                       WHERE uuid = ?""",
+                    values + (change['uuid'],),
+                )
+                if cursor.rowcount == 0:
+                    cursor.execute(
+                        """INSERT INTO passwords (title, password_encrypted, notes_encrypted, meta_encrypted,
+                                                  created_at, updated_at, origin, seq, uuid)
+                           VALUES ('', ?, ?, ?, ?, ?, ?, ?, ?)""",
+                        values + (change['uuid'],),
+                    )
+                row_id = cursor.execute("SELECT id FROM passwords WHERE uuid = ?", (change['uuid'],)).fetchone()[0]
+                self._index_entry(cursor, row_id, change)
+            applied += 1
+
+        self.connection.commit()
+        if applied:
             self._notify_change()
-        return cursor.rowcount > 0
+        return applied
+
+    def seal_changes(self, changes: List[Dict[str, Any]]) -> bytes:
+        """Serialize and encrypt a change set for upload with the sync key"""
+        if not self._sync_cipher:
+            raise RuntimeError("Database not unlocked")
+        return self._sync_cipher.encrypt(json.dumps(changes, separators=(',', ':')).encode())
+
+    def open_changes(self, data: bytes) -> List[Dict[str, Any]]:
+        """Decrypt a change set written by seal_changes(); raises InvalidToken for another sync key"""
+        if not self._sync_cipher:
+            raise RuntimeError("Database not unlocked")
+        return json.loads(self._sync_cipher.decrypt(data))
+
+    def reset_sync_identity(self) -> None:
+        """
+        Give this vault a new device ID, e.g. after restoring another
+        device's backup. Unsent changes of the old ID are re-stamped so
+        they are still uploaded, and the old ID is treated as a remote
+        device whose uploaded changes are already present.
+        """
+        if not self.connection:
+            self.connect()
+
+        cursor = self.connection.cursor()
+        old_id = self.get_sync_value('device_id')
+        pushed = int(self.get_sync_value('pushed_seq', '0'))
+        new_id = uuid.uuid4().hex[:16]
+        cursor.execute("UPDATE sync_state SET value = ? WHERE key = 'device_id'", (new_id,))
+        cursor.execute("UPDATE sync_state SET value = '0' WHERE key IN ('local_seq', 'pushed_seq')")
+        # What the old ID published and settled says nothing about the new one
+        cursor.execute("DELETE FROM sync_state WHERE key IN ('merge_log', 'settled', 'published_cursor', 'compacted_at')")
+        cursor.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)",
+                       (f"seen:{old_id}", str(pushed)))
+
+        for table in ('passwords', 'tombstones'):
+            cursor.execute(f"SELECT uuid FROM {table} WHERE origin = ? AND seq > ? ORDER BY seq",
+                           (old_id, pushed))
+            for (entry_uuid,) in cursor.fetchall():
+                origin, seq = self._next_change(cursor)
+                cursor.execute(f"UPDATE {table} SET origin = ?, seq = ? WHERE uuid = ?",
+                               (origin, seq, entry_uuid))
+        self.connection.commit()
@@ -0,0 +1,535 @@
+#!/usr/bin/env python3
+"""
+Ashy Pass - Fake Drive Server
+In-process HTTP server speaking the subset of the Drive v3 REST API used
+by DriveBackend. The real googleapiclient code path runs against it, so
+backups can be tested and benchmarked without a Google account.
+"""
+
+import re
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+import urllib.parse
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, List, Dict, Any
+
+from core.backup_backends import DriveBackend, DriveState, FOLDER_MIME_TYPE, BACKEND_FAKE_DRIVE
+
+DRIVE_ROOT = '/drive/v3/files'
+UPLOAD_ROOT = '/upload/drive/v3/files'
+SESSION_ROOT = '/upload/sessions/'
+BATCH_ROOT = '/batch/drive/v3'
+
+
+class FakeDriveStore:
+    """In-memory file table shared by all request handler threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.content: Dict[str, bytes] = {}
+        self.sessions: Dict[str, Dict[str, Any]] = {}
+        self.request_count = 0
+        self.bytes_received = 0
+        # Fault injection: list of HTTP statuses returned by the next requests
+        self.fail_queue: List[int] = []
+
+    def new_file(self, metadata: Dict[str, Any]) -> Dict[str, Any]:
+        file_id = uuid.uuid4().hex
+        now = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+        resource = {
+            'kind': 'drive#file',
+            'id': file_id,
+            'name': metadata.get('name', 'Untitled'),
+            'mimeType': metadata.get('mimeType', 'application/octet-stream'),
+            'parents': metadata.get('parents', []),
+            'trashed': False,
+            'createdTime': now,
+            'modifiedTime': now,
+        }
+        self.files[file_id] = resource
+        return resource
+
+    def missing_parent(self, metadata: Dict[str, Any]) -> Optional[str]:
+        """First parent ID that does not exist, as Drive rejects those"""
+        for parent in metadata.get('parents', []):
+            if parent not in self.files:
+                return parent
+        return None
+
+    def delete(self, file_id: str) -> bool:
+        """Remove a file; deleting a folder deletes its children"""
+        resource = self.files.pop(file_id, None)
+        self.content.pop(file_id, None)
+        if resource is None:
+            return False
+        if resource['mimeType'] == FOLDER_MIME_TYPE:
+            for child_id in [i for i, f in self.files.items() if file_id in f.get('parents', [])]:
+                self.files.pop(child_id, None)
+                self.content.pop(child_id, None)
+        return True
+
+    def set_content(self, file_id: str, data: bytes) -> Dict[str, Any]:
+        resource = self.files[file_id]
+        self.content[file_id] = data
+        revision = int(resource.get('headRevisionId', '0')) + 1
+        resource.update({
+            'size': str(len(data)),
+            'md5Checksum': hashlib.md5(data).hexdigest(),
+            'headRevisionId': str(revision),
+            'modifiedTime': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime()),
+        })
+        return resource
+
+
+def _match_query(resource: Dict[str, Any], query: str) -> bool:
+    """Evaluate the 'a and b and c' subset of the Drive query language"""
+    if not query:
+        return True
+    for clause in re.split(r'\s+and\s+', query.strip()):
+        m = re.fullmatch(r"(\w+)\s*(=|!=|contains)\s*'((?:[^'\\]|\\.)*)'", clause)
+        if m:
+            field, op, value = m.group(1), m.group(2), m.group(3).replace("\\'", "'")
+            actual = str(resource.get(field, ''))
+            if op == '=' and actual != value:
+                return False
+            if op == '!=' and actual == value:
+                return False
+            if op == 'contains' and value not in actual:
+                return False
+            continue
+        m = re.fullmatch(r"'([^']*)'\s+in\s+parents", clause)
+        if m:
+            if m.group(1) not in resource.get('parents', []):
+                return False
+            continue
+        m = re.fullmatch(r"trashed\s*=\s*(true|false)", clause)
+        if m:
+            if resource.get('trashed', False) != (m.group(1) == 'true'):
+                return False
+            continue
+        raise ValueError(f"Unsupported query clause: {clause}")
+    return True
+
+
+class FakeDriveHandler(BaseHTTPRequestHandler):
+    """Routes Drive v3 requests onto the shared FakeDriveStore"""
+
+    protocol_version = 'HTTP/1.1'
+    store: FakeDriveStore = None
+    latency = 0.0
+
+    def log_message(self, format, *args):
+        logging.debug("fake-drive: " + format % args)
+
+    # --- Helpers ---
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        self.store.bytes_received += len(body)
+        return body
+
+    def _send(self, status: int, body: bytes = b'', headers: Optional[Dict[str, str]] = None,
+              content_type: str = 'application/json') -> None:
+        self.send_response(status)
+        if body:
+            self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _json(self, status: int, data: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        self._send(status, json.dumps(data).encode(), headers)
+
+    def _error(self, status: int, reason: str, message: str = '') -> None:
+        self._json(status, {'error': {
+            'code': status,
+            'message': message or reason,
+            'errors': [{'reason': reason, 'message': message or reason}],
+        }})
+
+    def _route(self):
+        parsed = urllib.parse.urlparse(self.path)
+        params = {k: v[-1] for k, v in urllib.parse.parse_qs(parsed.query).items()}
+        return parsed.path, params
+
+    def _injected_failure(self) -> bool:
+        with self.store.lock:
+            self.store.request_count += 1
+            status = self.store.fail_queue.pop(0) if self.store.fail_queue else None
+        if self.latency:
+            time.sleep(self.latency)
+        if status is None:
+            return False
+        self._read_body()
+        reason = 'rateLimitExceeded' if status in (403, 429) else 'backendError'
+        self._error(status, reason)
+        return True
+
+    # --- Verbs ---
+
+    def do_GET(self):
+        if self._injected_failure():
+            return
+        path, params = self._route()
+        store = self.store
+
+        if path == DRIVE_ROOT:
+            try:
+                with store.lock:
+                    files = [dict(f) for f in store.files.values() if _match_query(f, params.get('q', ''))]
+            except ValueError as e:
+                return self._error(400, 'invalid', str(e))
+            return self._json(200, {'kind': 'drive#fileList', 'files': files})
+
+        if path.startswith(DRIVE_ROOT + '/'):
+            file_id = path[len(DRIVE_ROOT) + 1:]
+            with store.lock:
+                resource = store.files.get(file_id)
+                data = store.content.get(file_id, b'')
+            if resource is None:
+                return self._error(404, 'notFound', f"File not found: {file_id}")
+            if params.get('alt') != 'media':
+                return self._json(200, dict(resource))
+
+            range_header = self.headers.get('Range')
+            m = re.fullmatch(r'bytes=(\d+)-(\d*)', range_header or '')
+            if not m:
+                return self._send(200, data, content_type=resource['mimeType'])
+            start = int(m.group(1))
+            end = min(int(m.group(2)) if m.group(2) else len(data) - 1, len(data) - 1)
+            if start >= len(data) and data:
+                return self._send(416, headers={'Content-Range': f'bytes */{len(data)}'})
+            return self._send(206, data[start:end + 1], content_type=resource['mimeType'],
+                              headers={'Content-Range': f'bytes {start}-{end}/{len(data)}'})
+
+        self._error(404, 'notFound', path)
+
+    def do_POST(self):
+        if self._injected_failure():
+            return
+        path, params = self._route()
+        body = self._read_body()
+        store = self.store
+
+        if path == DRIVE_ROOT:
+            metadata = json.loads(body or b'{}')
+            with store.lock:
+                missing = store.missing_parent(metadata)
+                resource = None if missing else store.new_file(metadata)
+            if missing:
+                return self._error(404, 'notFound', f"File not found: {missing}")
+            return self._json(200, dict(resource))
+
+        if path == UPLOAD_ROOT:
+            return self._start_upload(None, params, body)
+
+        if path == BATCH_ROOT:
+            return self._batch(body)
+
+        self._error(404, 'notFound', path)
+
+    def do_PATCH(self):
+        if self._injected_failure():
+            return
+        path, params = self._route()
+        body = self._read_body()
+        store = self.store
+
+        if path.startswith(UPLOAD_ROOT + '/'):
+            file_id = path[len(UPLOAD_ROOT) + 1:]
+            with store.lock:
+                known = file_id in store.files
+            if not known:
+                return self._error(404, 'notFound', f"File not found: {file_id}")
+            return self._start_upload(file_id, params, body)
+
+        if path.startswith(DRIVE_ROOT + '/'):
+            file_id = path[len(DRIVE_ROOT) + 1:]
+            with store.lock:
+                resource = store.files.get(file_id)
+                if resource is not None:
+                    resource.update({k: v for k, v in json.loads(body or b'{}').items() if k != 'id'})
+            if resource is None:
+                return self._error(404, 'notFound', f"File not found: {file_id}")
+            return self._json(200, dict(resource))
+
+        self._error(404, 'notFound', path)
+
+    def do_DELETE(self):
+        if self._injected_failure():
+            return
+        path, _ = self._route()
+        self._read_body()
+        store = self.store
+
+        if path.startswith(DRIVE_ROOT + '/'):
+            file_id = path[len(DRIVE_ROOT) + 1:]
+            with store.lock:
+                deleted = store.delete(file_id)
+            if not deleted:
+                return self._error(404, 'notFound', f"File not found: {file_id}")
+            return self._send(204)
+
+        self._error(404, 'notFound', path)
+
+    def do_PUT(self):
+        if self._injected_failure():
+            return
+        path, _ = self._route()
+        body = self._read_body()
+        if path.startswith(SESSION_ROOT):
+            return self._upload_chunk(path[len(SESSION_ROOT):], body)
+        self._error(404, 'notFound', path)
+
+    # --- Batch ---
+
+    def _batch_call(self, method: str, path: str, body: bytes):
+        """Run one metadata call from a batch; returns (status, json body)"""
+        path = urllib.parse.urlparse(path).path
+        if not path.startswith(DRIVE_ROOT + '/'):
+            return 404, {'error': {'code': 404, 'message': path, 'errors': [{'reason': 'notFound'}]}}
+        file_id = path[len(DRIVE_ROOT) + 1:]
+        store = self.store
+        with store.lock:
+            if method == 'DELETE':
+                if store.delete(file_id):
+                    return 204, None
+            elif file_id in store.files:
+                if method == 'PATCH':
+                    store.files[file_id].update({k: v for k, v in json.loads(body or b'{}').items() if k != 'id'})
+                return 200, dict(store.files[file_id])
+        return 404, {'error': {'code': 404, 'message': f"File not found: {file_id}",
+                               'errors': [{'reason': 'notFound'}]}}
+
+    def _batch(self, body: bytes) -> None:
+        """Answer a multipart/mixed batch of application/http calls"""
+        content_type = self.headers.get('Content-Type', '')
+        message = BytesParser(policy=HTTP).parsebytes(
+            b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body)
+
+        boundary = uuid.uuid4().hex
+        out = []
+        for part in message.iter_parts():
+            content_id = part.get('Content-ID', '<+0>').strip('<>')
+            raw = part.get_payload(decode=True) or b''
+            head, _, inner_body = raw.partition(b'\r\n\r\n')
+            if not _:
+                head, _, inner_body = raw.partition(b'\n\n')
+            method, path = head.split(b' ', 2)[:2]
+            status, data = self._batch_call(method.decode(), path.decode(), inner_body)
+            payload = json.dumps(data).encode() if data is not None else b''
+            out.append(
+                f'--{boundary}\r\nContent-Type: application/http\r\n'
+                f'Content-ID: <response-{content_id}>\r\n\r\n'
+                f'HTTP/1.1 {status} {"OK" if status < 300 else "Error"}\r\n'
+                f'Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n'.encode()
+                + payload + b'\r\n')
+        out.append(f'--{boundary}--\r\n'.encode())
+        self._send(200, b''.join(out), content_type=f'multipart/mixed; boundary={boundary}')
+
+    # --- Uploads ---
+
+    def _start_upload(self, file_id: Optional[str], params: Dict[str, str], body: bytes) -> None:
+        """Handle uploadType=media|multipart|resumable for create and update"""
+        store = self.store
+        upload_type = params.get('uploadType', 'media')
+
+        if upload_type == 'resumable':
+            metadata = json.loads(body or b'{}')
+            with store.lock:
+                missing = store.missing_parent(metadata) if file_id is None else None
+            if missing:
+                return self._error(404, 'notFound', f"File not found: {missing}")
+            session_id = uuid.uuid4().hex
+            total = self.headers.get('X-Upload-Content-Length')
+            with store.lock:
+                store.sessions[session_id] = {
+                    'file_id': file_id,
+                    'metadata': metadata,
+                    'data': bytearray(),
+                    'total': int(total) if total else None,
+                }
+            host = self.headers.get('Host')
+            return self._send(200, headers={'Location': f'http://{host}{SESSION_ROOT}{session_id}'})
+
+        if upload_type == 'multipart':
+            content_type = self.headers.get('Content-Type', '')
+            message = BytesParser(policy=HTTP).parsebytes(
+                b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body)
+            parts = [part.get_payload(decode=True) for part in message.iter_parts()]
+            metadata, data = json.loads(parts[0] or b'{}'), parts[1] if len(parts) > 1 else b''
+        else:
+            metadata, data = {}, body
+
+        with store.lock:
+            missing = store.missing_parent(metadata) if file_id is None else None
+        if missing:
+            return self._error(404, 'notFound', f"File not found: {missing}")
+        return self._json(200, self._commit(file_id, metadata, bytes(data)))
+
+    def _commit(self, file_id: Optional[str], metadata: Dict[str, Any], data: bytes) -> Dict[str, Any]:
+        with self.store.lock:
+            if file_id is None:
+                resource = self.store.new_file(metadata)
+                file_id = resource['id']
+            else:
+                self.store.files[file_id].update({k: v for k, v in metadata.items() if k != 'id'})
+            return dict(self.store.set_content(file_id, data))
+
+    def _upload_chunk(self, session_id: str, body: bytes) -> None:
+        """Append a Content-Range chunk to a resumable session"""
+        store = self.store
+        with store.lock:
+            session = store.sessions.get(session_id)
+        if session is None:
+            return self._error(404, 'notFound', 'Upload session expired')
+
+        content_range = self.headers.get('Content-Range', '')
+        received = len(session['data'])
+
+        # Status query: "bytes */total"
+        m = re.fullmatch(r'bytes \*/(\d+|\*)', content_range)
+        if m:
+            if m.group(1) != '*':
+                session['total'] = int(m.group(1))
+            if session['total'] is not None and received >= session['total']:
+                return self._finish_session(session_id, session)
+            return self._incomplete(received)
+
+        m = re.fullmatch(r'bytes (\d+)-(\d+)/(\d+|\*)', content_range)
+        if not m and not content_range:
+            # Single-shot PUT without a range header
+            session['data'] = bytearray(body)
+            return self._finish_session(session_id, session)
+        if not m:
+            return self._error(400, 'badRequest', f"Bad Content-Range: {content_range}")
+
+        start = int(m.group(1))
+        if m.group(3) != '*':
+            session['total'] = int(m.group(3))
+        if start > received:
+            return self._error(400, 'badRequest', 'Chunk does not continue the upload')
+        # Overlapping resend after a lost response: keep only new bytes
+        session['data'] += body[received - start:]
+
+        if session['total'] is not None and len(session['data']) >= session['total']:
+            return self._finish_session(session_id, session)
+        return self._incomplete(len(session['data']))
+
+    def _incomplete(self, received: int) -> None:
+        headers = {'Range': f'bytes=0-{received - 1}'} if received else {}
+        self._send(308, headers=headers)
+
+    def _finish_session(self, session_id: str, session: Dict[str, Any]) -> None:
+        with self.store.lock:
+            self.store.sessions.pop(session_id, None)
+            file_id = session['file_id']
+            if file_id is not None and file_id not in self.store.files:
+                file_id = None
+        if session['file_id'] is not None and file_id is None:
+            return self._error(404, 'notFound', 'File was deleted during upload')
+        self._json(200, self._commit(file_id, session['metadata'], bytes(session['data'])))
+
+
+class FakeDriveServer:
+    """
+    Runs FakeDriveHandler on a loopback port in a daemon thread.
+    `latency` adds a fixed delay per request to model network round trips.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.store = FakeDriveStore()
+        handler = type('BoundFakeDriveHandler', (FakeDriveHandler,), {
+            'store': self.store,
+            'latency': latency,
+        })
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def start(self) -> 'FakeDriveServer':
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._server.serve_forever, name="fake-drive", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread = None
+
+    def fail_next(self, *statuses: int) -> None:
+        """Make the next requests fail with the given HTTP statuses"""
+        with self.store.lock:
+            self.store.fail_queue.extend(statuses)
+
+    def build_service(self):
+        """Drive v3 client bound to this server instead of googleapis.com"""
+        from googleapiclient import discovery_cache
+        from googleapiclient.discovery import build_from_document
+        from googleapiclient.http import build_http
+
+        document = json.loads(discovery_cache.get_static_doc('drive', 'v3'))
+        document['rootUrl'] = self.url
+        document['baseUrl'] = self.url + document['servicePath']
+        document.pop('mtlsRootUrl', None)
+        # build_http() stops httplib2 from treating upload 308s as redirects
+        return build_from_document(document, http=build_http())
+
+
+class FakeDriveBackend(DriveBackend):
+    """DriveBackend wired to a private FakeDriveServer"""
+
+    name = BACKEND_FAKE_DRIVE
+    needs_account = False
+
+    def __init__(self, server: Optional[FakeDriveServer] = None, **kwargs):
+        self.server = (server or FakeDriveServer()).start()
+        service = self.server.build_service()
+        super().__init__(lambda: service, state=DriveState(path=None), **kwargs)
+
+
+def _benchmark() -> None:
+    """Upload throughput through DriveBackend: python3 -m core.fake_drive [MB] [latency_ms]"""
+    import os
+    import sys
+    import tempfile
+    from pathlib import Path
+
+    size_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 50
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.0
+
+    backend = FakeDriveBackend(FakeDriveServer(latency=latency))
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp) / 'bench.db'
+        source.write_bytes(os.urandom(int(size_mb * 1024 * 1024)))
+
+        for label in ('cold', 'warm'):
+            requests_before = backend.server.store.request_count
+            start = time.perf_counter()
+            backend.upload_file('ashypass.db', source)
+            elapsed = time.perf_counter() - start
+            requests = backend.server.store.request_count - requests_before
+            print(f"{label}: {size_mb:.1f} MB in {elapsed:.3f}s "
+                  f"({size_mb / elapsed:.1f} MB/s, {requests} requests)")
+    backend.server.stop()
+
+
+if __name__ == '__main__':
+    _benchmark()
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Ashy Pass - Importers - Streaming readers for other password managers
+Bitwarden JSON, KeePass 2.x XML and 1Password .1pux exports are read
+incrementally, one item at a time, and fed to the same batched import
+path as CSV files, so multi-hundred-megabyte exports never have to fit
+in memory as a document tree.
+"""
+
+import io
+import json
+import os
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, Iterator, List, Optional, TextIO
+
+from core.csv_handler import CsvHandler, EntryReader, _CountingReader
+
+_WHITESPACE = re.compile(r'\s*')
+# What may still follow a number: "7." at the end of a chunk can be "7.5e10"
+_NUMBER_TAIL = re.compile(r'[0-9.eE+-]*\Z')
+
+
+class _JsonStream:
+    """
+    Pull parser over a text stream. Containers the caller cares about are
+    walked with iter_object() and iter_array(); everything else is read
+    whole with value(). Only the current item is held in memory.
+    """
+
+    def __init__(self, stream: TextIO, chunk_size: int = 64 * 1024):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        """Append the next chunk, dropping what has been consumed"""
+        if self.eof:
+            return False
+        data = self.stream.read(self.chunk_size)
+        if not data:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Next non-whitespace character, without consuming it"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON")
+
+    def expect(self, char: str) -> None:
+        """Consume char or fail"""
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} in JSON, found {self.buffer[self.pos]!r}")
+        self.pos += 1
+
+    def value(self) -> Any:
+        """Decode the next complete value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number is only complete once a delimiter follows it;
+                # up to the end of the buffer it may continue in the next chunk
+                if self.eof or not _NUMBER_TAIL.match(self.buffer, end):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def iter_object(self) -> Iterator[str]:
+        """Yield the keys of an object; the caller must consume each value"""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self._next('}'):
+                return
+
+    def iter_array(self) -> Iterator[None]:
+        """Yield once per array element; the caller must consume each element"""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield None
+            if self._next(']'):
+                return
+
+    def _next(self, close: str) -> bool:
+        """Consume ',' or the closing bracket; True at the closing bracket"""
+        char = self.peek()
+        if char not in (',', close):
+            raise ValueError(f"Expected ',' or {close!r} in JSON, found {char!r}")
+        self.pos += 1
+        return char == close
+
+
+def _entry(title: Optional[str], url: Optional[str], username: Optional[str], password: Optional[str],
+           notes: Optional[str], extra: List[str], folder: Optional[str]) -> Optional[Dict[str, str]]:
+    """
+    An Ashy Pass entry. Entries have no folders or custom fields, so those
+    are kept as lines in the notes.
+    """
+    lines = [f"Folder: {folder}"] if folder else []
+    lines.extend(extra)
+    if notes:
+        lines.append(notes)
+    entry = {
+        'title': title or 'Untitled',
+        'url': url or '',
+        'username': username or '',
+        'password': password or '',
+        'notes': '\n'.join(lines),
+    }
+    # Same rule as CSV import: keep entries with a password or a title
+    if entry['password'] or entry['title'] != 'Untitled':
+        return entry
+    return None
+
+
+def _open_text(raw, counter: Optional[_CountingReader]) -> io.TextIOWrapper:
+    """Text view of a binary stream, counting bytes read for progress"""
+    source = counter if counter is not None else _CountingReader(None)
+    source.raw = raw
+    return io.TextIOWrapper(io.BufferedReader(source), encoding='utf-8-sig')
+
+
+# --- Bitwarden ---
+
+BITWARDEN_LOGIN = 1
+BITWARDEN_SECURE_NOTE = 2
+
+
+def _bitwarden_entry(item: Dict[str, Any], folders: Dict[str, str]) -> Optional[Dict[str, str]]:
+    """Map a login or secure note; cards and identities have no login to map"""
+    if item.get('type') not in (BITWARDEN_LOGIN, BITWARDEN_SECURE_NOTE):
+        return None
+
+    login = item.get('login') or {}
+    uris = [uri['uri'] for uri in login.get('uris') or [] if uri.get('uri')]
+    extra = []
+    if len(uris) > 1:
+        extra.append(f"Other URLs: {', '.join(uris[1:])}")
+    if login.get('totp'):
+        extra.append(f"TOTP: {login['totp']}")
+    for field in item.get('fields') or []:
+        extra.append(f"{field.get('name') or ''}: {field.get('value') or ''}")
+
+    return _entry(item.get('name'), uris[0] if uris else '', login.get('username'), login.get('password'),
+                  item.get('notes'), extra, folders.get(item.get('folderId')))
+
+
+def iter_bitwarden_json(file_path: str, counter: Optional[_CountingReader] = None) -> Iterator[Dict[str, str]]:
+    """
+    Yield entries from an unencrypted Bitwarden JSON export. Bitwarden
+    writes folders before items, so folder names are known by then.
+    """
+    with open(file_path, 'rb', buffering=0) as raw, _open_text(raw, counter) as text:
+        stream = _JsonStream(text)
+        folders: Dict[str, str] = {}
+        for key in stream.iter_object():
+            if key == 'encrypted':
+                if stream.value():
+                    raise ValueError("Encrypted Bitwarden exports cannot be imported; export as unencrypted JSON")
+            elif key == 'folders':
+                for _ in stream.iter_array():
+                    folder = stream.value()
+                    folders[folder.get('id')] = folder.get('name') or ''
+            elif key == 'items':
+                for _ in stream.iter_array():
+                    entry = _bitwarden_entry(stream.value(), folders)
+                    if entry:
+                        yield entry
+            else:
+                stream.value()
+
+
+# --- KeePass ---
+
+_KEEPASS_FIELDS = {'Title', 'UserName', 'Password', 'URL', 'Notes'}
+
+
+def _keepass_entry(element: ET.Element, groups: List[str]) -> Optional[Dict[str, str]]:
+    """Map an <Entry>; custom strings go to the notes"""
+    fields: Dict[str, str] = {}
+    extra = []
+    for string in element.iterfind('String'):
+        key = string.findtext('Key') or ''
+        value = string.findtext('Value') or ''
+        if key in _KEEPASS_FIELDS:
+            fields[key] = value
+        elif value:
+            extra.append(f"{key}: {value}")
+
+    # The first group is the database root
+    folder = '/'.join(name for name in groups[1:] if name)
+    return _entry(fields.get('Title'), fields.get('URL'), fields.get('UserName'), fields.get('Password'),
+                  fields.get('Notes'), extra, folder)
+
+
+def iter_keepass_xml(file_path: str, counter: Optional[_CountingReader] = None) -> Iterator[Dict[str, str]]:
+    """
+    Yield entries from a KeePass 2.x XML export with iterparse. Finished
+    entries and groups are removed from the tree as the parse goes, and
+    entry history and the recycle bin are skipped.
+    """
+    with open(file_path, 'rb', buffering=0) as raw:
+        source = counter if counter is not None else _CountingReader(None)
+        source.raw = raw
+
+        open_elements: List[ET.Element] = []
+        groups: List[str] = []
+        group_uuids: List[str] = []
+        recycle_bin: Optional[str] = None
+        history_depth = 0
+
+        for event, element in ET.iterparse(io.BufferedReader(source), events=('start', 'end')):
+            if event == 'start':
+                open_elements.append(element)
+                if element.tag == 'Group':
+                    groups.append('')
+                    group_uuids.append('')
+                elif element.tag == 'History':
+                    history_depth += 1
+                continue
+
+            open_elements.pop()
+            parent = open_elements[-1] if open_elements else None
+            tag = element.tag
+
+            if parent is not None and parent.tag == 'Group':
+                if tag == 'Name':
+                    groups[-1] = element.text or ''
+                elif tag == 'UUID':
+                    group_uuids[-1] = element.text or ''
+            elif tag == 'RecycleBinUUID':
+                recycle_bin = element.text
+
+            if tag == 'Entry':
+                if not history_depth and not (recycle_bin and recycle_bin in group_uuids):
+                    entry = _keepass_entry(element, groups)
+                    if entry:
+                        yield entry
+            elif tag == 'History':
+                history_depth -= 1
+            elif tag == 'Group':
+                groups.pop()
+                group_uuids.pop()
+
+            # Drop what has been handled so memory stays flat
+            if parent is not None and tag in ('Entry', 'Group', 'History', 'Meta'):
+                parent.remove(element)
+
+
+# --- 1Password ---
+
+_1PUX_DATA = 'export.data'
+
+
+def _1password_entry(item: Dict[str, Any], vault: str) -> Optional[Dict[str, str]]:
+    """Map a 1Password item; section fields go to the notes"""
+    if item.get('state') == 'archived' or item.get('trashed'):
+        return None
+
+    overview = item.get('overview') or {}
+    details = item.get('details') or {}
+    username = password = ''
+    for field in details.get('loginFields') or []:
+        if field.get('designation') == 'username':
+            username = field.get('value') or ''
+        elif field.get('designation') == 'password':
+            password = field.get('value') or ''
+    if not password and details.get('password'):
+        password = details['password']
+
+    extra = []
+    for section in details.get('sections') or []:
+        for field in section.get('fields') or []:
+            value = field.get('value')
+            if isinstance(value, dict):
+                # Values are typed, e.g. {"concealed": "..."} or {"totp": "..."}
+                value = next((v for v in value.values() if isinstance(v, (str, int, float))), '')
+            if value not in (None, ''):
+                extra.append(f"{field.get('title') or ''}: {value}")
+
+    return _entry(overview.get('title'), overview.get('url'), username, password,
+                  details.get('notesPlain'), extra, vault)
+
+
+def iter_1password_1pux(file_path: str, counter: Optional[_CountingReader] = None) -> Iterator[Dict[str, str]]:
+    """
+    Yield entries from a 1Password .1pux export, a ZIP archive whose
+    export.data is walked as accounts > vaults > items. Progress counts
+    uncompressed bytes of export.data.
+    """
+    with zipfile.ZipFile(file_path) as archive:
+        info = archive.getinfo(_1PUX_DATA)
+        if counter is not None:
+            counter.total_bytes = info.file_size
+        with archive.open(info) as raw, _open_text(raw, counter) as text:
+            stream = _JsonStream(text)
+            for key in stream.iter_object():
+                if key != 'accounts':
+                    stream.value()
+                    continue
+                for _ in stream.iter_array():
+                    for account_key in stream.iter_object():
+                        if account_key != 'vaults':
+                            stream.value()
+                            continue
+                        for _ in stream.iter_array():
+                            vault = ''
+                            for vault_key in stream.iter_object():
+                                if vault_key == 'attrs':
+                                    vault = (stream.value() or {}).get('name') or ''
+                                elif vault_key == 'items':
+                                    for _ in stream.iter_array():
+                                        entry = _1password_entry(stream.value(), vault)
+                                        if entry:
+                                            yield entry
+                                else:
+                                    stream.value()
+
+
+# --- Format selection ---
+
+IMPORT_FORMATS: Dict[str, EntryReader] = {
+    'csv': CsvHandler.iter_csv,
+    'bitwarden': iter_bitwarden_json,
+    'keepass': iter_keepass_xml,
+    '1password': iter_1password_1pux,
+}
+
+_EXTENSIONS = {
+    '.csv': 'csv',
+    '.json': 'bitwarden',
+    '.xml': 'keepass',
+    '.1pux': '1password',
+    '.ashy': 'ashy',
+}
+
+
+def detect_format(file_path: str) -> str:
+    """Import format of a file, from its extension"""
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension not in _EXTENSIONS:
+        raise ValueError(f"Unsupported import file type: {extension or os.path.basename(file_path)}")
+    return _EXTENSIONS[extension]
+
+
+def get_reader(file_path: str) -> EntryReader:
+    """
+    Entry reader for a file, to pass to CsvHandler.import_into_database().
+    Archives need a passphrase; see core.vault_archive.iter_archive().
+    """
+    kind = detect_format(file_path)
+    if kind not in IMPORT_FORMATS:
+        raise ValueError(f"{os.path.basename(file_path)} needs a passphrase to import")
+    return IMPORT_FORMATS[kind]
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Ashy Pass - Jobs - Background runner for long vault operations
+Imports, exports, restores and sign-in run as named jobs on a small
+bounded pool. Each job has a cancel token and reports progress; changes
+are handed to a dispatch function (GLib.idle_add in the UI) so
+listeners always run on the GTK loop. Work that runs elsewhere, such as
+the persistent backup queue, can be shown in the same list with track().
+"""
+
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, List, Optional
+
+JOB_WORKERS = 2
+# Finished jobs kept for the job list
+KEEP_FINISHED = 10
+# Minimum seconds between progress notifications of one job
+PROGRESS_INTERVAL = 0.1
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when its cancel token is set"""
+
+
+class CancelToken(threading.Event):
+    """Set to ask a job to stop; can be passed wherever a threading.Event is expected"""
+
+    def raise_if_cancelled(self) -> None:
+        if self.is_set():
+            raise JobCancelled()
+
+
+@dataclass
+class Job:
+    """A unit of background work and its visible state"""
+    id: int
+    name: str
+    cancellable: bool = True
+    state: str = QUEUED
+    fraction: Optional[float] = None
+    message: str = ''
+    error: Optional[str] = None
+    result: Any = None
+    created: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+    token: CancelToken = field(default_factory=CancelToken, repr=False)
+    _on_cancel: Optional[Callable[[], None]] = field(default=None, repr=False)
+    _last_report: float = field(default=0.0, repr=False)
+
+    @property
+    def active(self) -> bool:
+        return self.state in (QUEUED, RUNNING)
+
+    def cancel(self) -> None:
+        """Ask the job to stop at its next check"""
+        if self.cancellable and self.active:
+            self.token.set()
+            if self._on_cancel:
+                self._on_cancel()
+
+
+class JobContext:
+    """Handed to a job function to report progress and check for cancel"""
+
+    def __init__(self, runner: 'JobRunner', job: Job):
+        self._runner = runner
+        self.job = job
+
+    @property
+    def token(self) -> CancelToken:
+        return self.job.token
+
+    def check(self) -> None:
+        """Raise JobCancelled if the job was cancelled"""
+        self.job.token.raise_if_cancelled()
+
+    def report(self, fraction: Optional[float] = None, message: Optional[str] = None) -> None:
+        """Update progress (0..1, or None if unknown) and/or the status message"""
+        if fraction is not None:
+            self.job.fraction = max(0.0, min(1.0, fraction))
+        if message is not None:
+            self.job.message = message
+        self._runner._progress(self.job)
+
+    def finish(self, error: Optional[str] = None) -> None:
+        """End a job created with JobRunner.track()"""
+        self._runner._finish(self.job, error=error)
+
+
+class JobRunner:
+    """Runs named jobs on a bounded pool and keeps the list the UI shows"""
+
+    def __init__(self, max_workers: int = JOB_WORKERS,
+                 dispatch: Optional[Callable[..., Any]] = None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ashypass-job')
+        self._dispatch = dispatch or (lambda func, *args: func(*args))
+        self._lock = threading.Lock()
+        self._jobs: List[Job] = []
+        self._ids = itertools.count(1)
+        self._listeners: List[Callable[[], None]] = []
+        self._progress_callbacks = {}
+        self._done_callbacks = {}
+
+    # --- Listeners ---
+
+    def add_listener(self, callback: Callable[[], None]) -> None:
+        """Called on the dispatch loop whenever a job is added, changes or ends"""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[], None]) -> None:
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def _notify(self) -> None:
+        self._dispatch(self._call_listeners)
+
+    def _call_listeners(self) -> bool:
+        for callback in list(self._listeners):
+            try:
+                callback()
+            except Exception as e:
+                logging.error(f"Error in job listener: {e}")
+        return False
+
+    # --- Jobs ---
+
+    def jobs(self) -> List[Job]:
+        """Active jobs, then recently finished ones, oldest first"""
+        with self._lock:
+            return list(self._jobs)
+
+    def submit(self, name: str, func: Callable[[JobContext], Any],
+               on_done: Optional[Callable[[Job], None]] = None,
+               on_progress: Optional[Callable[[Job], None]] = None,
+               cancellable: bool = True) -> Job:
+        """
+        Run func(context) in the background. on_progress and on_done are
+        called on the dispatch loop; on_done always runs, whatever the
+        outcome, and finds it in job.state, job.result and job.error.
+        """
+        job = Job(id=next(self._ids), name=name, cancellable=cancellable)
+        with self._lock:
+            self._jobs.append(job)
+            if on_progress:
+                self._progress_callbacks[job.id] = on_progress
+            if on_done:
+                self._done_callbacks[job.id] = on_done
+        self._notify()
+        self._executor.submit(self._run, job, func)
+        return job
+
+    def track(self, name: str, on_cancel: Optional[Callable[[], None]] = None) -> JobContext:
+        """
+        Show work that runs outside the pool; call report() and finish()
+        on the returned context
+        """
+        job = Job(id=next(self._ids), name=name, cancellable=on_cancel is not None,
+                  state=RUNNING, _on_cancel=on_cancel)
+        with self._lock:
+            self._jobs.append(job)
+        self._notify()
+        return JobContext(self, job)
+
+    def clear_finished(self) -> None:
+        """Drop finished jobs from the list"""
+        with self._lock:
+            self._jobs = [job for job in self._jobs if job.active]
+        self._notify()
+
+    def shutdown(self) -> None:
+        """Cancel everything and stop accepting work"""
+        for job in self.jobs():
+            job.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job: Job, func: Callable[[JobContext], Any]) -> None:
+        if job.token.is_set():
+            self._finish(job, cancelled=True)
+            return
+
+        job.state = RUNNING
+        self._notify()
+        try:
+            job.result = func(JobContext(self, job))
+            # A job may stop early on cancel and still return what it did
+            self._finish(job, cancelled=job.token.is_set())
+        except JobCancelled:
+            self._finish(job, cancelled=True)
+        except Exception as e:
+            logging.error(f"Job '{job.name}' failed: {e}")
+            self._finish(job, error=str(e))
+
+    def _progress(self, job: Job) -> None:
+        now = time.monotonic()
+        if now - job._last_report < PROGRESS_INTERVAL:
+            return
+        job._last_report = now
+        callback = self._progress_callbacks.get(job.id)
+        if callback:
+            self._dispatch(self._call, callback, job)
+        self._notify()
+
+    def _finish(self, job: Job, error: Optional[str] = None, cancelled: bool = False) -> None:
+        job.state = FAILED if error else CANCELLED if cancelled else DONE
+        job.error = error
+        job.finished = time.time()
+        with self._lock:
+            self._progress_callbacks.pop(job.id, None)
+            callback = self._done_callbacks.pop(job.id, None)
+            finished = [j for j in self._jobs if not j.active]
+            for old in finished[:-KEEP_FINISHED]:
+                self._jobs.remove(old)
+        if callback:
+            self._dispatch(self._call, callback, job)
+        self._notify()
+
+    @staticmethod
+    def _call(callback: Callable[[Job], None], job: Job) -> bool:
+        try:
+            callback(job)
+        except Exception as e:
+            logging.error(f"Error in job callback: {e}")
+        return False
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Ashy Pass - Secret Buffer - Locked, wipeable memory for plaintext secrets
+Python strings are immutable and copied freely, so a decrypted password
+held as a str stays somewhere in the heap until it happens to be reused.
+A SecretBuffer is an anonymous mmap region locked into RAM with mlock
+(never swapped), left out of core dumps, and zeroed when cleared, closed
+or when the session locks. Secrets are decrypted straight into it and
+handed on as memoryviews.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import mmap
+import threading
+import weakref
+from typing import Optional, Union
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+_libc = None
+_mlock_failed = False
+_live: 'weakref.WeakSet[SecretBuffer]' = weakref.WeakSet()
+_live_lock = threading.Lock()
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    return _libc
+
+
+def _address(region: mmap.mmap) -> int:
+    # The ctypes view must not outlive this call, or the map cannot be closed
+    view = ctypes.c_char.from_buffer(region)
+    try:
+        return ctypes.addressof(view)
+    finally:
+        del view
+
+
+def _lock_pages(region: mmap.mmap) -> bool:
+    """mlock a region; without the privilege or with RLIMIT_MEMLOCK reached the buffer still works, unlocked"""
+    global _mlock_failed
+    if hasattr(mmap, 'MADV_DONTDUMP'):
+        region.madvise(mmap.MADV_DONTDUMP)
+    try:
+        if _get_libc().mlock(ctypes.c_void_p(_address(region)), ctypes.c_size_t(len(region))) == 0:
+            return True
+        error = ctypes.get_errno()
+    except (OSError, AttributeError) as e:
+        error = e
+    if not _mlock_failed:
+        _mlock_failed = True
+        logging.warning(f"Could not lock secret memory, it may be swapped: {error}")
+    return False
+
+
+def wipe_all() -> None:
+    """Zero every live buffer created with wipe_on_lock, e.g. when the session locks"""
+    with _live_lock:
+        buffers = list(_live)
+    for buffer in buffers:
+        buffer.clear()
+
+
+class SecretBuffer:
+    """
+    Growable byte buffer in locked memory. append() and decrypt_into()
+    add to the end and return a memoryview of what was added; view()
+    covers the whole content. Views are only valid until the next clear(),
+    reserve() or close(). Use as a context manager to close on exit.
+    """
+
+    def __init__(self, capacity: int = 0, wipe_on_lock: bool = True):
+        self._map: Optional[mmap.mmap] = None
+        self._locked = False
+        self._length = 0
+        self.reserve(capacity)
+        if wipe_on_lock:
+            with _live_lock:
+                _live.add(self)
+
+    @classmethod
+    def from_bytes(cls, data: BytesLike, wipe_on_lock: bool = True) -> 'SecretBuffer':
+        buffer = cls(len(data), wipe_on_lock)
+        buffer.append(data)
+        return buffer
+
+    @classmethod
+    def from_str(cls, text: str, wipe_on_lock: bool = True) -> 'SecretBuffer':
+        """For secrets that already exist as a str, e.g. a generated password"""
+        return cls.from_bytes(text.encode(), wipe_on_lock)
+
+    @property
+    def capacity(self) -> int:
+        return len(self._map) if self._map is not None else 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __bool__(self) -> bool:
+        return self._length > 0
+
+    def __enter__(self) -> 'SecretBuffer':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def reserve(self, capacity: int) -> None:
+        """Make room for at least capacity bytes; a new region starts empty"""
+        if capacity <= self.capacity:
+            return
+        self.close()
+        size = -(-capacity // mmap.PAGESIZE) * mmap.PAGESIZE
+        self._map = mmap.mmap(-1, size, flags=mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS)
+        self._locked = _lock_pages(self._map)
+
+    def append(self, data: BytesLike) -> memoryview:
+        """Copy data to the end of the buffer and return a view of it"""
+        start = self._length
+        self.write(data)
+        return memoryview(self._map)[start:self._length]
+
+    def write(self, data: BytesLike) -> None:
+        """Copy data to the end of the buffer"""
+        end = self._length + len(data)
+        if end > self.capacity:
+            raise ValueError("SecretBuffer is full; reserve() more before writing")
+        self._map[self._length:end] = data
+        self._length = end
+
+    def tail(self, size: int) -> memoryview:
+        """Writable view of the next size bytes; follow with commit()"""
+        if self._length + size > self.capacity:
+            raise ValueError("SecretBuffer is full; reserve() more before writing")
+        return memoryview(self._map)[self._length:self._length + size]
+
+    def commit(self, size: int) -> memoryview:
+        """Keep size bytes written through tail(); returns a view of them"""
+        start = self._length
+        self._length += size
+        return memoryview(self._map)[start:self._length]
+
+    def view(self) -> memoryview:
+        """Read-only view of the content"""
+        if self._map is None:
+            return memoryview(b'')
+        return memoryview(self._map)[:self._length].toreadonly()
+
+    def decode(self) -> str:
+        """A str copy, for APIs that accept nothing else; it cannot be wiped"""
+        return self.view().tobytes().decode()
+
+    def clear(self) -> None:
+        """Zero the content"""
+        if self._map is not None and self._length:
+            self._map[:self._length] = bytes(self._length)
+        self._length = 0
+
+    def close(self) -> None:
+        """Zero and release the memory"""
+        if self._map is None:
+            return
+        self._length = len(self._map)
+        self.clear()
+        region, self._map = self._map, None
+        try:
+            if self._locked:
+                _get_libc().munlock(ctypes.c_void_p(_address(region)), ctypes.c_size_t(len(region)))
+            region.close()
+        except BufferError:
+            # A view is still held somewhere; the pages are already zeroed
+            # and are unmapped once it goes away
+            pass
+        self._locked = False
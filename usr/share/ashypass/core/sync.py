@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Ashy Pass - Sync - Row-level change exchange between devices
+Each device uploads its own changes as small encrypted change sets next
+to the backups and downloads the change sets of other devices it has
+not seen yet, so a sync costs as much as the changes, not the vault.
+Devices also publish how far they have merged everyone's changes; once
+all of them are past a run of a device's change sets, that device merges
+the run into one and deletions everyone has merged are forgotten, so the
+history kept does not grow with every sync.
+"""
+
+import json
+import time
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, List, Dict, Optional, Tuple
+
+from core.database import Database
+from core.backup_backends import BackupBackend
+
+CHANGESET_PREFIX = 'sync-'
+CHANGESET_SUFFIX = '.changes'
+# The sync group's key, wrapped by the master password
+SYNC_KEY_NAME = 'sync-key.json'
+# How far a device has merged each device's changes: sync-<device>.seen
+CURSOR_SUFFIX = '.seen'
+# Own change sets every device has merged before they are merged into one
+COMPACT_AFTER = 16
+# Devices silent for longer are no longer waited for; an entry deleted
+# meanwhile can come back from such a device when it returns
+CURSOR_EXPIRY = 90 * 86400
+# An unchanged cursor is uploaded again this often, to show the device is alive
+CURSOR_REFRESH = 86400
+
+
+def changeset_name(device_id: str, first: int, last: int) -> str:
+    """Backend file name of a change set covering sequence numbers first..last"""
+    return f"{CHANGESET_PREFIX}{device_id}-{first:010d}-{last:010d}{CHANGESET_SUFFIX}"
+
+
+def parse_changeset_name(name: str) -> Optional[Tuple[str, int, int]]:
+    """Device ID and sequence range of a change set file, or None"""
+    if not (name.startswith(CHANGESET_PREFIX) and name.endswith(CHANGESET_SUFFIX)):
+        return None
+    parts = name[len(CHANGESET_PREFIX):-len(CHANGESET_SUFFIX)].split('-')
+    if len(parts) != 3:
+        return None
+    try:
+        return parts[0], int(parts[1]), int(parts[2])
+    except ValueError:
+        return None
+
+
+def cursor_name(device_id: str) -> str:
+    """Backend file name of a device's cursor"""
+    return f"{CHANGESET_PREFIX}{device_id}{CURSOR_SUFFIX}"
+
+
+def group_changesets(listing: List[Dict[str, Any]]) -> Dict[str, List[Tuple[int, int, str]]]:
+    """Change sets in a backend listing by device, as sorted (first, last, name)"""
+    grouped: Dict[str, List[Tuple[int, int, str]]] = {}
+    for item in listing:
+        parsed = parse_changeset_name(item['name'])
+        if parsed is not None:
+            origin, first, last = parsed
+            grouped.setdefault(origin, []).append((first, last, item['name']))
+    for changesets in grouped.values():
+        changesets.sort()
+    return grouped
+
+
+@dataclass
+class SyncResult:
+    """What one sync round did"""
+    pushed: int = 0
+    pulled: int = 0
+    applied: int = 0
+    compacted: int = 0
+
+
+class SyncEngine:
+    """
+    Exchanges row changes through a backup backend. Change sets are
+    sealed with a random sync key shared by the sync group: the first
+    device publishes it wrapped by its master password with a random salt,
+    and others join by unwrapping it with the same password on their next
+    unlock. Changing the master password later keeps the key, so devices
+    keep syncing; devices joining afterwards need the newest password.
+    """
+
+    def __init__(self, database: Database, get_backend: Callable[[], BackupBackend]):
+        self.database = database
+        self._get_backend = get_backend
+
+    def sync(self) -> SyncResult:
+        """Push local changes, then pull and merge other devices' changes"""
+        if not self.database.is_unlocked():
+            raise RuntimeError("Database not unlocked")
+
+        # The worker thread needs its own connection
+        db = self.database.clone()
+        try:
+            backend = self._get_backend()
+            result = SyncResult()
+            if not self._join(db, backend):
+                return result
+            result.pushed = self._push(db, backend)
+            listing = backend.list_files(CHANGESET_PREFIX)
+            result.pulled, result.applied = self._pull(db, backend, group_changesets(listing))
+            self._log_merge(db)
+            result.compacted = self._compact(db, backend, listing)
+            self._publish_cursor(db, backend, listing)
+        finally:
+            db.close()
+
+        logging.info(f"Sync: pushed {result.pushed}, pulled {result.pulled}, applied {result.applied} changes")
+        return result
+
+    def _join(self, db: Database, backend: BackupBackend) -> bool:
+        """
+        Make sure this device seals change sets with the group's key,
+        publishing its own if there is no group yet. False while it waits
+        for an unlock to join a group with another key.
+        """
+        local = db.get_sync_key_record()
+        try:
+            remote = json.loads(backend.download_bytes(SYNC_KEY_NAME))
+        except FileNotFoundError:
+            remote = None
+
+        if remote is not None and remote['key_id'] != local['key_id']:
+            db.offer_sync_key(remote)
+            logging.warning("Other devices use another sync key; unlock the vault again to join them")
+            return False
+        if remote is None or remote['updated'] < local['updated']:
+            # First device, or the master password was changed here
+            backend.upload_bytes(SYNC_KEY_NAME, json.dumps(local).encode(), 'application/json',
+                                 new=remote is None)
+
+        if db.get_sync_value('republish') == '1':
+            # Change sets sealed before joining are unreadable to the group
+            own = group_changesets(backend.list_files(CHANGESET_PREFIX)).get(db.get_sync_value('device_id'), [])
+            backend.delete_files(name for _, _, name in own)
+            db.set_sync_value('republish', '0')
+        return True
+
+    def _push(self, db: Database, backend: BackupBackend) -> int:
+        """Upload local changes made since the last push as one change set"""
+        pushed_seq = int(db.get_sync_value('pushed_seq', '0'))
+        changes = db.get_local_changes(pushed_seq)
+        if not changes:
+            return 0
+
+        last = changes[-1]['seq']
+        name = changeset_name(db.get_sync_value('device_id'), pushed_seq + 1, last)
+        backend.upload_bytes(name, db.seal_changes(changes), new=True)
+        db.set_sync_value('pushed_seq', last)
+        return len(changes)
+
+    def _pull(self, db: Database, backend: BackupBackend,
+              changesets: Dict[str, List[Tuple[int, int, str]]]) -> Tuple[int, int]:
+        """Download and merge change sets from other devices not seen yet"""
+        from cryptography.fernet import InvalidToken
+
+        device_id = db.get_sync_value('device_id')
+        pulled = applied = 0
+        for origin, runs in changesets.items():
+            if origin == device_id:
+                continue
+            seen = int(db.get_sync_value(f"seen:{origin}", '0'))
+            for first, last, name in runs:
+                if last <= seen:
+                    continue
+                try:
+                    changes = db.open_changes(backend.download_bytes(name))
+                except FileNotFoundError:
+                    # Merged into one by its device since listing; next round reads that
+                    break
+                except InvalidToken:
+                    logging.error(f"Cannot read change set {name}; it was sealed with another sync key")
+                    break
+                changes = [c for c in changes if c['seq'] > seen]
+                applied += db.apply_remote_changes(changes)
+                pulled += len(changes)
+                seen = last
+                db.set_sync_value(f"seen:{origin}", seen)
+        return pulled, applied
+
+    def _log_merge(self, db: Database) -> None:
+        """
+        Note what this device has merged after a round, with how much it
+        had sent by then: anything a tombstone merged here deleted was sent
+        earlier, so once those change sets are compacted it is gone from
+        the backend (see _settle)
+        """
+        pushed = int(db.get_sync_value('pushed_seq', '0'))
+        seen = db.get_seen()
+        seen[db.get_sync_value('device_id')] = pushed
+        log = json.loads(db.get_sync_value('merge_log', '[]'))
+        if log and log[-1]['seen'] == seen:
+            return
+        # Merges never go back, so the newest entry per amount sent covers the older ones
+        if log and log[-1]['pushed'] == pushed:
+            log.pop()
+        log.append({'pushed': pushed, 'seen': seen})
+        db.set_sync_value('merge_log', json.dumps(log))
+
+    def _settle(self, db: Database, covered: int) -> None:
+        """
+        Record that this device's change sets no longer hold versions of
+        entries deleted by tombstones it had merged once it had sent at most
+        `covered`: those change sets were compacted since, or deleted.
+        Other devices prune a tombstone once every device has settled it.
+        """
+        log = json.loads(db.get_sync_value('merge_log', '[]'))
+        settled = json.loads(db.get_sync_value('settled', '{}'))
+        pending = []
+        for entry in log:
+            if entry['pushed'] > covered:
+                pending.append(entry)
+                continue
+            for origin, seq in entry['seen'].items():
+                settled[origin] = max(settled.get(origin, 0), seq)
+        if len(pending) != len(log):
+            db.set_sync_value('merge_log', json.dumps(pending))
+            db.set_sync_value('settled', json.dumps(settled))
+
+    def _publish_cursor(self, db: Database, backend: BackupBackend, listing: List[Dict[str, Any]]) -> None:
+        """Tell other devices how far this one has merged and settled every device's changes"""
+        device_id = db.get_sync_value('device_id')
+        own = group_changesets(listing).get(device_id, [])
+        # Changes sent before the oldest change set left are stored nowhere
+        self._settle(db, own[0][0] - 1 if own else int(db.get_sync_value('pushed_seq', '0')))
+
+        seen = db.get_seen()
+        seen[device_id] = int(db.get_sync_value('pushed_seq', '0'))
+        settled = json.loads(db.get_sync_value('settled', '{}'))
+        published = json.loads(db.get_sync_value('published_cursor', '{}'))
+        now = int(time.time())
+        if published.get('seen') == seen and published.get('settled') == settled and \
+                now - published.get('updated', 0) < CURSOR_REFRESH:
+            return
+
+        cursor = {'seen': seen, 'settled': settled, 'updated': now}
+        backend.upload_bytes(cursor_name(device_id), json.dumps(cursor).encode(), 'application/json')
+        db.set_sync_value('published_cursor', json.dumps(cursor))
+
+    def _load_cursors(self, backend: BackupBackend, listing: List[Dict[str, Any]],
+                      device_id: str) -> Dict[str, Dict[str, Any]]:
+        """Cursors of the other devices that synced lately, by device"""
+        cursors = {}
+        now = int(time.time())
+        for item in listing:
+            name = item['name']
+            if not name.endswith(CURSOR_SUFFIX):
+                continue
+            other = name[len(CHANGESET_PREFIX):-len(CURSOR_SUFFIX)]
+            if other == device_id:
+                continue
+            try:
+                cursor = json.loads(backend.download_bytes(name))
+            except FileNotFoundError:
+                continue
+            if now - cursor['updated'] < CURSOR_EXPIRY:
+                cursors[other] = cursor
+        return cursors
+
+    def _compact(self, db: Database, backend: BackupBackend, listing: List[Dict[str, Any]]) -> int:
+        """
+        Merge this device's change sets every other device is past into
+        one holding just the latest version of each entry, and forget
+        tombstones every device has settled, once there are COMPACT_AFTER
+        change sets or tombstones. Devices that join later still find every
+        entry in the merged set. Returns how many change sets were merged.
+        """
+        device_id = db.get_sync_value('device_id')
+        own = group_changesets(listing).get(device_id, [])
+        tombstones = db.count_tombstones()
+        if len(own) < COMPACT_AFTER and tombstones < COMPACT_AFTER:
+            return 0
+
+        cursors = self._load_cursors(backend, listing, device_id)
+        settled = [cursor.get('settled', {}) for cursor in cursors.values()]
+        settled.append(json.loads(db.get_sync_value('settled', '{}')))
+        origins = set().union(*settled)
+        pruned = db.prune_tombstones({origin: min(view.get(origin, 0) for view in settled) for origin in origins})
+
+        # With no other device around, everything sent counts as seen
+        pushed = int(db.get_sync_value('pushed_seq', '0'))
+        horizon = min((int(cursor['seen'].get(device_id, 0)) for cursor in cursors.values()), default=pushed)
+        merged = [(first, last, name) for first, last, name in own if last <= horizon]
+        last = max((last for _, last, _ in merged), default=0)
+        # A lone merged set is only rewritten, at most daily, when merges
+        # made since it was written wait to be settled with it
+        log = json.loads(db.get_sync_value('merge_log', '[]'))
+        resettle = (tombstones - pruned >= COMPACT_AFTER and any(entry['pushed'] <= last for entry in log) and
+                    time.time() - int(db.get_sync_value('compacted_at', '0')) >= CURSOR_REFRESH)
+        if not merged or (len(merged) < 2 and not resettle):
+            if pruned:
+                logging.info(f"Sync: forgot {pruned} deletions")
+            return 0
+
+        target = changeset_name(device_id, 1, last)
+        stale = [name for _, _, name in merged if name != target]
+        # Upload before deleting, so the changes are always stored somewhere;
+        # the target exists already if it is rewritten to settle merges, or
+        # if an earlier round stopped in between
+        backend.upload_bytes(target, db.seal_changes(db.get_local_changes(0, up_to=last)),
+                             new=len(stale) == len(merged))
+        backend.delete_files(stale)
+        db.set_sync_value('compacted_at', int(time.time()))
+        self._settle(db, last)
+        logging.info(f"Sync: merged {len(merged)} change sets, forgot {pruned} deletions")
+        return len(merged)
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Ashy Pass - Vault Archive - Encrypted .ashy export and import
+An archive is a header holding a random archive key wrapped with a key
+derived from a passphrase, a stream of compressed, encrypted blocks of
+length-prefixed records, and an encrypted index footer locating each
+block. The passphrase KDF runs once per archive, not once per entry, and
+both export and import stream block by block.
+
+Layout (big-endian):
+    header   MAGIC | iterations u32 | salt 16 | nonce 12 | key length u16 | wrapped key
+    block    length u32 | nonce 12 | AES-GCM(zlib(record...))
+    record   length u32 | JSON entry
+    footer   nonce 12 | AES-GCM(JSON index)
+    trailer  footer offset u64 | footer length u32 | END_MAGIC
+"""
+
+import bisect
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import zlib
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+ARCHIVE_EXTENSION = '.ashy'
+MAGIC = b'ASHYARC1'
+END_MAGIC = b'ASHYEND1'
+KDF_ITERATIONS = 600000
+# KDF rounds accepted from an archive header, which anyone can write
+MIN_KDF_ITERATIONS = 100000
+MAX_KDF_ITERATIONS = 10000000
+# Records per block; a block is the unit of compression and random access
+BLOCK_RECORDS = 256
+
+# Entry fields stored in an archive
+ARCHIVE_FIELDS = ('title', 'username', 'url', 'password', 'notes', 'created_at', 'updated_at')
+
+_HEADER = struct.Struct('>8sI16s12sH')
+_LENGTH = struct.Struct('>I')
+_TRAILER = struct.Struct('>QI8s')
+_NONCE_SIZE = 12
+
+
+class ArchiveError(Exception):
+    """The file is not a readable archive, or the passphrase is wrong"""
+
+
+def _derive_key(passphrase: str, salt: bytes, iterations: int) -> bytes:
+    return hashlib.pbkdf2_hmac('sha256', passphrase.encode(), salt, iterations, dklen=32)
+
+
+def _seal(aead: AESGCM, data: bytes, aad: bytes) -> bytes:
+    nonce = os.urandom(_NONCE_SIZE)
+    return nonce + aead.encrypt(nonce, data, aad)
+
+
+def _open(aead: AESGCM, data: bytes, aad: bytes) -> bytes:
+    try:
+        return aead.decrypt(data[:_NONCE_SIZE], data[_NONCE_SIZE:], aad)
+    except InvalidTag:
+        raise ArchiveError("The archive is damaged")
+
+
+class VaultArchiveWriter:
+    """
+    Writes entries to a new archive. The file appears under its final
+    name only when close() succeeds; use as a context manager.
+    """
+
+    def __init__(self, path: str, passphrase: str, block_records: int = BLOCK_RECORDS):
+        self.path = path
+        self.block_records = block_records
+        self.count = 0
+        self._pending: List[bytes] = []
+        self._blocks: List[List[int]] = []
+
+        key = AESGCM.generate_key(bit_length=256)
+        salt, key_nonce = os.urandom(16), os.urandom(_NONCE_SIZE)
+        fixed = _HEADER.pack(MAGIC, KDF_ITERATIONS, salt, key_nonce, 32 + 16)
+        wrapped = AESGCM(_derive_key(passphrase, salt, KDF_ITERATIONS)).encrypt(key_nonce, key, fixed)
+        self._header = fixed + wrapped
+        self._aead = AESGCM(key)
+
+        fd, self._tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                              prefix='.ashypass-archive-', suffix=ARCHIVE_EXTENSION)
+        self._file = os.fdopen(fd, 'wb')
+        self._file.write(self._header)
+
+    def __enter__(self) -> 'VaultArchiveWriter':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def add(self, entry: Dict[str, Any]) -> None:
+        """Append one entry"""
+        record = json.dumps({key: entry.get(key) for key in ARCHIVE_FIELDS}, separators=(',', ':')).encode()
+        self._pending.append(_LENGTH.pack(len(record)) + record)
+        if len(self._pending) >= self.block_records:
+            self._flush_block()
+
+    def close(self) -> None:
+        """Write the index footer and move the archive into place"""
+        try:
+            self._flush_block()
+            index = json.dumps({'count': self.count, 'blocks': self._blocks}).encode()
+            footer = _seal(self._aead, index, self._header + b'index')
+            offset = self._file.tell()
+            self._file.write(footer)
+            self._file.write(_TRAILER.pack(offset, len(footer), END_MAGIC))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            os.replace(self._tmp_path, self.path)
+        except BaseException:
+            self.abort()
+            raise
+
+    def abort(self) -> None:
+        """Discard the partly written archive"""
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
+
+    def _flush_block(self) -> None:
+        if not self._pending:
+            return
+        number = len(self._blocks)
+        sealed = _seal(self._aead, zlib.compress(b''.join(self._pending)),
+                       self._header + struct.pack('>Q', number))
+        offset = self._file.tell()
+        self._file.write(_LENGTH.pack(len(sealed)) + sealed)
+        # [offset, stored length, first record, record count]
+        self._blocks.append([offset, _LENGTH.size + len(sealed), self.count, len(self._pending)])
+        self.count += len(self._pending)
+        self._pending = []
+
+
+class VaultArchiveReader:
+    """
+    Reads an archive. Opening checks the passphrase and loads the index,
+    so records can be streamed in order or fetched by position.
+    """
+
+    def __init__(self, path: str, passphrase: str):
+        self._file = open(path, 'rb')
+        try:
+            self._load(passphrase)
+        except BaseException:
+            self._file.close()
+            raise
+
+    def _load(self, passphrase: str) -> None:
+        fixed = self._file.read(_HEADER.size)
+        if len(fixed) < _HEADER.size or not fixed.startswith(MAGIC):
+            raise ArchiveError("Not an Ashy Pass archive")
+        _, iterations, salt, key_nonce, wrapped_size = _HEADER.unpack(fixed)
+        if not MIN_KDF_ITERATIONS <= iterations <= MAX_KDF_ITERATIONS:
+            raise ArchiveError("The archive is damaged")
+        wrapped = self._file.read(wrapped_size)
+        self._header = fixed + wrapped
+        try:
+            key = AESGCM(_derive_key(passphrase, salt, iterations)).decrypt(key_nonce, wrapped, fixed)
+        except InvalidTag:
+            raise ArchiveError("Wrong passphrase")
+        self._aead = AESGCM(key)
+
+        self.size = self._file.seek(0, os.SEEK_END)
+        if self.size < len(self._header) + _TRAILER.size:
+            raise ArchiveError("The archive is incomplete")
+        self._file.seek(self.size - _TRAILER.size)
+        offset, length, end_magic = _TRAILER.unpack(self._file.read(_TRAILER.size))
+        if end_magic != END_MAGIC:
+            raise ArchiveError("The archive is incomplete")
+        self._file.seek(offset)
+        index = json.loads(_open(self._aead, self._file.read(length), self._header + b'index'))
+        self.count: int = index['count']
+        self.blocks: List[List[int]] = index['blocks']
+        self._firsts = [block[2] for block in self.blocks]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __enter__(self) -> 'VaultArchiveReader':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def read_block(self, number: int) -> List[Dict[str, Any]]:
+        """All entries of one block"""
+        offset, length, _, count = self.blocks[number]
+        self._file.seek(offset)
+        data = self._file.read(length)
+        payload = zlib.decompress(_open(self._aead, data[_LENGTH.size:], self._header + struct.pack('>Q', number)))
+        entries, pos = [], 0
+        while pos < len(payload):
+            (size,) = _LENGTH.unpack_from(payload, pos)
+            pos += _LENGTH.size
+            entries.append(json.loads(payload[pos:pos + size]))
+            pos += size
+        if len(entries) != count:
+            raise ArchiveError("The archive is damaged")
+        return entries
+
+    def get(self, position: int) -> Dict[str, Any]:
+        """The entry at a position, reading only its block"""
+        if not 0 <= position < self.count:
+            raise IndexError(position)
+        number = bisect.bisect_right(self._firsts, position) - 1
+        return self.read_block(number)[position - self._firsts[number]]
+
+    def iter_entries(self, on_block: Optional[Callable[[int], None]] = None) -> Iterator[Dict[str, Any]]:
+        """Yield every entry in order; on_block gets the bytes read so far"""
+        for number, block in enumerate(self.blocks):
+            entries = self.read_block(number)
+            if on_block:
+                on_block(block[0] + block[1])
+            yield from entries
+
+
+def export_archive(path: str, entries: Iterable[Dict[str, Any]], passphrase: str) -> int:
+    """Write entries (with plain-text passwords) to an archive; returns how many"""
+    with VaultArchiveWriter(path, passphrase) as writer:
+        for entry in entries:
+            writer.add(entry)
+    return writer.count
+
+
+def iter_archive(file_path: str, counter=None, passphrase: str = '') -> Iterator[Dict[str, Any]]:
+    """
+    Entry reader for CsvHandler.import_into_database(); bind the
+    passphrase with functools.partial
+    """
+    with VaultArchiveReader(file_path, passphrase) as reader:
+        def on_block(position: int) -> None:
+            if counter is not None:
+                counter.bytes_read = position
+        for entry in reader.iter_entries(on_block):
+            entry['notes'] = entry.get('notes') or ''
+            yield entry
+        on_block(reader.size)
@@ -5,6 +5,10 @@ Modern password generator and encrypted password vault
 """
 
 import sys
+
+# Imported first so startup phases are measured from here
+from utils import startup_timing
+
 import gi
 
 gi.require_version('Gtk', '4.0')
@@ -17,6 +21,8 @@ from core.database import Database
 from utils.i18n import _
 from ui.window import MainWindow
 
+startup_timing.mark('imports')
+
 
 class AshyPassApplication(Adw.Application):
     """Main application class"""
@@ -57,12 +63,15 @@ class AshyPassApplication(Adw.Application):
             self.database.connect()
             self.database.initialize()
             print("Database initialized")
+            startup_timing.mark('database opened')
         
         # Create window if it doesn't exist
         if not self.window:
             print("Creating main window...")
             self.window = MainWindow(self, self.database)
             print("Window created")
+            startup_timing.mark('window built')
+            startup_timing.watch_first_frame(self.window, self)
         
         print("Presenting window...")
         self.window.present()
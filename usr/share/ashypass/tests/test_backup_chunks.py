@@ -0,0 +1,136 @@
+"""Chunked backups: chunking, restore and garbage collection on a shared target"""
+
+import os
+import time
+import zlib
+
+import pytest
+
+from core.backup_backends import LocalDirectoryBackend
+from core.backup_chunks import (CHUNK_GRACE_PERIOD, CHUNK_MAX_SIZE, CHUNK_MIN_SIZE, CHUNK_PREFIX,
+                                ChunkStore, chunk_name, iter_chunks)
+
+
+def _stored_chunks(backend):
+    return {f['name'] for f in backend.list_files(CHUNK_PREFIX)}
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    # upload_bytes() stages data in the application data directory
+    monkeypatch.setattr('core.backup_backends.DATA_DIR', tmp_path)
+    directory = tmp_path / 'target'
+    directory.mkdir()
+    return LocalDirectoryBackend(directory)
+
+
+def _age(backend, name, seconds):
+    path = backend.directory / name
+    stamp = time.time() - seconds
+    os.utime(path, (stamp, stamp))
+
+
+def test_restore_reassembles_the_snapshot(backend, tmp_path):
+    store = ChunkStore(backend)
+    snapshot = tmp_path / 'snapshot.db'
+    content = os.urandom(3 * 1024 * 1024 + 123)
+    snapshot.write_bytes(content)
+    manifest = store.put(snapshot)
+
+    sizes = [size for _, size in manifest['chunks']]
+    assert sum(sizes) == manifest['size'] == len(content)
+    assert all(CHUNK_MIN_SIZE <= size <= CHUNK_MAX_SIZE for size in sizes[:-1])
+    restored = tmp_path / 'restored.db'
+    progress = []
+    store.restore(manifest, restored, lambda done, total: progress.append((done, total)))
+    assert restored.read_bytes() == content
+    assert progress[-1] == (len(content), len(content))
+
+
+def test_edit_only_uploads_the_chunks_around_it(backend, tmp_path):
+    store = ChunkStore(backend)
+    snapshot = tmp_path / 'snapshot.db'
+    content = bytearray(os.urandom(4 * 1024 * 1024))
+    snapshot.write_bytes(content)
+    first = store.put(snapshot)
+
+    # Insert a few bytes in the middle: boundaries move with the content
+    content[2 * 1024 * 1024:2 * 1024 * 1024] = b'edited'
+    snapshot.write_bytes(content)
+    second = store.put(snapshot)
+
+    new = {d for d, _ in second['chunks']} - {d for d, _ in first['chunks']}
+    assert 1 <= len(new) <= 2
+    assert len(_stored_chunks(backend)) == len(first['chunks']) + len(new)
+    restored = tmp_path / 'restored.db'
+    store.restore(second, restored)
+    assert restored.read_bytes() == bytes(content)
+
+
+def test_corrupt_chunk_fails_the_restore(backend, tmp_path):
+    store = ChunkStore(backend)
+    snapshot = tmp_path / 'snapshot.db'
+    snapshot.write_bytes(os.urandom(1024 * 1024))
+    manifest = store.put(snapshot)
+    digest = manifest['chunks'][0][0]
+    backend.upload_bytes(chunk_name(digest), zlib.compress(b'something else'))
+
+    with pytest.raises(ValueError):
+        store.restore(manifest, tmp_path / 'restored.db')
+
+
+def test_chunking_does_not_depend_on_read_size(tmp_path):
+    content = os.urandom(2 * 1024 * 1024)
+    path = tmp_path / 'snapshot.db'
+    path.write_bytes(content)
+    with open(path, 'rb') as f:
+        chunks = list(iter_chunks(f))
+    assert b''.join(chunks) == content
+
+    class Trickle:
+        """Stream returning short reads"""
+        def __init__(self, data):
+            self.data, self.pos = data, 0
+
+        def read(self, size=-1):
+            block = self.data[self.pos:self.pos + min(size, 100 * 1024 + 7)]
+            self.pos += len(block)
+            return block
+
+    assert list(iter_chunks(Trickle(content))) == chunks
+
+
+def test_recent_orphans_survive_garbage_collection(backend, tmp_path):
+    store = ChunkStore(backend)
+    snapshot = tmp_path / 'snapshot.db'
+    snapshot.write_bytes(os.urandom(2 * 1024 * 1024))
+    digests = [d for d, _ in store.put(snapshot)['chunks']]
+    assert len(digests) > 1
+    old, young = chunk_name(digests[0]), chunk_name(digests[-1])
+    _age(backend, old, CHUNK_GRACE_PERIOD + 60)
+
+    # Nothing refers to either chunk; only the one past the grace period goes
+    assert store.collect_garbage(lambda: []) == 1
+    assert old not in _stored_chunks(backend)
+    assert young in _stored_chunks(backend)
+
+
+def test_published_chunk_list_protects_reused_chunks(backend, tmp_path):
+    snapshot = tmp_path / 'snapshot.db'
+    snapshot.write_bytes(os.urandom(2 * 1024 * 1024))
+    first = ChunkStore(backend).put(snapshot)
+    for name in _stored_chunks(backend):
+        _age(backend, name, CHUNK_GRACE_PERIOD + 60)
+
+    # Another device collects garbage while this one is between
+    # publishing its chunk list and relying on the stored chunks
+    published = []
+
+    def publish(manifest):
+        published.append(manifest)
+        collector = ChunkStore(backend)
+        collector.collect_garbage(lambda: [d for m in published for d, _ in m['chunks']])
+
+    second = ChunkStore(backend).put(snapshot, publish)
+    assert second['chunks'] == first['chunks']
+    assert _stored_chunks(backend) == {chunk_name(d) for d, _ in second['chunks']}
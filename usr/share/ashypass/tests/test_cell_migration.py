@@ -0,0 +1,72 @@
+"""Rewriting Fernet-encrypted entries with plain-text metadata as v1 cells"""
+
+from core.cell_crypto import is_cell
+from core.database import Database
+
+
+def _legacy_vault(path) -> Database:
+    """Vault whose entries are stored the way earlier versions wrote them"""
+    database = Database(path)
+    database.initialize()
+    database.set_master_password('master')
+    database.add_password('Mail', 'pw1', 'alice', 'recovery codes', 'https://mail.example')
+    database.add_password('Bank', 'pw2', 'bob')
+    database.add_password('Shop', 'pw3', url='https://shop.example')
+
+    fernet = database._cipher._fernet
+    for entry in list(database.iter_decrypted_passwords()):
+        notes = fernet.encrypt(entry['notes'].encode()) if entry['notes'] else None
+        database.connection.execute(
+            """UPDATE passwords SET title = ?, username = ?, url = ?, meta_encrypted = NULL,
+                                    password_encrypted = ?, notes_encrypted = ?
+               WHERE id = ?""",
+            (entry['title'], entry['username'], entry['url'],
+             fernet.encrypt(entry['password'].encode()), notes, entry['id']),
+        )
+    database.connection.commit()
+    return database
+
+
+def _entries(database):
+    return sorted((e['title'], e['username'], e['url'], e['password'], e['notes'])
+                  for e in database.iter_decrypted_passwords())
+
+
+def _versions(database):
+    return database.connection.execute("SELECT id, updated_at, origin, seq FROM passwords ORDER BY id").fetchall()
+
+
+def test_migration_rewrites_every_entry_in_batches(tmp_path):
+    database = _legacy_vault(tmp_path / 'vault.db')
+    before, versions = _entries(database), _versions(database)
+    assert database.count_legacy_cells() == 3
+
+    assert database.migrate_cells(batch_size=2) == 2
+    assert database.count_legacy_cells() == 1
+    assert database.migrate_cells(batch_size=2) == 1
+    assert database.migrate_cells(batch_size=2) == 0
+
+    assert _entries(database) == before
+    # Nothing changed for sync: the plain text is the same
+    assert _versions(database) == versions
+    for row in database.connection.execute(
+            "SELECT title, username, url, password_encrypted, notes_encrypted, meta_encrypted FROM passwords"):
+        assert (row['title'], row['username'], row['url']) == ('', None, None)
+        assert all(is_cell(cell) for cell in row[3:] if cell)
+
+    # Migrated metadata is searchable through the blind index
+    assert [e['title'] for e in database.get_passwords('alice')] == ['Mail']
+    assert sorted(e['title'] for e in database.get_passwords('example')) == ['Mail', 'Shop']
+
+
+def test_partly_rewritten_entry_is_migrated(tmp_path):
+    database = _legacy_vault(tmp_path / 'vault.db')
+    bank = next(e['id'] for e in database.get_passwords() if e['title'] == 'Bank')
+    # A new password is written as a cell; the metadata is still plain text
+    database.update_password(bank, password='changed')
+    assert database.count_legacy_cells() == 3
+
+    while database.migrate_cells(batch_size=1):
+        pass
+    assert database.count_legacy_cells() == 0
+    assert [e['password'] for e in database.iter_decrypted_passwords() if e['id'] == bank] == ['changed']
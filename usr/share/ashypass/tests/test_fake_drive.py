@@ -0,0 +1,128 @@
+"""DriveBackend against the loopback FakeDriveServer: resumed uploads and retention"""
+
+import os
+
+import pytest
+
+pytest.importorskip('googleapiclient')
+
+from core.backup_backends import DEFAULT_UPLOAD_CHUNK_MB, UPLOAD_CHUNK_UNIT, create_backend
+from core.backup_chunks import CHUNK_PREFIX, chunk_name
+from core.backup_generations import GENERATION_PREFIX, GenerationStore, RetentionPolicy
+from core.fake_drive import FakeDriveBackend, FakeDriveServer
+
+SIZE = 4 * UPLOAD_CHUNK_UNIT + 1000
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture
+def backend():
+    backend = FakeDriveBackend(FakeDriveServer(), chunk_size=UPLOAD_CHUNK_UNIT)
+    yield backend
+    backend.server.stop()
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'snapshot.db'
+    path.write_bytes(os.urandom(SIZE))
+    return path
+
+
+def _interrupt_after(count):
+    """Progress callback that stops the upload once `count` bytes are sent"""
+    def progress(sent, total):
+        if sent >= count:
+            raise Interrupted()
+    return progress
+
+
+def test_resume_after_interrupted_upload(backend, source):
+    with pytest.raises(Interrupted):
+        backend.upload_file('snapshot.db', source, new=True, progress=_interrupt_after(2 * UPLOAD_CHUNK_UNIT))
+    assert 'snapshot.db' in backend.state.uploads
+    sent_before = backend.server.store.bytes_received
+
+    backend.upload_file('snapshot.db', source, new=True)
+
+    assert backend.download_bytes('snapshot.db') == source.read_bytes()
+    assert backend.state.uploads == {}
+    # Only the part Drive did not have yet is sent again
+    assert backend.server.store.bytes_received - sent_before <= SIZE - 2 * UPLOAD_CHUNK_UNIT
+    assert [f['name'] for f in backend.list_files()] == ['snapshot.db']
+
+
+def test_resume_after_server_error(backend, source):
+    def progress(sent, total):
+        if sent >= UPLOAD_CHUNK_UNIT:
+            backend.server.fail_next(503)
+
+    with pytest.raises(Exception):
+        backend.upload_file('snapshot.db', source, new=True, progress=progress)
+    assert 'snapshot.db' in backend.state.uploads
+
+    backend.upload_file('snapshot.db', source, new=True)
+    assert backend.download_bytes('snapshot.db') == source.read_bytes()
+
+
+def test_expired_session_restarts_the_upload(backend, source):
+    with pytest.raises(Interrupted):
+        backend.upload_file('snapshot.db', source, new=True, progress=_interrupt_after(UPLOAD_CHUNK_UNIT))
+    backend.server.store.sessions.clear()
+
+    backend.upload_file('snapshot.db', source, new=True)
+
+    assert backend.download_bytes('snapshot.db') == source.read_bytes()
+    assert backend.state.uploads == {}
+    assert [f['name'] for f in backend.list_files()] == ['snapshot.db']
+
+
+@pytest.mark.parametrize('incremental', [False, True])
+def test_retention_prunes_old_generations(backend, tmp_path, incremental):
+    store = GenerationStore(backend, RetentionPolicy(hourly=2, daily=0, monthly=0),
+                            incremental=incremental,
+                            pending_path=tmp_path / 'pending.json',
+                            pending_snapshot=tmp_path / 'pending.db')
+    # Everything is written within the test, so no chunk would be old enough
+    store.chunks.grace_period = 0
+    start = 1700000000 - 1700000000 % 3600
+    contents = []
+    for hour in range(4):
+        snapshot = tmp_path / 'snapshot.db'
+        contents.append(os.urandom(UPLOAD_CHUNK_UNIT + 100 * hour))
+        snapshot.write_bytes(contents[-1])
+        store.add(snapshot, created=start + hour * 3600)
+
+    generations = store.list()
+    assert [g['created'] for g in generations] == [start + 3 * 3600, start + 2 * 3600]
+
+    stored = {f['name'] for f in backend.list_files(GENERATION_PREFIX)}
+    assert stored == {g['name'] for g in generations}
+    for generation, content in zip(generations, reversed(contents)):
+        restored = tmp_path / 'restored.db'
+        store.restore(generation, restored)
+        assert restored.read_bytes() == content
+    if incremental:
+        # Chunks only the pruned generations used are gone as well
+        referenced = set()
+        for generation in generations:
+            referenced.update(d for d, _ in store._chunk_manifest(generation['name'])['chunks'])
+        assert {f['name'] for f in backend.list_files(CHUNK_PREFIX)} == {chunk_name(d) for d in referenced}
+
+
+@pytest.mark.parametrize('value, chunk_size', [
+    (2, 2 * 1024 * 1024),
+    ('0.6', 2 * UPLOAD_CHUNK_UNIT),
+    (0.01, UPLOAD_CHUNK_UNIT),
+    (0, DEFAULT_UPLOAD_CHUNK_MB * 1024 * 1024),
+    (-4, DEFAULT_UPLOAD_CHUNK_MB * 1024 * 1024),
+    ('lots', DEFAULT_UPLOAD_CHUNK_MB * 1024 * 1024),
+    (None, DEFAULT_UPLOAD_CHUNK_MB * 1024 * 1024),
+])
+def test_upload_chunk_setting_is_validated(value, chunk_size):
+    backend = create_backend({'backup_backend': 'fake-drive', 'backup_upload_chunk_mb': value}, None)
+    backend.server.stop()
+    assert backend.chunk_size == chunk_size
@@ -0,0 +1,104 @@
+"""Streaming importers: JSON pull parser and Bitwarden/KeePass readers"""
+
+import io
+import json
+
+import pytest
+
+from core.importers import _JsonStream, iter_bitwarden_json, iter_keepass_xml
+
+
+def _read_all(stream: _JsonStream):
+    """Walk a document with the pull parser the way the importers do"""
+    char = stream.peek()
+    if char == '{':
+        return {key: _read_all(stream) for key in stream.iter_object()}
+    if char == '[':
+        return [_read_all(stream) for _ in stream.iter_array()]
+    return stream.value()
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 4, 5, 7, 64 * 1024])
+def test_numbers_split_across_chunks(chunk_size):
+    document = '{"a": [7.5e10, -12.25E-3, 1e+5, 0, 42], "b": {"c": 3.0, "d": [true, null, "7."]}, "e": 123456}'
+    stream = _JsonStream(io.StringIO(document), chunk_size=chunk_size)
+    assert _read_all(stream) == json.loads(document)
+
+
+def test_number_at_end_of_document():
+    stream = _JsonStream(io.StringIO('[1, 2.5e3'), chunk_size=3)
+    stream.expect('[')
+    assert stream.value() == 1
+    stream.expect(',')
+    assert stream.value() == 2.5e3
+
+
+def test_truncated_document_fails():
+    stream = _JsonStream(io.StringIO('{"a": [1, 2'), chunk_size=3)
+    with pytest.raises(ValueError):
+        _read_all(stream)
+
+
+def test_bitwarden_export(tmp_path):
+    export = {
+        'encrypted': False,
+        'folders': [{'id': 'f1', 'name': 'Work'}],
+        'items': [
+            {'type': 1, 'name': 'Mail', 'folderId': 'f1', 'notes': None,
+             'login': {'username': 'bob', 'password': 'pw"1', 'totp': None,
+                       'uris': [{'uri': 'https://mail.example'}, {'uri': 'https://alt.example'}]}},
+            {'type': 2, 'name': 'Note', 'notes': 'text'},
+            {'type': 3, 'name': 'Card'},
+        ],
+    }
+    path = tmp_path / 'bitwarden.json'
+    path.write_text(json.dumps(export))
+
+    entries = list(iter_bitwarden_json(str(path)))
+    assert [entry['title'] for entry in entries] == ['Mail', 'Note']
+    assert entries[0]['password'] == 'pw"1'
+    assert entries[0]['url'] == 'https://mail.example'
+    assert 'Folder: Work' in entries[0]['notes']
+    assert 'Other URLs: https://alt.example' in entries[0]['notes']
+
+
+def test_encrypted_bitwarden_export_rejected(tmp_path):
+    path = tmp_path / 'bitwarden.json'
+    path.write_text(json.dumps({'encrypted': True, 'items': []}))
+    with pytest.raises(ValueError):
+        list(iter_bitwarden_json(str(path)))
+
+
+def test_keepass_export_skips_history_and_recycle_bin(tmp_path):
+    path = tmp_path / 'keepass.xml'
+    path.write_text("""<?xml version="1.0" encoding="utf-8"?>
+<KeePassFile>
+  <Meta><RecycleBinUUID>bin</RecycleBinUUID></Meta>
+  <Root>
+    <Group>
+      <UUID>root</UUID><Name>Database</Name>
+      <Group>
+        <UUID>g1</UUID><Name>Email</Name>
+        <Entry>
+          <String><Key>Title</Key><Value>Mail</Value></String>
+          <String><Key>Password</Key><Value>new</Value></String>
+          <String><Key>PIN</Key><Value>1234</Value></String>
+          <History>
+            <Entry><String><Key>Title</Key><Value>Mail</Value></String>
+                   <String><Key>Password</Key><Value>old</Value></String></Entry>
+          </History>
+        </Entry>
+      </Group>
+      <Group>
+        <UUID>bin</UUID><Name>Recycle Bin</Name>
+        <Entry><String><Key>Title</Key><Value>Deleted</Value></String></Entry>
+      </Group>
+    </Group>
+  </Root>
+</KeePassFile>
+""")
+
+    entries = list(iter_keepass_xml(str(path)))
+    assert [(entry['title'], entry['password']) for entry in entries] == [('Mail', 'new')]
+    assert 'Folder: Email' in entries[0]['notes']
+    assert 'PIN: 1234' in entries[0]['notes']
@@ -0,0 +1,88 @@
+"""Master password: vault key wrapping, legacy unlock and sync key records"""
+
+import pytest
+
+from core.cell_crypto import CellCipher
+from core.database import KEY_KDF_ITERATIONS, LEGACY_KDF_ITERATIONS, MAX_KDF_ITERATIONS, Database
+
+
+def _vault(path, password='master') -> Database:
+    database = Database(path)
+    database.initialize()
+    database.set_master_password(password)
+    return database
+
+
+def _reopen(path, password):
+    database = Database(path)
+    database.initialize()
+    return database if database.verify_master_password(password) else None
+
+
+def _cells(database):
+    return database.connection.execute(
+        "SELECT password_encrypted, notes_encrypted, meta_encrypted FROM passwords ORDER BY id").fetchall()
+
+
+def test_change_rewraps_the_vault_key_only(tmp_path):
+    path = tmp_path / 'vault.db'
+    database = _vault(path)
+    database.add_password('Mail', 'pw1', 'alice', 'notes')
+    cells = [tuple(row) for row in _cells(database)]
+    record = database.get_sync_key_record()
+    sealed = database.seal_changes([{'uuid': 'x'}])
+
+    assert not database.change_master_password('wrong', 'new')
+    assert database.change_master_password('master', 'new')
+    database.close()
+
+    assert _reopen(path, 'master') is None
+    reopened = _reopen(path, 'new')
+    assert [e['password'] for e in reopened.iter_decrypted_passwords()] == ['pw1']
+    # Entries are not re-encrypted
+    assert [tuple(row) for row in _cells(reopened)] == cells
+    # Same sync key, published under the new password
+    changed = reopened.get_sync_key_record()
+    assert changed['key_id'] == record['key_id']
+    assert changed['salt'] != record['salt']
+    assert reopened.open_changes(sealed) == [{'uuid': 'x'}]
+
+
+def test_legacy_vault_unlocks_and_gets_a_wrapped_key(tmp_path):
+    path = tmp_path / 'vault.db'
+    database = _vault(path)
+    # Before key wrapping, the password-derived key was the vault key
+    salt = database.connection.execute("SELECT salt FROM master").fetchone()[0]
+    key = Database._derive_wrapping_key('master', salt.encode(), LEGACY_KDF_ITERATIONS)
+    database.connection.execute(
+        "UPDATE master SET wrapped_key = NULL, kdf_iterations = NULL, sync_key = NULL, sync_key_record = NULL")
+    database.connection.commit()
+    database._cipher = CellCipher(key)
+    database.add_password('Mail', 'pw1')
+    database.close()
+
+    assert _reopen(path, 'wrong') is None
+    reopened = _reopen(path, 'master')
+    assert [e['password'] for e in reopened.iter_decrypted_passwords()] == ['pw1']
+    row = reopened.connection.execute("SELECT salt, kdf_iterations, wrapped_key FROM master").fetchone()
+    assert row['wrapped_key'] is not None and row['salt'] != salt
+    assert row['kdf_iterations'] == KEY_KDF_ITERATIONS
+    reopened.close()
+
+    # Later unlocks go through the wrapped key
+    again = _reopen(path, 'master')
+    assert [e['password'] for e in again.iter_decrypted_passwords()] == ['pw1']
+
+
+@pytest.mark.parametrize('change', [
+    {'iterations': MAX_KDF_ITERATIONS + 1},
+    {'iterations': LEGACY_KDF_ITERATIONS - 1},
+    {'wrapped': 'not base64!'},
+    {'salt': None},
+])
+def test_malformed_sync_key_records_are_refused(tmp_path, change):
+    database = _vault(tmp_path / 'vault.db')
+    record = dict(_vault(tmp_path / 'other.db').get_sync_key_record(), **change)
+    with pytest.raises(ValueError):
+        database.offer_sync_key(record)
+    assert database.get_sync_value('offered_sync_key') is None
@@ -0,0 +1,65 @@
+"""Blind-index search returns what the plain-text LIKE search returned"""
+
+import random
+import sqlite3
+
+import pytest
+
+from core.database import Database
+
+WORDS = ['mail', 'Bank', 'bankING', 'shop', 'example', 'alice', 'bob', 'ex', 'a', 'work-vpn', 'x1', 'Café']
+
+
+@pytest.fixture(scope='module')
+def vault(tmp_path_factory):
+    rng = random.Random(7)
+    database = Database(tmp_path_factory.mktemp('search') / 'vault.db')
+    database.initialize()
+    database.set_master_password('master')
+
+    def text(count):
+        return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+    entries = []
+    for i in range(120):
+        entries.append({
+            'title': text(rng.randint(1, 3)),
+            'username': rng.choice([None, f"{rng.choice(WORDS).lower()}{i}@example.com"]),
+            'url': rng.choice([None, f"https://{rng.choice(WORDS).lower()}.example.org/{text(1)}"]),
+            'password': 'pw',
+        })
+    database.add_passwords(entries)
+    return database
+
+
+def _like_search(database, query):
+    """The search as it ran while titles, usernames and URLs were plain text"""
+    plain = sqlite3.connect(':memory:')
+    plain.execute("CREATE TABLE passwords (id INTEGER, title TEXT, username TEXT, url TEXT)")
+    plain.executemany("INSERT INTO passwords VALUES (?, ?, ?, ?)",
+                      [(e['id'], e['title'], e['username'], e['url']) for e in database.get_passwords()])
+    pattern = f"%{query}%"
+    return {row[0] for row in plain.execute(
+        "SELECT id FROM passwords WHERE title LIKE ? OR username LIKE ? OR url LIKE ?", (pattern,) * 3)}
+
+
+@pytest.mark.parametrize('query', [
+    'mail', 'MAIL', 'ank', 'bank', 'banking', 'b', 'ex', 'e', 'x1', 'ample.c', 'example.org/',
+    'bank mail', 'mail ban', 'ail sh', 'https://shop', '@example.com', 'work-vpn', 'k-v', 'alice1',
+    'nothing here', ' ', 'a a',
+])
+def test_search_matches_like(vault, query):
+    found = {e['id'] for e in vault.get_passwords(query)}
+    assert found == _like_search(vault, query)
+
+
+def test_search_results_are_sorted_by_title(vault):
+    titles = [e['title'] for e in vault.get_passwords('bank')]
+    assert titles and titles == sorted(titles)
+
+
+def test_edited_entry_is_found_by_its_new_title(vault):
+    entry_id = vault.add_password('Old name', 'pw')
+    vault.update_password(entry_id, title='Fresh title')
+    assert [e['id'] for e in vault.get_passwords('fresh')] == [entry_id]
+    assert vault.get_passwords('old name') == []
@@ -0,0 +1,106 @@
+"""Sync: last-writer-wins merging, deletions and change set compaction"""
+
+import pytest
+
+from core import sync
+from core.backup_backends import LocalDirectoryBackend
+from core.database import Database
+from core.sync import CHANGESET_PREFIX, SyncEngine
+
+
+def _vault(path, password='master') -> Database:
+    database = Database(path)
+    database.initialize()
+    database.set_master_password(password)
+    return database
+
+
+def _entries(database):
+    return sorted((e['title'], e['password']) for e in database.iter_decrypted_passwords())
+
+
+def _entry_id(database, title):
+    return next(e['id'] for e in database.get_passwords() if e['title'] == title)
+
+
+def test_newest_edit_wins_whatever_the_order(tmp_path):
+    a, b, c = (_vault(tmp_path / f'{name}.db') for name in 'abc')
+    a.add_password('Mail', 'first')
+    created = a.get_local_changes(0)
+    b.apply_remote_changes(created)
+    c.apply_remote_changes(created)
+
+    # Edits are usually within the same second; b edits last
+    a.update_password(_entry_id(a, 'Mail'), password='from a')
+    b.update_password(_entry_id(b, 'Mail'), password='from b')
+    b.update_password(_entry_id(b, 'Mail'), password='from b again')
+    from_a, from_b = a.get_local_changes(1), b.get_local_changes(0)
+
+    assert a.apply_remote_changes(from_b) == 1
+    assert b.apply_remote_changes(from_a) == 0
+    assert c.apply_remote_changes(from_b + from_a) == 1
+    assert _entries(a) == _entries(b) == _entries(c) == [('Mail', 'from b again')]
+
+
+def test_deletion_beats_the_version_it_deleted(tmp_path):
+    a, b = _vault(tmp_path / 'a.db'), _vault(tmp_path / 'b.db')
+    a.add_password('Mail', 'pw')
+    created = a.get_local_changes(0)
+    b.apply_remote_changes(created)
+
+    b.delete_password(_entry_id(b, 'Mail'))
+    deleted = b.get_local_changes(0)
+    assert [change['deleted'] for change in deleted] == [True]
+
+    a.apply_remote_changes(deleted)
+    assert _entries(a) == []
+    # Receiving the deleted version again does not bring it back
+    assert a.apply_remote_changes(created) == 0
+    assert b.apply_remote_changes(created) == 0
+    assert _entries(b) == []
+    assert a.count_tombstones() == b.count_tombstones() == 1
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    # upload_bytes() stages data in the application data directory
+    monkeypatch.setattr('core.backup_backends.DATA_DIR', tmp_path)
+    directory = tmp_path / 'target'
+    directory.mkdir()
+    return LocalDirectoryBackend(directory)
+
+
+def test_compaction_keeps_devices_converged(tmp_path, backend, monkeypatch):
+    monkeypatch.setattr(sync, 'COMPACT_AFTER', 2)
+    vaults = [_vault(tmp_path / f'{name}.db') for name in 'ab']
+    engines = [SyncEngine(v, lambda: backend) for v in vaults]
+    engines[0].sync()
+    engines[1].sync()
+    # The second device joins with the first one's sync key on its next unlock
+    vaults[1].close()
+    assert vaults[1].verify_master_password('master')
+
+    for step in range(6):
+        for number, (vault, engine) in enumerate(zip(vaults, engines)):
+            vault.add_password(f'{step}-{number}', 'pw')
+            if step % 2:
+                vault.delete_password(_entry_id(vault, f'{step - 1}-{number}'))
+            engine.sync()
+    for engine in engines:
+        engine.sync()
+
+    assert _entries(vaults[0]) == _entries(vaults[1])
+    assert len(_entries(vaults[0])) == 6
+    changesets = [f for f in backend.list_files(CHANGESET_PREFIX) if f['name'].endswith('.changes')]
+    assert len(changesets) < 12
+    assert vaults[0].count_tombstones() < 6
+
+    # A device joining after compaction gets the same entries, without
+    # the deleted ones coming back
+    late = _vault(tmp_path / 'late.db')
+    late_engine = SyncEngine(late, lambda: backend)
+    late_engine.sync()
+    late.close()
+    assert late.verify_master_password('master')
+    late_engine.sync()
+    assert _entries(late) == _entries(vaults[0])
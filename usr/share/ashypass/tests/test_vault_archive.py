@@ -0,0 +1,76 @@
+"""Encrypted .ashy archives: export, import and passphrase checks"""
+
+import functools
+import struct
+
+import pytest
+
+from core.csv_handler import CsvHandler
+from core.database import Database
+from core.vault_archive import (ArchiveError, MAX_KDF_ITERATIONS, MIN_KDF_ITERATIONS, VaultArchiveReader,
+                                export_archive, iter_archive)
+
+
+def _vault(path) -> Database:
+    database = Database(path)
+    database.initialize()
+    database.set_master_password('master')
+    return database
+
+
+def test_round_trip_keeps_fields_and_dates(tmp_path):
+    source = _vault(tmp_path / 'source.db')
+    source.add_password('Mail', 'pw"1', 'bob', 'line 1\nline 2', 'https://mail.example')
+    source.add_password('Bank', 'pw2')
+    source.connection.execute("UPDATE passwords SET created_at = 1000000000, updated_at = 1100000000")
+    source.connection.commit()
+
+    archive = tmp_path / 'vault.ashy'
+    assert export_archive(str(archive), source.iter_decrypted_passwords(), 'phrase') == 2
+
+    target = _vault(tmp_path / 'target.db')
+    state = CsvHandler.import_into_database(target, str(archive),
+                                            reader=functools.partial(iter_archive, passphrase='phrase'))
+    assert state.added == 2
+
+    def entries(database):
+        return sorted((e['title'], e['username'], e['url'], e['password'], e['notes'] or '',
+                       e['created_at'], e['updated_at']) for e in database.iter_decrypted_passwords())
+
+    assert entries(target) == entries(source)
+
+
+def test_wrong_passphrase_fails_the_import(tmp_path):
+    archive = tmp_path / 'vault.ashy'
+    export_archive(str(archive), [{'title': 'Mail', 'password': 'pw'}], 'phrase')
+
+    with pytest.raises(ArchiveError):
+        VaultArchiveReader(str(archive), 'wrong')
+
+    target = _vault(tmp_path / 'target.db')
+    with pytest.raises(ArchiveError):
+        CsvHandler.import_into_database(target, str(archive),
+                                        reader=functools.partial(iter_archive, passphrase='wrong'))
+    assert target.count_passwords() == 0
+
+
+def test_random_access(tmp_path):
+    archive = tmp_path / 'vault.ashy'
+    export_archive(str(archive), ({'title': f'entry {i}', 'password': str(i)} for i in range(600)), 'phrase')
+    with VaultArchiveReader(str(archive), 'phrase') as reader:
+        assert len(reader) == 600
+        assert reader.get(0)['title'] == 'entry 0'
+        assert reader.get(599)['password'] == '599'
+        assert reader.get(300)['title'] == 'entry 300'
+
+
+@pytest.mark.parametrize('iterations', [0, 1, MIN_KDF_ITERATIONS - 1, MAX_KDF_ITERATIONS + 1, 2 ** 32 - 1])
+def test_header_kdf_rounds_are_bounded(tmp_path, iterations):
+    archive = tmp_path / 'vault.ashy'
+    export_archive(str(archive), [{'title': 'Mail', 'password': 'pw'}], 'phrase')
+    data = bytearray(archive.read_bytes())
+    struct.pack_into('>I', data, 8, iterations)
+    archive.write_bytes(bytes(data))
+
+    with pytest.raises(ArchiveError):
+        VaultArchiveReader(str(archive), 'phrase')
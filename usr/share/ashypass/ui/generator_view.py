@@ -7,6 +7,7 @@ gi.require_version('Adw', '1')
 
 from gi.repository import Gtk, Adw, GLib
 from core.generator import PasswordGenerator, PasswordConfig
+from core.secret_buffer import SecretBuffer
 from utils.clipboard import ClipboardManager
 from utils.i18n import _
 from core.config import *
@@ -20,7 +21,9 @@ class GeneratorView(Adw.NavigationPage):
         super().__init__(title=_("Generator"))
         self.generator = PasswordGenerator()
         self.clipboard = ClipboardManager()
-        self.current_password = ""
+        # Kept in locked memory for copying. The generator works without
+        # the vault, so locking it must not empty the password still shown
+        self.current_password = SecretBuffer(wipe_on_lock=False)
         self.settings = load_settings()
         self._build_ui()
         self._load_preferences()
@@ -231,25 +234,29 @@ class GeneratorView(Adw.NavigationPage):
                     use_symbols=self.symbols_switch.get_active(),
                     exclude_ambiguous=self.ambiguous_switch.get_active(),
                 )
-                self.current_password = self.generator.generate_password(config)
+                password = self.generator.generate_password(config)
             elif current_type == "passphrase":
-                self.current_password = self.generator.generate_passphrase(
+                password = self.generator.generate_passphrase(
                     num_words=int(self.words_spin.get_value()),
                     separator=self.separator_entry.get_text(),
                     capitalize=self.capitalize_switch.get_active(),
                     add_number=self.add_number_switch.get_active(),
                 )
             elif current_type == "pin":
-                self.current_password = self.generator.generate_pin(int(self.pin_length_spin.get_value()))
+                password = self.generator.generate_pin(int(self.pin_length_spin.get_value()))
+            else:
+                return
             
-            self.password_label.set_text(self.current_password)
-            self._update_strength_indicator()
+            self.current_password.close()
+            self.current_password = SecretBuffer.from_str(password, wipe_on_lock=False)
+            self.password_label.set_text(password)
+            self._update_strength_indicator(password)
         except ValueError as e:
             print(f"Error: {e}")
     
-    def _update_strength_indicator(self) -> None:
+    def _update_strength_indicator(self, password: str) -> None:
         """Update password strength indicator"""
-        score, level = self.generator.check_password_strength(self.current_password)
+        score, level = self.generator.check_password_strength(password)
         self.strength_label.set_text(_(level))
         self.strength_bar.set_value(score)
         
@@ -324,5 +331,5 @@ class GeneratorView(Adw.NavigationPage):
     def _on_copy_clicked(self, button: Gtk.Button) -> None:
         """Handle copy button click"""
         if self.current_password:
-            self.clipboard.copy_text(self.current_password)
+            self.clipboard.copy_secret(self.current_password)
             self.activate_action("app.show-toast", GLib.Variant.new_string(_("Password copied to clipboard")))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Ashy Pass - Job List - Header button listing background jobs"""
+
+import gi
+gi.require_version('Gtk', '4.0')
+gi.require_version('Adw', '1')
+
+from gi.repository import Gtk, Pango
+from core.jobs import JobRunner, Job, QUEUED, RUNNING, DONE, FAILED, CANCELLED
+from utils.i18n import _
+
+
+class JobListButton(Gtk.MenuButton):
+    """Shows running and recent jobs with progress and cancel; hidden when there are none"""
+
+    def __init__(self, runner: JobRunner):
+        super().__init__()
+        self.runner = runner
+        self.set_icon_name("emblem-synchronizing-symbolic")
+        self.set_tooltip_text(_("Background Tasks"))
+        self.set_visible(False)
+
+        box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
+        box.set_margin_top(6)
+        box.set_margin_bottom(6)
+        box.set_margin_start(6)
+        box.set_margin_end(6)
+
+        self.list_box = Gtk.ListBox()
+        self.list_box.set_selection_mode(Gtk.SelectionMode.NONE)
+        self.list_box.add_css_class("boxed-list")
+        box.append(self.list_box)
+
+        self.btn_clear = Gtk.Button(label=_("Clear Finished"))
+        self.btn_clear.add_css_class("flat")
+        self.btn_clear.connect("clicked", lambda btn: self.runner.clear_finished())
+        box.append(self.btn_clear)
+
+        popover = Gtk.Popover()
+        popover.set_child(box)
+        self.set_popover(popover)
+
+        # The runner calls listeners on the GTK loop
+        runner.add_listener(self._refresh)
+
+    def _refresh(self) -> None:
+        """Rebuild the rows; the list only ever holds a handful of jobs"""
+        jobs = self.runner.jobs()
+        self.set_visible(bool(jobs))
+        self.btn_clear.set_visible(any(not job.active for job in jobs))
+        if any(job.active for job in jobs):
+            self.add_css_class("suggested-action")
+        else:
+            self.remove_css_class("suggested-action")
+
+        while (row := self.list_box.get_first_child()) is not None:
+            self.list_box.remove(row)
+        for job in reversed(jobs):
+            self.list_box.append(self._build_row(job))
+
+    def _build_row(self, job: Job) -> Gtk.Widget:
+        row = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=4)
+        row.set_margin_top(8)
+        row.set_margin_bottom(8)
+        row.set_margin_start(10)
+        row.set_margin_end(10)
+
+        top = Gtk.Box(spacing=8)
+        name = Gtk.Label(label=job.name, xalign=0, hexpand=True,
+                         max_width_chars=30, ellipsize=Pango.EllipsizeMode.END)
+        top.append(name)
+        if job.cancellable and job.active:
+            btn_cancel = Gtk.Button(icon_name="process-stop-symbolic")
+            btn_cancel.add_css_class("flat")
+            btn_cancel.set_tooltip_text(_("Cancel"))
+            btn_cancel.connect("clicked", lambda btn: (job.cancel(), btn.set_sensitive(False)))
+            top.append(btn_cancel)
+        row.append(top)
+
+        if job.state == RUNNING:
+            bar = Gtk.ProgressBar()
+            if job.fraction is None:
+                bar.pulse()
+            else:
+                bar.set_fraction(job.fraction)
+            row.append(bar)
+
+        status = {
+            QUEUED: _("Waiting..."),
+            RUNNING: job.message or _("Running..."),
+            DONE: job.message or _("Finished"),
+            FAILED: _("Failed: {error}").format(error=job.error),
+            CANCELLED: _("Cancelled"),
+        }[job.state]
+        label = Gtk.Label(label=status, xalign=0, wrap=True, max_width_chars=40)
+        label.add_css_class("dim-label")
+        label.add_css_class("caption")
+        row.append(label)
+        return row
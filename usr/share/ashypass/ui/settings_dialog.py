@@ -4,10 +4,13 @@ gi.require_version('Adw', '1')
 from gi.repository import Gtk, Adw, GLib, Gio
 
 from core.backup_service import BackupService
-from core.csv_handler import CsvHandler
+from core.backup_backends import BACKEND_DRIVE, BACKEND_LOCAL, LocalDirectoryBackend
+from core.backup_generations import RetentionPolicy
+from core.config import DATA_DIR, MIN_MASTER_PASSWORD_LENGTH
 from core.database import Database
+from core.jobs import CANCELLED
 from utils.i18n import _
-import threading
+import time
 
 class SettingsDialog(Adw.PreferencesWindow):
     """Application Settings Window"""
@@ -21,19 +24,56 @@ class SettingsDialog(Adw.PreferencesWindow):
 
         self.backup_service = backup_service
         self.database = database
-        self.csv_handler = CsvHandler()
+        self.jobs = parent.jobs
 
         self._build_ui()
-        self._update_account_status()
+
+        # Listeners run on worker threads; hop to the GTK loop
+        self._queue_listener = lambda: GLib.idle_add(self._update_queue_status)
+        self._progress_listener = lambda sent, total: GLib.idle_add(self._update_upload_progress, sent, total)
+        # The saved token is loaded in the background and may arrive later
+        self._account_listener = lambda: GLib.idle_add(self._update_account_status)
+        self._attached = False
+
+        # The window keeps this dialog; closing hides it for the next time
+        self.set_hide_on_close(True)
+        self.connect("show", self._on_show)
+        self.connect("close-request", self._on_close_request)
         
     def _build_ui(self):
         # --- Cloud Sync Page ---
         page_cloud = Adw.PreferencesPage()
         page_cloud.set_title(_("Cloud Backup"))
         page_cloud.set_icon_name("folder-remote-symbolic")
+
+        # Target Group
+        group_target = Adw.PreferencesGroup()
+        group_target.set_title(_("Backup Target"))
+
+        self.row_backend = Adw.ComboRow()
+        self.row_backend.set_title(_("Save Backups To"))
+        self.row_backend.set_model(Gtk.StringList.new([_("Google Drive"), _("Local Folder")]))
+        self._backend_ids = [BACKEND_DRIVE, BACKEND_LOCAL]
+        current = self.backup_service.backend.name
+        if current in self._backend_ids:
+            self.row_backend.set_selected(self._backend_ids.index(current))
+        self.row_backend.connect("notify::selected", self._on_backend_changed)
+        group_target.add(self.row_backend)
+
+        # Local folder row
+        self.row_local_dir = Adw.ActionRow()
+        self.row_local_dir.set_title(_("Folder"))
+        btn_choose_dir = Gtk.Button(icon_name="folder-open-symbolic")
+        btn_choose_dir.set_valign(Gtk.Align.CENTER)
+        btn_choose_dir.add_css_class("flat")
+        btn_choose_dir.connect("clicked", self._on_choose_dir_clicked)
+        self.row_local_dir.add_suffix(btn_choose_dir)
+        group_target.add(self.row_local_dir)
+
+        page_cloud.add(group_target)
         
         # Account Group
-        group_account = Adw.PreferencesGroup()
+        self.group_account = group_account = Adw.PreferencesGroup()
         group_account.set_title(_("Google Account"))
         group_account.set_description(_("Sign in to automatically backup your encrypted database to Google Drive."))
         
@@ -77,7 +117,7 @@ class SettingsDialog(Adw.PreferencesWindow):
         
         self.row_backup_now = Adw.ActionRow()
         self.row_backup_now.set_title(_("Backup Now"))
-        self.row_backup_now.set_subtitle(_("Force a manual backup to Google Drive"))
+        self.row_backup_now.set_subtitle(_("Force a manual backup now"))
         
         btn_backup = Gtk.Button(icon_name="document-save-symbolic")
         btn_backup.set_valign(Gtk.Align.CENTER)
@@ -86,9 +126,68 @@ class SettingsDialog(Adw.PreferencesWindow):
         
         self.row_backup_now.add_suffix(btn_backup)
         group_actions.add(self.row_backup_now)
+
+        # Queue status rows
+        self.row_queue = Adw.ActionRow()
+        self.row_queue.set_title(_("Pending Backups"))
+        self.upload_progress = Gtk.ProgressBar()
+        self.upload_progress.set_valign(Gtk.Align.CENTER)
+        self.upload_progress.set_visible(False)
+        self.row_queue.add_suffix(self.upload_progress)
+        group_actions.add(self.row_queue)
+
+        self.row_last_backup = Adw.ActionRow()
+        self.row_last_backup.set_title(_("Last Successful Backup"))
+        group_actions.add(self.row_last_backup)
+
+        # Restore row
+        self.row_restore = Adw.ActionRow()
+        self.row_restore.set_title(_("Restore from Backup"))
+        self.row_restore.set_subtitle(_("Replace this vault with a saved backup"))
+        self.restore_progress = Gtk.ProgressBar()
+        self.restore_progress.set_valign(Gtk.Align.CENTER)
+        self.restore_progress.set_visible(False)
+        self.row_restore.add_suffix(self.restore_progress)
+        self.btn_restore = Gtk.Button(icon_name="document-revert-symbolic")
+        self.btn_restore.set_valign(Gtk.Align.CENTER)
+        self.btn_restore.add_css_class("flat")
+        self.btn_restore.connect("clicked", self._on_restore_clicked)
+        self.row_restore.add_suffix(self.btn_restore)
+        group_actions.add(self.row_restore)
         
         page_cloud.add(group_actions)
 
+        # Sync Group
+        group_sync = Adw.PreferencesGroup()
+        group_sync.set_title(_("Sync"))
+        group_sync.set_description(_("Devices join the sync group with the master password of the device that set it up, or its newest one if it was changed since."))
+
+        self.row_sync = Adw.SwitchRow(title=_("Sync Between Devices"))
+        self.row_sync.set_subtitle(_("Merge entries with other devices using the same backup target"))
+        self.row_sync.set_active(self.backup_service.sync_enabled)
+        self.row_sync.connect("notify::active", self._on_sync_changed)
+        group_sync.add(self.row_sync)
+
+        page_cloud.add(group_sync)
+
+        # Retention Group
+        group_retention = Adw.PreferencesGroup()
+        group_retention.set_title(_("Backup History"))
+        group_retention.set_description(_("Older backups are thinned out to one per hour, day and month."))
+
+        self.row_incremental = Adw.SwitchRow(title=_("Incremental Backups"))
+        self.row_incremental.set_subtitle(_("Upload only the parts of the vault that changed"))
+        self.row_incremental.set_active(self.backup_service.generations.incremental)
+        self.row_incremental.connect("notify::active", self._on_incremental_changed)
+        group_retention.add(self.row_incremental)
+
+        policy = self.backup_service.generations.policy
+        self.spin_hourly = self._create_retention_row(group_retention, _("Hourly Backups"), policy.hourly, 168)
+        self.spin_daily = self._create_retention_row(group_retention, _("Daily Backups"), policy.daily, 365)
+        self.spin_monthly = self._create_retention_row(group_retention, _("Monthly Backups"), policy.monthly, 120)
+
+        page_cloud.add(group_retention)
+
         self.add(page_cloud)
 
         # --- Import/Export Page ---
@@ -103,8 +202,8 @@ class SettingsDialog(Adw.PreferencesWindow):
 
         # Import Row
         row_import = Adw.ActionRow()
-        row_import.set_title(_("Import from CSV"))
-        row_import.set_subtitle(_("Import passwords from a CSV file"))
+        row_import.set_title(_("Import Passwords"))
+        row_import.set_subtitle(_("Import a CSV file or a Bitwarden, KeePass or 1Password export"))
 
         btn_import = Gtk.Button(icon_name="document-open-symbolic")
         btn_import.set_valign(Gtk.Align.CENTER)
@@ -131,40 +230,179 @@ class SettingsDialog(Adw.PreferencesWindow):
 
         self.add(page_import_export)
 
+        # --- Security Page ---
+        page_security = Adw.PreferencesPage()
+        page_security.set_title(_("Security"))
+        page_security.set_icon_name("channel-secure-symbolic")
+
+        group_master = Adw.PreferencesGroup()
+        group_master.set_title(_("Master Password"))
+        group_master.set_description(_("Entries are encrypted with a vault key that the master password unlocks, "
+                                       "so changing it is quick whatever the size of the vault."))
+
+        self.row_change_password = Adw.ActionRow()
+        self.row_change_password.set_title(_("Change Master Password"))
+        self.row_change_password.set_subtitle(_("Backups made before the change still need the old password"))
+
+        self.btn_change_password = Gtk.Button(icon_name="dialog-password-symbolic")
+        self.btn_change_password.set_valign(Gtk.Align.CENTER)
+        self.btn_change_password.add_css_class("flat")
+        self.btn_change_password.connect("clicked", self._on_change_password_clicked)
+        self.row_change_password.add_suffix(self.btn_change_password)
+
+        group_master.add(self.row_change_password)
+        page_security.add(group_master)
+
+        self.add(page_security)
+
+    def _create_retention_row(self, group, title: str, value: int, upper: int) -> Adw.SpinRow:
+        """Spin row for one retention bucket"""
+        row = Adw.SpinRow(title=title)
+        row.set_adjustment(Gtk.Adjustment(value=value, lower=0, upper=upper, step_increment=1))
+        row.connect("notify::value", self._on_retention_changed)
+        group.add(row)
+        return row
+
+    def _on_incremental_changed(self, row, *args):
+        """Toggle chunked incremental backups"""
+        self.backup_service.set_incremental(row.get_active())
+
+    def _on_sync_changed(self, row, *args):
+        """Toggle row-level sync with other devices"""
+        self.backup_service.set_sync_enabled(row.get_active())
+
+    def _on_retention_changed(self, *args):
+        """Save retention policy"""
+        self.backup_service.set_retention(RetentionPolicy(
+            hourly=int(self.spin_hourly.get_value()),
+            daily=int(self.spin_daily.get_value()),
+            monthly=int(self.spin_monthly.get_value()),
+        ))
+
     def _update_account_status(self):
-        """Update UI based on login state"""
+        """Update UI based on backup target and login state"""
         is_logged = self.backup_service.is_logged_in()
-        
+        uses_account = self.backup_service.uses_drive_account()
+        backend = self.backup_service.backend
+
+        self.group_account.set_visible(uses_account)
+        self.row_local_dir.set_visible(isinstance(backend, LocalDirectoryBackend))
+        if isinstance(backend, LocalDirectoryBackend):
+            self.row_local_dir.set_subtitle(GLib.markup_escape_text(str(backend.directory)))
+
         self.row_login.set_visible(not is_logged)
         self.row_logout.set_visible(is_logged)
         self.row_account.set_visible(is_logged)
-        self.row_backup_now.set_sensitive(is_logged)
+        self.row_backup_now.set_sensitive(self.backup_service.is_ready())
+        self.row_restore.set_sensitive(self.backup_service.is_ready())
         
         if is_logged:
             self.row_status.set_subtitle(_("Connected"))
-            # Try to fetch user info
-            try:
-                info = self.backup_service.get_user_info()
-                if info and 'email' in info:
-                    self.row_account.set_subtitle(info['email'])
-                    # Could also set avatar if we wanted to fetch the image
-            except:
+            # Cached; a background refresh calls back through the account listener
+            info = self.backup_service.get_cached_user_info()
+            if info and info.get('email'):
+                self.row_account.set_subtitle(info['email'])
+            elif self.backup_service.is_profile_loading():
+                self.row_account.set_subtitle(_("Loading..."))
+            else:
                 self.row_account.set_subtitle(_("Unknown User"))
         else:
             self.row_status.set_subtitle(_("Disconnected"))
 
+    def _update_queue_status(self):
+        """Show backup queue depth and last success time"""
+        queue = self.backup_service.queue
+        depth = queue.depth()
+
+        if depth == 0:
+            self.row_queue.set_subtitle(_("None"))
+        elif queue.is_busy():
+            self.row_queue.set_subtitle(_("{count} pending (uploading...)").format(count=depth))
+        elif queue.last_error:
+            self.row_queue.set_subtitle(_("{count} pending, will retry: {error}").format(
+                count=depth, error=GLib.markup_escape_text(queue.last_error)))
+        else:
+            self.row_queue.set_subtitle(_("{count} pending").format(count=depth))
+
+        if queue.last_success:
+            self.row_last_backup.set_subtitle(
+                time.strftime("%Y-%m-%d %H:%M", time.localtime(queue.last_success)))
+        else:
+            self.row_last_backup.set_subtitle(_("Never"))
+
+        if not queue.is_busy():
+            self.upload_progress.set_visible(False)
+        return False
+
+    def _update_upload_progress(self, sent, total):
+        """Show how much of the current backup has been uploaded"""
+        fraction = sent / total if total else 1.0
+        self.upload_progress.set_fraction(fraction)
+        self.upload_progress.set_visible(fraction < 1.0)
+        self.upload_progress.set_tooltip_text(_("{sent} of {total} MB uploaded").format(
+            sent=f"{sent / 1048576:.1f}", total=f"{total / 1048576:.1f}"))
+        return False
+
+    def _on_show(self, *args):
+        """Refresh state and follow the backup service while visible"""
+        self._update_account_status()
+        self._update_queue_status()
+        if self._attached:
+            return
+        self._attached = True
+        self.backup_service.queue.add_listener(self._queue_listener)
+        self.backup_service.add_progress_listener(self._progress_listener)
+        self.backup_service.add_account_listener(self._account_listener)
+
+    def _on_close_request(self, *args):
+        """Detach from the backup service while hidden"""
+        self._attached = False
+        self.backup_service.queue.remove_listener(self._queue_listener)
+        self.backup_service.remove_progress_listener(self._progress_listener)
+        self.backup_service.remove_account_listener(self._account_listener)
+        return False
+
+    def _on_backend_changed(self, row, *args):
+        """Switch backup target"""
+        kind = self._backend_ids[row.get_selected()]
+        if kind == self.backup_service.backend.name:
+            return
+        local_dir = None
+        if kind == BACKEND_LOCAL:
+            local_dir = str(DATA_DIR / "backups")
+            if isinstance(self.backup_service.backend, LocalDirectoryBackend):
+                local_dir = str(self.backup_service.backend.directory)
+            else:
+                (DATA_DIR / "backups").mkdir(parents=True, exist_ok=True)
+        self.backup_service.set_backend(kind, local_dir)
+        self._update_account_status()
+
+    def _on_choose_dir_clicked(self, btn):
+        """Pick the local backup folder"""
+        dialog = Gtk.FileDialog()
+        dialog.set_title(_("Select Backup Folder"))
+        dialog.select_folder(self, None, self._on_dir_selected)
+
+    def _on_dir_selected(self, dialog, result):
+        """Handle folder selection for local backups"""
+        try:
+            folder = dialog.select_folder_finish(result)
+            if folder:
+                self.backup_service.set_backend(BACKEND_LOCAL, folder.get_path())
+                self._update_account_status()
+        except Exception as e:
+            if "dismissed" not in str(e).lower():
+                self._show_error_dialog(_("Backup Folder"), str(e))
+
     def _on_login_clicked(self, btn):
         """Handle login"""
         self.btn_login.set_sensitive(False)
         self.btn_login.set_label(_("Waiting for browser..."))
         
-        def run_login():
-            success = self.backup_service.login()
-            GLib.idle_add(self._on_login_finished, success)
-            
-        thread = threading.Thread(target=run_login)
-        thread.daemon = True
-        thread.start()
+        # The browser flow cannot be interrupted, so the job has no cancel
+        self.jobs.submit(_("Signing in to Google"), lambda ctx: self.backup_service.login(),
+                         on_done=lambda job: self._on_login_finished(bool(job.result)),
+                         cancellable=False)
         
     def _on_login_finished(self, success):
         self.btn_login.set_sensitive(True)
@@ -198,25 +436,117 @@ class SettingsDialog(Adw.PreferencesWindow):
 
         self.backup_service.auto_backup()
 
+    def _on_restore_clicked(self, btn):
+        """List backups in the background, then ask which one to restore"""
+        self.btn_restore.set_sensitive(False)
+
+        self.jobs.submit(_("Listing backups"), lambda ctx: self.backup_service.list_backups(),
+                         on_done=self._on_backups_listed)
+
+    def _on_backups_listed(self, job):
+        self.btn_restore.set_sensitive(True)
+        if job.error:
+            self._show_error_dialog(_("Restore Failed"), job.error)
+            return
+        backups = job.result
+        if not backups:
+            self._show_info_dialog(_("Restore"), _("No backups found."))
+            return
+
+        labels = []
+        for backup in backups:
+            label = time.strftime("%Y-%m-%d %H:%M", time.localtime(backup['created']))
+            if backup.get('size'):
+                label += f"  ({backup['size'] / 1048576:.1f} MB)"
+            labels.append(label)
+
+        box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=12)
+        dropdown = Gtk.DropDown.new_from_strings(labels)
+        box.append(dropdown)
+        entry = Gtk.PasswordEntry()
+        entry.set_show_peek_icon(True)
+        entry.set_property("placeholder-text", _("Master password of the backup"))
+        box.append(entry)
+
+        dlg = Adw.AlertDialog()
+        dlg.set_heading(_("Restore Backup?"))
+        dlg.set_body(_("The current vault will be replaced. Entries added since the backup will be lost."))
+        dlg.set_extra_child(box)
+        dlg.add_response("cancel", _("Cancel"))
+        dlg.add_response("restore", _("Restore"))
+        dlg.set_response_appearance("restore", Adw.ResponseAppearance.DESTRUCTIVE)
+        dlg.set_default_response("cancel")
+
+        def on_response(dialog, response):
+            if response == "restore":
+                self._start_restore(backups[dropdown.get_selected()], entry.get_text())
+
+        dlg.connect("response", on_response)
+        dlg.present(self)
+
+    def _start_restore(self, backup, password):
+        """Download and verify a backup off the GTK thread; it is swapped in when done"""
+        self.btn_restore.set_sensitive(False)
+        self.restore_progress.set_fraction(0.0)
+        self.restore_progress.set_visible(True)
+
+        def work(ctx):
+            def on_download(done, total):
+                # Cancelling is only possible while downloading, before the vault is touched
+                ctx.check()
+                ctx.report(done / total if total else None,
+                           _("{done:.1f} of {total:.1f} MB downloaded").format(
+                               done=done / 1048576, total=total / 1048576))
+
+            return self.backup_service.stage_restore(backup, password, on_download)
+
+        self.jobs.submit(_("Restoring backup"), work, on_done=self._on_restore_finished,
+                         on_progress=lambda job: self.restore_progress.set_fraction(job.fraction or 0.0))
+
+    def _on_restore_finished(self, job):
+        self.btn_restore.set_sensitive(True)
+        self.restore_progress.set_visible(False)
+        if job.error:
+            self._show_error_dialog(_("Restore Failed"), job.error)
+            return
+        if job.state == CANCELLED:
+            if job.result is not None:
+                self.backup_service.discard_restore(job.result)
+            return
+
+        # The vault connection belongs to the GTK thread, so the swap happens here
+        try:
+            self.backup_service.install_restore(job.result, self.database)
+        except Exception as e:
+            self._show_error_dialog(_("Restore Failed"), str(e))
+            return
+
+        parent = self.get_transient_for()
+        if parent and hasattr(parent, 'show_toast'):
+            parent.show_toast(_("Backup restored"))
+        if parent and getattr(parent, 'vault_view', None):
+            parent.vault_view._load_passwords()
+
     def _on_import_clicked(self, btn):
         """Handle CSV import"""
         dialog = Gtk.FileDialog()
-        dialog.set_title(_("Select CSV File to Import"))
+        dialog.set_title(_("Select File to Import"))
 
-        # Set filter for CSV files
-        filter_csv = Gtk.FileFilter()
-        filter_csv.set_name(_("CSV Files"))
-        filter_csv.add_pattern("*.csv")
+        # CSV plus the exports of other password managers
+        filter_supported = Gtk.FileFilter()
+        filter_supported.set_name(_("Password Exports (Ashy Pass, CSV, Bitwarden, KeePass, 1Password)"))
+        for pattern in ("*.ashy", "*.csv", "*.json", "*.xml", "*.1pux"):
+            filter_supported.add_pattern(pattern)
 
         filter_all = Gtk.FileFilter()
         filter_all.set_name(_("All Files"))
         filter_all.add_pattern("*")
 
         filters = Gio.ListStore.new(Gtk.FileFilter)
-        filters.append(filter_csv)
+        filters.append(filter_supported)
         filters.append(filter_all)
         dialog.set_filters(filters)
-        dialog.set_default_filter(filter_csv)
+        dialog.set_default_filter(filter_supported)
 
         dialog.open(self, None, self._on_import_file_selected)
 
@@ -232,41 +562,10 @@ class SettingsDialog(Adw.PreferencesWindow):
                 self._show_error_dialog(_("Import Failed"), str(e))
 
     def _import_passwords(self, file_path: str):
-        """Import passwords from CSV file"""
-        try:
-            # Import CSV
-            entries = self.csv_handler.import_csv(file_path)
-
-            if not entries:
-                self._show_info_dialog(_("Import Complete"), _("No valid entries found in CSV file."))
-                return
-
-            # Add to database
-            count = 0
-            for entry in entries:
-                try:
-                    self.database.add_password(
-                        title=entry['title'],
-                        password=entry['password'],
-                        username=entry.get('username'),
-                        notes=entry.get('notes'),
-                        url=entry.get('url')
-                    )
-                    count += 1
-                except Exception as e:
-                    print(f"Error importing entry {entry.get('title')}: {e}")
-
-            # Show success message
-            parent = self.get_transient_for()
-            if parent and hasattr(parent, 'show_toast'):
-                parent.show_toast(_("Imported {count} passwords").format(count=count))
-
-            # Refresh vault view
-            if parent and hasattr(parent, 'vault_view'):
-                parent.vault_view._load_passwords()
-
-        except Exception as e:
-            self._show_error_dialog(_("Import Failed"), str(e))
+        """Import passwords from a CSV file or another password manager's export"""
+        parent = self.get_transient_for()
+        if parent and hasattr(parent, 'import_passwords_file'):
+            parent.import_passwords_file(file_path)
 
     def _on_export_clicked(self, btn):
         """Handle CSV export"""
@@ -294,27 +593,79 @@ class SettingsDialog(Adw.PreferencesWindow):
                 self._show_error_dialog(_("Export Failed"), str(e))
 
     def _export_passwords(self, file_path: str):
-        """Export passwords to CSV file"""
-        try:
-            # Get all passwords from database
-            passwords = self.database.get_passwords()
+        """Export passwords to CSV file as a background job of the main window"""
+        if not self.database.count_passwords():
+            self._show_info_dialog(_("Export Complete"), _("No passwords to export."))
+            return
+
+        parent = self.get_transient_for()
+        if parent and hasattr(parent, 'export_csv_file'):
+            parent.export_csv_file(file_path)
+
+    def _on_change_password_clicked(self, btn):
+        """Ask for the current and the new master password"""
+        box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=12)
+        entries = []
+        for placeholder in (_("Current master password"), _("New master password"), _("Confirm new password")):
+            entry = Gtk.PasswordEntry()
+            entry.set_show_peek_icon(True)
+            entry.set_property("placeholder-text", placeholder)
+            box.append(entry)
+            entries.append(entry)
+        current, new, confirm = entries
 
-            if not passwords:
-                self._show_info_dialog(_("Export Complete"), _("No passwords to export."))
+        dlg = Adw.AlertDialog()
+        dlg.set_heading(_("Change Master Password"))
+        dlg.set_extra_child(box)
+        dlg.add_response("cancel", _("Cancel"))
+        dlg.add_response("change", _("Change"))
+        dlg.set_response_appearance("change", Adw.ResponseAppearance.SUGGESTED)
+        dlg.set_default_response("change")
+
+        def on_response(dialog, response):
+            if response != "change":
                 return
+            if len(new.get_text()) < MIN_MASTER_PASSWORD_LENGTH:
+                self._show_error_dialog(_("Password Not Changed"), _("Password must be at least {min} characters").format(
+                    min=MIN_MASTER_PASSWORD_LENGTH))
+            elif new.get_text() != confirm.get_text():
+                self._show_error_dialog(_("Password Not Changed"), _("Passwords do not match"))
+            else:
+                self._change_master_password(current.get_text(), new.get_text())
 
-            # Export to CSV
-            success = self.csv_handler.export_csv(file_path, passwords)
+        dlg.connect("response", on_response)
+        dlg.present(self)
 
-            if success:
-                parent = self.get_transient_for()
-                if parent and hasattr(parent, 'show_toast'):
-                    parent.show_toast(_("Exported {count} passwords").format(count=len(passwords)))
-            else:
-                self._show_error_dialog(_("Export Failed"), _("Could not write to file."))
+    def _change_master_password(self, current: str, new: str):
+        """Re-wrap the vault key off the GTK thread; the KDF takes about a second"""
+        self.btn_change_password.set_sensitive(False)
 
-        except Exception as e:
-            self._show_error_dialog(_("Export Failed"), str(e))
+        def work(ctx):
+            worker_db = self.database.clone()
+            try:
+                # The unconnected handle carries the keys back to the GTK thread
+                return worker_db.change_master_password(current, new) and worker_db.clone(connect=False)
+            finally:
+                worker_db.close()
+
+        self.jobs.submit(_("Changing master password"), work, on_done=self._on_password_changed,
+                         cancellable=False)
+
+    def _on_password_changed(self, job):
+        self.btn_change_password.set_sensitive(True)
+        if job.error:
+            self._show_error_dialog(_("Password Not Changed"), job.error)
+        elif not job.result:
+            self._show_error_dialog(_("Password Not Changed"), _("Incorrect master password"))
+        else:
+            # The sync key may have changed with the password, e.g. by joining
+            # the sync group; the sync engine clones this handle
+            self.database.adopt_key(job.result)
+            # Written through another connection; lets the backup pick it up
+            self.database.notify_external_change()
+            parent = self.get_transient_for()
+            if parent and hasattr(parent, 'show_toast'):
+                parent.show_toast(_("Master password changed"))
 
     def _show_error_dialog(self, title: str, message: str):
         """Show error dialog"""
@@ -10,7 +10,6 @@ gi.require_version('Adw', '1')
 
 from gi.repository import Gtk, Adw, GLib, Gio
 from typing import Optional, Dict, Any
-import urllib.request
 import urllib.parse
 import hashlib
 import os
@@ -219,6 +218,9 @@ class VaultView(Adw.NavigationPage):
             if self.database.verify_master_password(password):
                 self.session.login()
                 self._update_view()
+                root = self.get_root()
+                if root and hasattr(root, 'on_vault_unlocked'):
+                    root.on_vault_unlocked()
             else:
                 self._show_auth_error(_("Incorrect master password"))
         else:
@@ -312,6 +314,16 @@ class VaultView(Adw.NavigationPage):
         copy_btn.connect("clicked", lambda _, pwd_id=pwd_data["id"]: self._copy_password(pwd_id))
         row.add_suffix(copy_btn)
 
+        # Copy username button
+        if pwd_data.get("username"):
+            username_btn = Gtk.Button()
+            username_btn.set_icon_name("avatar-default-symbolic")
+            username_btn.set_valign(Gtk.Align.CENTER)
+            username_btn.add_css_class("flat")
+            username_btn.set_tooltip_text(_("Copy Username"))
+            username_btn.connect("clicked", lambda _, pwd_id=pwd_data["id"]: self._copy_username(pwd_id))
+            row.add_suffix(username_btn)
+
         # Edit button
         edit_btn = Gtk.Button()
         edit_btn.set_icon_name("document-edit-symbolic")
@@ -327,7 +339,7 @@ class VaultView(Adw.NavigationPage):
         delete_btn.set_valign(Gtk.Align.CENTER)
         delete_btn.add_css_class("flat")
         delete_btn.set_tooltip_text(_("Delete"))
-        delete_btn.connect("clicked", lambda _, pwd_id=pwd_data["id"]: self._confirm_delete(pwd_id))
+        delete_btn.connect("clicked", lambda _, pwd_id=pwd_data["id"], title=pwd_data["title"]: self._confirm_delete(pwd_id, title))
         row.add_suffix(delete_btn)
         
         return row
@@ -340,10 +352,19 @@ class VaultView(Adw.NavigationPage):
     
     def _copy_password(self, password_id: int) -> None:
         """Copy password to clipboard"""
-        entry = self.database.get_password(password_id)
-        if entry:
-            self.clipboard.copy_text(entry["password"])
-            self.activate_action("app.show-toast", GLib.Variant.new_string(_("Password copied to clipboard")))
+        self._copy_field(password_id, "password", _("Password copied to clipboard"))
+
+    def _copy_username(self, password_id: int) -> None:
+        """Copy username to clipboard"""
+        self._copy_field(password_id, "username", _("Username copied to clipboard"))
+
+    def _copy_field(self, password_id: int, field: str, message: str) -> None:
+        """Copy one field of an entry, decrypting nothing else"""
+        secret = self.database.get_secret(password_id, field)
+        if secret is not None:
+            with secret:
+                self.clipboard.copy_secret(secret)
+            self.activate_action("app.show-toast", GLib.Variant.new_string(message))
             self.session.on_activity()
     
     def _show_add_dialog(self) -> None:
@@ -494,15 +515,11 @@ class VaultView(Adw.NavigationPage):
         dialog.connect("response", on_response)
         dialog.present(self.get_root())
     
-    def _confirm_delete(self, password_id: int) -> None:
+    def _confirm_delete(self, password_id: int, title: str) -> None:
         """Show delete confirmation dialog"""
-        entry = self.database.get_password(password_id)
-        if not entry:
-            return
-
         dialog = Adw.AlertDialog()
         dialog.set_heading(_("Delete Password?"))
-        dialog.set_body(_("Are you sure you want to delete '{title}'? This action cannot be undone.").format(title=entry['title']))
+        dialog.set_body(_("Are you sure you want to delete '{title}'? This action cannot be undone.").format(title=title))
         dialog.add_response("cancel", _("Cancel"))
         dialog.add_response("delete", _("Delete"))
         dialog.set_response_appearance("delete", Adw.ResponseAppearance.DESTRUCTIVE)
@@ -728,6 +745,7 @@ class VaultView(Adw.NavigationPage):
 
         # Download favicon
         try:
+            import urllib.request
             req = urllib.request.Request(favicon_url, headers={'User-Agent': 'Mozilla/5.0'})
             with urllib.request.urlopen(req, timeout=5) as response:
                 with open(cache_path, 'wb') as f:
@@ -762,6 +780,8 @@ class VaultView(Adw.NavigationPage):
         # Download in background thread
         def download_favicon():
             try:
+                # Pulls in http.client and ssl; only load it once a favicon is missing
+                import urllib.request
                 req = urllib.request.Request(favicon_url, headers={'User-Agent': 'Mozilla/5.0'})
                 with urllib.request.urlopen(req, timeout=5) as response:
                     with open(cache_path, 'wb') as f:
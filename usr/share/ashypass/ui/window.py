@@ -4,22 +4,25 @@ Ashy Pass - Main Window
 GTK4/libadwaita main application window with view switcher
 """
 
-import threading
+import os
+import functools
+from typing import Optional, Iterator, Dict, Any
 import gi
 gi.require_version('Gtk', '4.0')
 gi.require_version('Adw', '1')
 
-from gi.repository import Gtk, Adw, GLib, Gio, GObject
+from gi.repository import Gtk, Adw, GLib, Gio, GObject, Pango
 
-from core.config import WINDOW_DEFAULT_WIDTH, WINDOW_DEFAULT_HEIGHT, WINDOW_MIN_WIDTH, WINDOW_MIN_HEIGHT
+from core.config import WINDOW_DEFAULT_WIDTH, WINDOW_DEFAULT_HEIGHT, WINDOW_MIN_WIDTH, WINDOW_MIN_HEIGHT, SYNC_INTERVAL_SECONDS
 from core.database import Database
 from core.auth import SessionManager
-from core.csv_handler import CsvHandler
+from core.csv_handler import CsvHandler, CsvPreview, EntryReader, ImportProgress
 from core.backup_service import BackupService
+from core.jobs import JobRunner, JobContext, Job, CANCELLED
 from utils.i18n import _
+from ui.job_list import JobListButton
 from ui.generator_view import GeneratorView
 from ui.vault_view import VaultView
-from ui.settings_dialog import SettingsDialog
 
 
 class MainWindow(Adw.ApplicationWindow):
@@ -31,9 +34,29 @@ class MainWindow(Adw.ApplicationWindow):
         self.database = database
         self.session = SessionManager()
         self.backup_service = BackupService()
+        self._settings_dialog = None
+
+        # Long operations run as jobs; their callbacks arrive on the GTK loop
+        self.jobs = JobRunner(dispatch=GLib.idle_add)
+        # The backup queue has its own worker; mirror its jobs in the list
+        self._queue_job: Optional[JobContext] = None
+        self._queue_kind: Optional[str] = None
+        self._migration_job: Optional[Job] = None
+        self.backup_service.queue.add_listener(lambda: GLib.idle_add(self._on_backup_queue_changed))
+        self.backup_service.add_progress_listener(
+            lambda sent, total: GLib.idle_add(self._on_backup_progress, sent, total))
         
         # Connect auto-backup to database changes
         self.database.add_change_listener(self.backup_service.auto_backup)
+
+        # Pick up changes made on other devices
+        self.backup_service.attach_database(self.database)
+        self.backup_service.add_sync_listener(lambda applied: GLib.idle_add(self._on_sync_applied, applied))
+        GLib.timeout_add_seconds(SYNC_INTERVAL_SECONDS, self._on_sync_timer)
+
+        # Drain queued backups as soon as connectivity returns
+        self.network_monitor = Gio.NetworkMonitor.get_default()
+        self.network_monitor.connect("network-changed", self._on_network_changed)
         
         # Window properties
         self.set_title("Ashy Pass")
@@ -57,6 +80,11 @@ class MainWindow(Adw.ApplicationWindow):
         action_export.connect("activate", self.on_export_csv)
         self.add_action(action_export)
 
+        # Encrypted archive export
+        action_export_archive = Gio.SimpleAction.new("export_archive", None)
+        action_export_archive.connect("activate", self.on_export_archive)
+        self.add_action(action_export_archive)
+
         # Settings Action
         action_settings = Gio.SimpleAction.new("settings", None)
         action_settings.connect("activate", self.on_settings)
@@ -103,8 +131,9 @@ class MainWindow(Adw.ApplicationWindow):
         menu.append_section(None, section_main)
         
         section_csv = Gio.Menu()
-        section_csv.append(_("Import from Google CSV"), "win.import_csv")
+        section_csv.append(_("Import Passwords..."), "win.import_csv")
         section_csv.append(_("Export to CSV"), "win.export_csv")
+        section_csv.append(_("Export Encrypted Archive..."), "win.export_archive")
         menu.append_section(None, section_csv)
         
         section_app = Gio.Menu()
@@ -122,6 +151,8 @@ class MainWindow(Adw.ApplicationWindow):
         self.add_button.set_visible(False)
         header.pack_end(self.add_button)
 
+        header.pack_end(JobListButton(self.jobs))
+
         self.lock_button = Gtk.Button()
         self.lock_button.set_icon_name("system-lock-screen-symbolic")
         self.lock_button.set_tooltip_text(_("Lock Vault"))
@@ -134,30 +165,24 @@ class MainWindow(Adw.ApplicationWindow):
         self.view_stack = Adw.ViewStack()
         self.view_switcher_title.set_stack(self.view_stack)
         
-        # Generator view
-        self.generator_view = GeneratorView()
-        self.view_stack.add_titled_with_icon(
-            self.generator_view,
-            "generator",
-            _("Generator"),
-            "view-reveal-symbolic"
-        )
-
-        # Vault view
-        self.vault_view = VaultView(self.database, self.session)
-        self.view_stack.add_titled_with_icon(
-            self.vault_view,
-            "vault",
-            _("Vault"),
-            "dialog-password-symbolic"
-        )
+        # Pages are placeholders until first shown; the views are built then
+        self.generator_view: Optional[GeneratorView] = None
+        self.vault_view: Optional[VaultView] = None
+        self._view_bins = {}
+        for name, title, icon in (
+            ("generator", _("Generator"), "view-reveal-symbolic"),
+            ("vault", _("Vault"), "dialog-password-symbolic"),
+        ):
+            self._view_bins[name] = Adw.Bin()
+            self.view_stack.add_titled_with_icon(self._view_bins[name], name, title, icon)
 
         # Connect vault buttons
         self.add_button.connect("clicked", lambda _: self.vault_view._show_add_dialog())
         self.lock_button.connect("clicked", lambda _: self.vault_view._lock_vault())
 
-        # Connect stack notify to show/hide vault buttons
+        # Connect stack notify to build views and show/hide vault buttons
         self.view_stack.connect("notify::visible-child", self._on_view_changed)
+        self._ensure_view(self.view_stack.get_visible_child_name())
 
         toolbar_view.set_content(self.view_stack)
 
@@ -165,14 +190,87 @@ class MainWindow(Adw.ApplicationWindow):
         
         return page
     
+    def _ensure_view(self, name: Optional[str]) -> None:
+        """Build a page's view the first time it is shown"""
+        if name == "generator" and self.generator_view is None:
+            self.generator_view = GeneratorView()
+            self._view_bins[name].set_child(self.generator_view)
+        elif name == "vault" and self.vault_view is None:
+            self.vault_view = VaultView(self.database, self.session)
+            self._view_bins[name].set_child(self.vault_view)
+
     def _on_view_changed(self, stack, *args) -> None:
-        """Handle view change to show/hide vault buttons"""
+        """Handle view change to build the page and show/hide vault buttons"""
+        self._ensure_view(stack.get_visible_child_name())
         is_vault = stack.get_visible_child_name() == "vault"
         is_authenticated = self.session.is_authenticated()
 
         self.add_button.set_visible(is_vault and is_authenticated)
         self.lock_button.set_visible(is_vault and is_authenticated)
 
+    def on_vault_unlocked(self) -> None:
+        """Rewrite entries still in the legacy Fernet format, a batch at a time"""
+        if self._migration_job is not None and self._migration_job.active:
+            return
+        if not self.database.count_legacy_cells():
+            return
+
+        def work(ctx: JobContext) -> int:
+            worker_db = self.database.clone()
+            try:
+                total, done = worker_db.count_legacy_cells(), 0
+                # Each batch is committed, so a cancelled or interrupted
+                # upgrade continues from where it stopped on the next unlock
+                while True:
+                    ctx.check()
+                    count = worker_db.migrate_cells()
+                    if not count:
+                        return done
+                    done += count
+                    ctx.report(min(done / total, 1.0), _("{count} of {total} passwords upgraded").format(
+                        count=min(done, total), total=total))
+            finally:
+                worker_db.close()
+
+        self._migration_job = self.jobs.submit(_("Upgrading vault encryption"), work)
+
+    def _on_network_changed(self, monitor, available: bool) -> None:
+        """Retry pending backups when the network comes back"""
+        if available:
+            self.backup_service.queue.wake()
+
+    def _on_backup_queue_changed(self) -> bool:
+        """Start or end the job-list entry for the backup queue's running job"""
+        kind = self.backup_service.queue.running_kind()
+        if kind == self._queue_kind:
+            return False
+        if self._queue_job is not None:
+            self._queue_job.finish(error=self.backup_service.queue.last_error)
+            self._queue_job = None
+        self._queue_kind = kind
+        if kind is not None:
+            self._queue_job = self.jobs.track(
+                _("Backing up vault") if kind == 'backup' else _("Syncing with other devices"))
+        return False
+
+    def _on_backup_progress(self, sent: int, total: int) -> bool:
+        if self._queue_job is not None and total:
+            self._queue_job.report(sent / total, _("{sent:.1f} of {total:.1f} MB uploaded").format(
+                sent=sent / 1048576, total=total / 1048576))
+        return False
+
+    def _on_sync_timer(self) -> bool:
+        """Periodically fetch changes from other devices"""
+        self.backup_service.request_sync()
+        return True
+
+    def _on_sync_applied(self, applied: int) -> bool:
+        """Refresh the vault after merging changes from other devices"""
+        if self.vault_view and self.session.is_authenticated():
+            self.vault_view._load_passwords()
+        self.show_toast(_("Synced {count} changes from other devices").format(count=applied))
+        return False
+
     def show_toast(self, message: str) -> None:
         """Show a toast notification"""
         toast = Adw.Toast.new(message)
@@ -193,36 +291,185 @@ class MainWindow(Adw.ApplicationWindow):
             action=Gtk.FileChooserAction.OPEN
         )
         
-        filter_csv = Gtk.FileFilter()
-        filter_csv.set_name("CSV Files")
-        filter_csv.add_pattern("*.csv")
-        chooser.add_filter(filter_csv)
+        filter_supported = Gtk.FileFilter()
+        filter_supported.set_name(_("Password Exports (Ashy Pass, CSV, Bitwarden, KeePass, 1Password)"))
+        for pattern in ("*.ashy", "*.csv", "*.json", "*.xml", "*.1pux"):
+            filter_supported.add_pattern(pattern)
+        chooser.add_filter(filter_supported)
         
         def on_response(dialog, response):
             if response == Gtk.ResponseType.ACCEPT:
-                file_path = dialog.get_file().get_path()
-                try:
-                    entries = CsvHandler.import_csv(file_path)
-                    count = 0
-                    for entry in entries:
-                        self.database.add_password(
-                            title=entry['title'],
-                            password=entry['password'],
-                            username=entry['username'],
-                            url=entry['url'],
-                            notes=entry['notes']
-                        )
-                        count += 1
-                    
-                    self.show_toast(_("Imported {count} passwords").format(count=count))
-                    self.vault_view._load_passwords()
-                except Exception as e:
-                    self.show_toast(_("Error importing CSV: {error}").format(error=str(e)))
+                self.import_passwords_file(dialog.get_file().get_path())
             dialog.destroy()
             
         chooser.connect("response", on_response)
         chooser.show()
 
+    def import_passwords_file(self, file_path: str) -> None:
+        """
+        Import a CSV file or a Bitwarden, KeePass or 1Password export. CSV
+        files are sniffed first and a preview of the mapped rows is shown
+        before anything is written.
+        """
+        from core.importers import detect_format, get_reader
+
+        try:
+            kind = detect_format(file_path)
+            if kind == 'ashy':
+                self._ask_passphrase(_("Import Encrypted Archive"), _("Enter the passphrase of this archive."),
+                                     False, lambda passphrase: self._import_archive(file_path, passphrase))
+                return
+            if kind != 'csv':
+                self._run_import(file_path, get_reader(file_path))
+                return
+            preview = CsvHandler.preview(file_path)
+        except (OSError, ValueError) as e:
+            self.show_toast(_("Error importing passwords: {error}").format(error=str(e)))
+            return
+        self._confirm_csv_import(file_path, preview)
+
+    def _import_archive(self, file_path: str, passphrase: str) -> None:
+        """
+        Stream the archive into the vault. The passphrase is checked in the
+        job, when the reader opens the archive, so the key derivation never
+        blocks the GTK thread; a wrong one fails the job with ArchiveError.
+        """
+        from core.vault_archive import iter_archive
+
+        self._run_import(file_path, functools.partial(iter_archive, passphrase=passphrase))
+
+    def _ask_passphrase(self, heading: str, body: str, confirm: bool, on_done) -> None:
+        """Ask for an archive passphrase, twice when confirm is set, and pass it to on_done"""
+        box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
+        entry = Gtk.PasswordEntry(show_peek_icon=True)
+        entry.set_property("placeholder-text", _("Passphrase"))
+        box.append(entry)
+        repeat = None
+        if confirm:
+            repeat = Gtk.PasswordEntry(show_peek_icon=True)
+            repeat.set_property("placeholder-text", _("Repeat passphrase"))
+            box.append(repeat)
+
+        dlg = Adw.AlertDialog()
+        dlg.set_heading(heading)
+        dlg.set_body(body)
+        dlg.set_extra_child(box)
+        dlg.add_response("cancel", _("Cancel"))
+        dlg.add_response("ok", _("Continue"))
+        dlg.set_response_appearance("ok", Adw.ResponseAppearance.SUGGESTED)
+        dlg.set_response_enabled("ok", False)
+
+        def on_changed(*args):
+            text = entry.get_text()
+            dlg.set_response_enabled("ok", bool(text) and (repeat is None or repeat.get_text() == text))
+
+        entry.connect("changed", on_changed)
+        if repeat is not None:
+            repeat.connect("changed", on_changed)
+
+        def on_response(dialog, response):
+            if response == "ok":
+                on_done(entry.get_text())
+
+        dlg.connect("response", on_response)
+        dlg.present(self)
+
+    def _confirm_csv_import(self, file_path: str, preview: CsvPreview) -> None:
+        """Show the detected CSV format and the first mapped rows; import on confirm"""
+        fmt = preview.format
+        delimiter = {'\t': _("tab"), ' ': _("space")}.get(fmt.delimiter, f"\"{fmt.delimiter}\"")
+        header = _("header row") if fmt.has_header else _("no header row, Chrome column order")
+
+        grid = Gtk.Grid(column_spacing=12, row_spacing=6)
+        columns = [('title', _("Title")), ('username', _("Username")), ('url', _("URL")), ('password', _("Password"))]
+        for col, (field, label) in enumerate(columns):
+            title = Gtk.Label(label=label, xalign=0)
+            title.add_css_class("heading")
+            grid.attach(title, col, 0, 1, 1)
+            for row, entry in enumerate(preview.entries, start=1):
+                # Never show imported passwords, only whether there is one
+                text = ("\u2022" * 8 if entry[field] else "") if field == 'password' else entry[field]
+                cell = Gtk.Label(label=text, xalign=0, max_width_chars=24,
+                                 ellipsize=Pango.EllipsizeMode.END)
+                grid.attach(cell, col, row, 1, 1)
+
+        dlg = Adw.AlertDialog()
+        dlg.set_heading(_("Import Passwords"))
+        dlg.set_body(_("Detected {encoding}, {delimiter} delimited, {header}.").format(
+            encoding=fmt.encoding.upper(), delimiter=delimiter, header=header)
+            if preview.entries else _("No passwords found at the start of this file."))
+        dlg.set_extra_child(grid)
+        dlg.add_response("cancel", _("Cancel"))
+        dlg.add_response("import", _("Import"))
+        dlg.set_response_appearance("import", Adw.ResponseAppearance.SUGGESTED)
+        dlg.set_response_enabled("import", bool(preview.entries))
+
+        def on_response(dialog, response):
+            if response == "import":
+                self._run_import(file_path, functools.partial(CsvHandler.iter_csv, fmt=fmt))
+
+        dlg.connect("response", on_response)
+        dlg.present(self)
+
+    def _run_import(self, file_path: str, reader: EntryReader) -> None:
+        """Stream entries from reader into the vault as a background job, with a progress dialog"""
+        progress_bar = Gtk.ProgressBar()
+        progress_bar.set_show_text(True)
+        dlg = Adw.AlertDialog()
+        dlg.set_heading(_("Importing Passwords"))
+        dlg.set_body(_("Reading file..."))
+        dlg.set_extra_child(progress_bar)
+        dlg.add_response("cancel", _("Cancel"))
+        dlg.add_response("background", _("Run in Background"))
+        dlg.set_close_response("background")
+
+        def work(ctx: JobContext) -> ImportProgress:
+            def on_progress(state: ImportProgress) -> None:
+                ctx.report(state.fraction, _("{count} passwords read ({rate} per second)").format(
+                    count=state.rows, rate=int(state.rows_per_second)))
+
+            worker_db = self.database.clone()
+            try:
+                return CsvHandler.import_into_database(worker_db, file_path, progress=on_progress,
+                                                       cancel=ctx.token, reader=reader)
+            finally:
+                worker_db.close()
+
+        def on_progress(job: Job) -> None:
+            progress_bar.set_fraction(job.fraction or 0.0)
+            dlg.set_body(job.message)
+
+        def on_done(job: Job) -> None:
+            dlg.force_close()
+            # Rows were written through a separate connection
+            self.database.notify_external_change()
+            if self.vault_view:
+                self.vault_view._load_passwords()
+            state = job.result
+            if job.error:
+                self.show_toast(_("Error importing passwords: {error}").format(error=job.error))
+            elif state is None or state.cancelled:
+                self.show_toast(_("Import cancelled after {count} passwords").format(
+                    count=state.rows if state else 0))
+            else:
+                self.show_toast(_("Imported {added} new, {updated} updated, {skipped} unchanged").format(
+                    added=state.added, updated=state.updated, skipped=state.skipped))
+
+        job = self.jobs.submit(_("Import {name}").format(name=os.path.basename(file_path)), work,
+                               on_done=on_done, on_progress=on_progress)
+        dlg.connect("response", lambda dialog, response: job.cancel() if response == "cancel" else None)
+        dlg.present(self)
+
+    def _export_entries(self, ctx: JobContext, database: Database,
+                        secrets: bool = False) -> Iterator[Dict[str, Any]]:
+        """Decrypted entries for an export job, reporting progress and honouring cancel"""
+        total = database.count_passwords()
+        for count, entry in enumerate(database.iter_decrypted_passwords(secrets=secrets), start=1):
+            ctx.check()
+            ctx.report(count / total if total else 1.0,
+                       _("{count} of {total} passwords written").format(count=count, total=total))
+            yield entry
+
     def on_export_csv(self, action, param):
         """Handle Export CSV action"""
         if not self.session.is_authenticated():
@@ -243,27 +490,80 @@ class MainWindow(Adw.ApplicationWindow):
         
         def on_response(dialog, response):
             if response == Gtk.ResponseType.ACCEPT:
-                file_path = dialog.get_file().get_path()
-                
-                # Fetch all passwords (decrypted)
-                passwords_list = self.database.get_passwords()
-                decrypted_passwords = []
-                
-                for p in passwords_list:
-                    full_entry = self.database.get_password(p['id'])
-                    if full_entry:
-                        decrypted_passwords.append(full_entry)
-                
-                if CsvHandler.export_csv(file_path, decrypted_passwords):
-                    self.show_toast(_("Passwords exported successfully"))
-                else:
-                    self.show_toast(_("Error exporting passwords"))
+                self.export_csv_file(dialog.get_file().get_path())
             dialog.destroy()
             
         chooser.connect("response", on_response)
         chooser.show()
 
+    def export_csv_file(self, file_path: str) -> None:
+        """Write the vault to a CSV file as a background job"""
+        def work(ctx: JobContext) -> int:
+            worker_db = self.database.clone()
+            try:
+                # Passwords and notes stay in locked memory until written
+                entries = self._export_entries(ctx, worker_db, secrets=True)
+                ok = CsvHandler.export_csv(file_path, entries)
+                ctx.check()
+                if not ok:
+                    raise OSError(_("Could not write to file."))
+                return worker_db.count_passwords()
+            finally:
+                worker_db.close()
+
+        self.jobs.submit(_("Export {name}").format(name=os.path.basename(file_path)), work,
+                         on_done=self._on_export_done)
+
+    def _on_export_done(self, job: Job) -> None:
+        if job.error:
+            self.show_toast(_("Error exporting passwords: {error}").format(error=job.error))
+        elif job.state == CANCELLED:
+            self.show_toast(_("Export cancelled"))
+        else:
+            self.show_toast(_("Exported {count} passwords").format(count=job.result))
+
+    def on_export_archive(self, action, param):
+        """Export the vault to a passphrase-protected .ashy archive"""
+        if not self.session.is_authenticated():
+            self.show_toast(_("Please unlock the vault first"))
+            return
+
+        chooser = Gtk.FileChooserNative(
+            title=_("Export Encrypted Archive"),
+            transient_for=self,
+            action=Gtk.FileChooserAction.SAVE
+        )
+        chooser.set_current_name("ashypass_export.ashy")
+
+        def on_response(dialog, response):
+            if response == Gtk.ResponseType.ACCEPT:
+                file_path = dialog.get_file().get_path()
+                self._ask_passphrase(_("Export Encrypted Archive"),
+                                     _("Choose a passphrase. It is needed to import the archive."),
+                                     True, lambda passphrase: self._export_archive(file_path, passphrase))
+            dialog.destroy()
+
+        chooser.connect("response", on_response)
+        chooser.show()
+
+    def _export_archive(self, file_path: str, passphrase: str) -> None:
+        """Write the archive as a background job"""
+        def work(ctx: JobContext) -> int:
+            from core.vault_archive import export_archive
+
+            worker_db = self.database.clone()
+            try:
+                return export_archive(file_path, self._export_entries(ctx, worker_db), passphrase)
+            finally:
+                worker_db.close()
+
+        self.jobs.submit(_("Export {name}").format(name=os.path.basename(file_path)), work,
+                         on_done=self._on_export_done)
+
     def on_settings(self, action, param):
         """Open settings dialog"""
-        dialog = SettingsDialog(self, self.backup_service, self.database)
-        dialog.present()
+        # Built on first use and kept; closing only hides it
+        if self._settings_dialog is None:
+            from ui.settings_dialog import SettingsDialog
+            self._settings_dialog = SettingsDialog(self, self.backup_service, self.database)
+        self._settings_dialog.present()
@@ -5,6 +5,9 @@ from typing import Optional
 from gi.repository import Gdk, GLib
 
 from core.config import CLIPBOARD_CLEAR_SECONDS
+from core.secret_buffer import SecretBuffer
+
+_TEXT_TYPES = ("text/plain;charset=utf-8", "text/plain", "UTF8_STRING")
 
 
 class ClipboardManager:
@@ -17,14 +20,32 @@ class ClipboardManager:
     
     def copy_text(self, text: str, auto_clear: bool = True, timeout: int = CLIPBOARD_CLEAR_SECONDS) -> None:
         """Copy text to clipboard"""
-        if self._clear_timeout_id is not None:
-            GLib.source_remove(self._clear_timeout_id)
-            self._clear_timeout_id = None
+        self.cancel_auto_clear()
         
         self.clipboard.set(text)
         
         if auto_clear:
             self._clear_timeout_id = GLib.timeout_add_seconds(timeout, self._clear_clipboard)
+
+    def copy_secret(self, secret: SecretBuffer, auto_clear: bool = True,
+                    timeout: int = CLIPBOARD_CLEAR_SECONDS) -> None:
+        """
+        Copy a secret from its buffer's memoryview; GTK gets its own copy
+        of the bytes, but no Python string is made. The buffer can be
+        closed right after.
+        """
+        self.cancel_auto_clear()
+
+        view = secret.view()
+        try:
+            data = GLib.Bytes.new(view)
+        finally:
+            view.release()
+        self.clipboard.set_content(Gdk.ContentProvider.new_union(
+            [Gdk.ContentProvider.new_for_bytes(mime_type, data) for mime_type in _TEXT_TYPES]))
+
+        if auto_clear:
+            self._clear_timeout_id = GLib.timeout_add_seconds(timeout, self._clear_clipboard)
     
     def _clear_clipboard(self) -> bool:
         """Clear clipboard contents"""
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Ashy Pass - Crypto Benchmark - How bulk encryption scales with cores
+Run
+
+    python -m utils.crypto_benchmark [values]
+
+from the application directory to encrypt and decrypt a batch of
+password-sized values in the current cell format and the legacy Fernet
+format, with 1, 2, 4, ... worker threads up to the CPU count, and print
+throughput, stored size and speed-up over a single thread.
+"""
+
+import base64
+import os
+import sys
+import time
+from typing import Callable, List
+
+from core.bulk_crypto import BulkCrypto, Cipher, default_workers
+from core.cell_crypto import CellCipher
+
+
+def _worker_counts() -> List[int]:
+    """1, 2, 4, ... up to the CPU count, which is always included"""
+    cpus = default_workers()
+    counts, n = [], 1
+    while n < cpus:
+        counts.append(n)
+        n *= 2
+    counts.append(cpus)
+    return counts
+
+
+def _best_of(runs: int, func: Callable[[], object]) -> float:
+    """Fastest of several runs, in seconds"""
+    best = float('inf')
+    for _ in range(runs):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def _run(name: str, cipher: Cipher, values: List[str]) -> None:
+    count = len(values)
+    tokens = BulkCrypto(cipher, workers=1).encrypt_many(values)
+    stored = sum(len(token) for token in tokens) / count
+
+    print(f"\n{name}: {stored:.0f} bytes stored per value")
+    print(f"{'threads':>7}  {'encrypt/s':>10}  {'decrypt/s':>10}  {'speed-up':>8}")
+    baseline = None
+    for workers in _worker_counts():
+        engine = BulkCrypto(cipher, workers=workers)
+        try:
+            encrypt = _best_of(3, lambda: engine.encrypt_many(values))
+            decrypt = _best_of(3, lambda: engine.decrypt_many(tokens))
+        finally:
+            engine.close()
+        total = encrypt + decrypt
+        baseline = baseline or total
+        print(f"{workers:>7}  {count / encrypt:>10.0f}  {count / decrypt:>10.0f}  {baseline / total:>7.2f}x")
+
+
+def main() -> int:
+    from cryptography.fernet import Fernet
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    key = os.urandom(32)
+    values = [os.urandom(12).hex() for _ in range(count)]
+
+    print(f"{count} values, {default_workers()} CPUs available")
+    _run("AES-GCM cells", CellCipher(key), values)
+    _run("Fernet (legacy)", Fernet(base64.urlsafe_b64encode(key)), values)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
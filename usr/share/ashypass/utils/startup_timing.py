@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Ashy Pass - Startup Timing - Where launch time goes
+
+Set ASHYPASS_STARTUP_TIMING=1 to print the time of each startup phase
+and of the first painted frame to stderr. Run
+
+    python -m utils.startup_timing [runs]
+
+from the application directory to launch the app under -X importtime,
+close it after its first frame, and report the slowest imports along
+with the wall-clock time from process spawn to first frame.
+"""
+
+import os
+import sys
+import time
+from typing import Dict, List, Tuple
+
+# Reference point: the moment main.py imports this module
+_START = time.perf_counter()
+
+ENABLED = os.environ.get('ASHYPASS_STARTUP_TIMING') == '1'
+EXIT_AFTER_FIRST_FRAME = os.environ.get('ASHYPASS_STARTUP_EXIT') == '1'
+FIRST_FRAME_MARKER = 'ashypass-first-frame'
+
+_marks: List[Tuple[str, float]] = []
+
+
+def mark(label: str) -> None:
+    """Record that a startup phase has finished"""
+    if ENABLED:
+        _marks.append((label, time.perf_counter() - _START))
+
+
+def watch_first_frame(window, app=None) -> None:
+    """Print the startup report once the window has painted its first frame"""
+    if not ENABLED:
+        return
+
+    def on_after_paint(frame_clock):
+        frame_clock.disconnect(handler[0])
+        mark('first frame')
+        for label, seconds in _marks:
+            print(f"startup: {seconds * 1000:8.1f} ms  {label}", file=sys.stderr)
+        print(f"{FIRST_FRAME_MARKER} {time.time():.6f}", file=sys.stderr, flush=True)
+        if EXIT_AFTER_FIRST_FRAME and app is not None:
+            app.quit()
+
+    handler = []
+
+    def on_tick(widget, frame_clock):
+        handler.append(frame_clock.connect('after-paint', on_after_paint))
+        return False
+
+    window.add_tick_callback(on_tick)
+
+
+def _parse_importtime(lines: List[str]) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """Self time per top-level package and cumulative time per module, in µs"""
+    by_package: Dict[str, int] = {}
+    cumulative: Dict[str, int] = {}
+    for line in lines:
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        module = module.strip()
+        package = module.split('.')[0]
+        by_package[package] = by_package.get(package, 0) + int(self_us)
+        cumulative[module] = int(cumulative_us)
+    return by_package, cumulative
+
+
+def _run_once() -> Tuple[float, List[str]]:
+    """Launch the app once; returns seconds to first frame and stderr lines"""
+    import subprocess
+
+    env = dict(os.environ, ASHYPASS_STARTUP_TIMING='1', ASHYPASS_STARTUP_EXIT='1')
+    app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    spawned = time.time()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', 'main.py'], cwd=app_dir, env=env,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, timeout=120)
+    lines = proc.stderr.splitlines()
+    for line in lines:
+        if line.startswith(FIRST_FRAME_MARKER):
+            return float(line.split()[1]) - spawned, lines
+    raise RuntimeError("The application exited without drawing a frame")
+
+
+def main() -> int:
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    results = [_run_once() for _ in range(runs)]
+    first_frames = sorted(seconds for seconds, _ in results)
+    lines = results[0][1]
+
+    print("Startup phases (first run):")
+    for line in lines:
+        if line.startswith('startup:'):
+            print('  ' + line[len('startup:'):].strip())
+
+    by_package, cumulative = _parse_importtime(lines)
+    print("\nImport self time by top-level package:")
+    for package, us in sorted(by_package.items(), key=lambda item: -item[1])[:15]:
+        print(f"  {us / 1000:8.1f} ms  {package}")
+
+    print("\nCumulative import time of application modules:")
+    own = {m: us for m, us in cumulative.items() if m.split('.')[0] in ('core', 'ui', 'utils')}
+    for module, us in sorted(own.items(), key=lambda item: -item[1])[:15]:
+        print(f"  {us / 1000:8.1f} ms  {module}")
+
+    print(f"\nSpawn to first frame over {runs} runs: "
+          f"min {first_frames[0] * 1000:.0f} ms, median {first_frames[len(first_frames) // 2] * 1000:.0f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())